@@ -14,7 +14,8 @@ Basic Echobot example, repeats messages.
 Press Ctrl-C on the command line or send a signal to the process to stop the
 app.
 """
-import asyncio
+from contextlib import asynccontextmanager
+from functools import partial
 from urllib.parse import urljoin
 
 import sentry_sdk
@@ -23,14 +24,18 @@ from fastapi import FastAPI, HTTPException
 from fastapi.exception_handlers import http_exception_handler
 from sentry_sdk.integrations.fastapi import FastApiIntegration
 from sentry_sdk.integrations.httpx import HttpxIntegration
-from starlette.requests import Request
-from starlette.responses import Response
 from telegram import Update
 
 from app.routers import api_router, webhook_router
-from .bot import application, setup_commands
+from .bot import application, setup_commands, telegram_updates
 from .config import settings
 from .containers import Container
+from .handlers.telegram import BroadcastJobs, receipt_checks
+from .handlers.telegram_bot import bookkeeping
+from .libs.logger import logger
+from .libs.http_client import http_client
+from .libs.database import RedisPool
+from .providers import ExchaigeAssistantProvider, exchaige_assistant_outbox, vendor_directory
 
 sentry_sdk.init(
     dsn=settings.SENTRY_URL,
@@ -74,17 +79,48 @@ def setup_middlewares(webapi_app: FastAPI):
     # )
 
 
+@asynccontextmanager
+async def lifespan(fastapi_app: FastAPI):
+    """
+    Application lifespan, open the container's resources (bot, Redis pool), start the outbox, warm the vendor directory
+    and resume the broadcast jobs on startup, release the long-lived resources on shutdown
+    :param fastapi_app:
+    :return:
+    """
+    container: Container = fastapi_app.container
+    await container.init_resources()
+    redis_pool: RedisPool = await container.redis_pool()
+    exchaige_assistant_outbox.start(redis_pool.create())
+    application.set_update_claim(partial(telegram_updates.claim, redis_pool.create()))
+    vendor_directory.start()
+    try:
+        broadcast_jobs: BroadcastJobs = await container.broadcast_jobs()
+        await broadcast_jobs.resume()
+    except Exception as exc:
+        logger.exception(exc)
+    yield
+    await BroadcastJobs.stop()
+    await vendor_directory.stop()
+    await bookkeeping.stop()
+    await receipt_checks.stop()
+    await exchaige_assistant_outbox.stop()
+    await ExchaigeAssistantProvider.flush_account_writes()
+    await container.shutdown_resources()
+    await http_client.aclose()
+
+
 def get_application() -> FastAPI:
     """
     Get application
     :return:
     """
-    fastapi_app = FastAPI()
+    fastapi_app = FastAPI(lifespan=lifespan)
     if not settings.IS_DEV:
         fastapi_app = FastAPI(
             docs_url="/swagger/api/documents",
             openapi_url="/open_api/documents/openapi.json",
             redoc_url=None,
+            lifespan=lifespan,
         )
     # set container
     container = Container()
@@ -107,28 +143,12 @@ async def run_application():
     await application.bot.set_webhook(
         url=urljoin(base=settings.BASE_URL, url=TELEGRAM_WEBHOOK_PATH),
         allowed_updates=Update.ALL_TYPES,
+        secret_token=settings.TELEGRAM_WEBHOOK_SECRET_TOKEN or None,
         pool_timeout=5
     )
 
     web_application = get_application()
 
-    @web_application.middleware("http")
-    async def http_middleware_handler(request: Request, callback):
-        """
-
-        :param request:
-        :param callback:
-        :return:
-        """
-        try:
-            response: Response = await callback(request)
-            if not settings.IS_DEV:
-                await asyncio.sleep(1.5)
-            return response
-        finally:
-            container: Container = request.app.container
-            container.reset_singletons()
-
     @web_application.exception_handler(HTTPException)
     async def root_http_exception_handler(request, exc: HTTPException):
         """
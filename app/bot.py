@@ -1,7 +1,9 @@
 """
 Telegram bot application
 """
-from telegram import BotCommandScopeAllGroupChats, Bot
+from typing import Optional
+
+from telegram import BotCommandScopeAllGroupChats, Bot, Update
 from telegram.ext import (
     ContextTypes,
     Application,
@@ -21,11 +23,52 @@ from app.libs.consts.bot_commands import (
     PROVIDE_EXCHANGE_RATE,
     PAYMENT_ACCOUNT_STATUS
 )
+from app.libs.telegram import (
+    LazyUpdateApplication,
+    PriorityUpdateQueue,
+    RawUpdate,
+    UpdateDeduplicator,
+    UpdatePriority,
+    shared_bot
+)
 
-__all__ = ["application"]
+__all__ = ["application", "telegram_updates", "update_queue"]
 
 _context_types = ContextTypes(context=CustomContext)
 
+# the callback queries of the payment flows
+PAYMENT_CALLBACKS = ("CONFIRM_PAY", "PROVIDE_PA", "OUT_OF_STOCK", "PA_STATUS")
+
+
+def update_priority(update: object) -> Optional[UpdatePriority]:
+    """
+    The class of a queued update: the payment callbacks first, then the other callbacks, the commands and
+    the replies to the bot (the flows), then the membership updates, never shed: a lost one leaves a chat
+    or a vendor untracked, and the group chatter last
+    :param update:
+    :return:
+    """
+    if isinstance(update, RawUpdate):
+        data = update.data
+    elif isinstance(update, Update):
+        data = update.to_dict()
+    else:
+        return None
+    callback_query = data.get("callback_query")
+    if callback_query is not None:
+        if str(callback_query.get("data") or "").startswith(PAYMENT_CALLBACKS):
+            return UpdatePriority.PAYMENT
+        return UpdatePriority.FLOW
+    if data.get("my_chat_member") is not None or data.get("chat_member") is not None:
+        return UpdatePriority.MEMBERSHIP
+    message = data.get("message") or data.get("edited_message") or {}
+    if message.get("new_chat_members") or message.get("left_chat_member"):
+        return UpdatePriority.MEMBERSHIP
+    reply_to_message = message.get("reply_to_message") or {}
+    if (message.get("text") or "").startswith("/") or (reply_to_message.get("from") or {}).get("is_bot"):
+        return UpdatePriority.FLOW
+    return UpdatePriority.LOW
+
 
 async def setup_commands(tg_application: Application) -> None:
     """
@@ -43,13 +86,32 @@ async def setup_commands(tg_application: Application) -> None:
     )
 
 
+update_queue = PriorityUpdateQueue(
+    name=settings.APP_NAME,
+    capacity=settings.TELEGRAM_UPDATE_QUEUE_SIZE,
+    priority=update_priority
+)
+
 application = (
     ApplicationBuilder()
-    .token(settings.TELEGRAM_BOT_TOKEN)
+    # the webhook queues the raw updates, they are parsed when processed
+    .application_class(LazyUpdateApplication)
+    # the payment callbacks go first, the chatter is shed under a burst
+    .update_queue(update_queue)
+    # the bot the API handlers send with too, its rate limiter paces the outbound sends
+    .bot(shared_bot)
     .context_types(_context_types)
     .build()
 )
 
+# the updates received, the ones Telegram delivers again are dropped:
+# by the webhook when this instance saw them, by the application when Redis did
+telegram_updates = UpdateDeduplicator(
+    name=settings.APP_NAME,
+    window=settings.TELEGRAM_UPDATE_DEDUP_WINDOW,
+    ttl=settings.TELEGRAM_UPDATE_DEDUP_TTL
+)
+
 # register handlers
 if settings.IS_DEV:
     application.add_handler(
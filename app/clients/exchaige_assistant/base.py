@@ -1,6 +1,7 @@
 """
 ExchaigeAssistantBase
 """
+from typing import Optional
 from urllib.parse import urljoin
 
 
@@ -26,3 +27,13 @@ class ExchaigeAssistantBase:
         assert resource, "resource can't be None"
         assert path.startswith("/"), "A path prefix must start with '/'"
         return urljoin(base=self._url, url=f"/api/{self._version}/{resource}{path}")
+
+    def _get_headers(self, idempotency_key: Optional[str] = None) -> dict:
+        """
+        the headers of a request, a state-changing one carries its idempotency key
+        :param idempotency_key:
+        :return:
+        """
+        if idempotency_key is None:
+            return self._headers
+        return {**self._headers, "Idempotency-Key": idempotency_key}
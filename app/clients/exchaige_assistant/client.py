@@ -2,6 +2,7 @@
 ExchaigeAssistantClient
 """
 from app.config import settings
+from app.libs.http_client import http_client, HttpHostOptions
 from .currency import ExchaigeAssistantCurrency
 from .exchange_rate import ExchaigeAssistantExchangeRate
 from .files import ExchaigeAssistantFiles
@@ -17,6 +18,13 @@ class ExchaigeAssistantClient:
         self._headers = {
             "X-API-KEY": settings.JCN_EXCHAIGE_ASSISTANT_API_KEY
         }
+        http_client.configure_host(
+            url=self.base_url,
+            options=HttpHostOptions(
+                http2=settings.JCN_EXCHAIGE_ASSISTANT_HTTP2,
+                max_retries=settings.JCN_EXCHAIGE_ASSISTANT_MAX_RETRIES
+            )
+        )
 
     @property
     def currency(self) -> ExchaigeAssistantCurrency:
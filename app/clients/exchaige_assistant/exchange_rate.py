@@ -1,6 +1,8 @@
 """
 ExchaigeAssistantExchangeRate
 """
+from typing import Optional
+
 from httpx import HTTPStatusError
 
 from app.libs.http_client import http_client
@@ -16,16 +18,19 @@ class ExchaigeAssistantExchangeRate(ExchaigeAssistantBase):
         self._resource = "exchange_rate"
 
     @distributed_trace()
-    async def update_exchange_rate(self, data: dict):
+    async def update_exchange_rate(self, data: dict, idempotency_key: Optional[str] = None):
         """
         update exchange rate
+        :param data:
+        :param idempotency_key:
         :return:
         """
         url = self._get_resource_url(resource=self._resource, path="/currency_rate")
         try:
             resp = await http_client.create(url=url) \
-                .add_headers(self._headers) \
+                .add_headers(self._get_headers(idempotency_key)) \
                 .add_json(data) \
+                .idempotent(True) \
                 .apost()
             resp.raise_for_status()
         except HTTPStatusError as exc:
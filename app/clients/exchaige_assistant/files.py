@@ -1,9 +1,13 @@
 """
 ExchaigeAssistantFiles
 """
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
 from httpx import HTTPStatusError
 
 from app.libs.http_client import http_client
+from app.libs.http_client.http_client import HttpResponse
 from .base import ExchaigeAssistantBase
 from app.libs.decorators.sentry_tracer import distributed_trace
 
@@ -30,3 +34,18 @@ class ExchaigeAssistantFiles(ExchaigeAssistantBase):
             return resp.content
         except HTTPStatusError as exc:
             raise exc
+
+    @asynccontextmanager
+    async def stream_file(self, file_id: str, file_name: str) -> AsyncIterator[HttpResponse]:
+        """
+        get file, its body is read with aiter_bytes instead of being loaded in memory
+        :param file_id:
+        :param file_name:
+        :return:
+        """
+        url = self._get_resource_url(resource=self._resource, path=f"/{file_id}/{file_name}")
+        async with http_client.create(url=url) \
+                .add_headers(self._headers) \
+                .astream() as resp:
+            resp.raise_for_status()
+            yield resp
@@ -25,6 +25,7 @@ class ExchaigeAssistantTelegramAccount(ExchaigeAssistantBase):
             resp = await http_client.create(url=url) \
                 .add_headers(self._headers) \
                 .add_json(data) \
+                .idempotent(True) \
                 .apost()
             resp.raise_for_status()
         except HTTPStatusError as exc:
@@ -41,6 +42,7 @@ class ExchaigeAssistantTelegramAccount(ExchaigeAssistantBase):
             resp = await http_client.create(url=url) \
                 .add_headers(self._headers) \
                 .add_json(data) \
+                .idempotent(True) \
                 .apost()
             resp.raise_for_status()
         except HTTPStatusError as exc:
@@ -57,6 +59,7 @@ class ExchaigeAssistantTelegramAccount(ExchaigeAssistantBase):
             resp = await http_client.create(url=url) \
                 .add_headers(self._headers) \
                 .add_json(data) \
+                .idempotent(True) \
                 .apost()
             resp.raise_for_status()
         except HTTPStatusError as exc:
@@ -73,6 +76,24 @@ class ExchaigeAssistantTelegramAccount(ExchaigeAssistantBase):
             resp = await http_client.create(url=url) \
                 .add_headers(self._headers) \
                 .add_json(data) \
+                .idempotent(True) \
+                .apost()
+            resp.raise_for_status()
+        except HTTPStatusError as exc:
+            raise exc
+
+    async def bulk_upsert(self, data: dict):
+        """
+        accounts, groups and chat group members in one request
+        :param data: {"accounts": [], "groups": [], "chat_group_members": [], "deleted_chat_group_members": []}
+        :return:
+        """
+        url = self._get_resource_url(resource=self._resource, path="/raw/bulk")
+        try:
+            resp = await http_client.create(url=url) \
+                .add_headers(self._headers) \
+                .add_json(data) \
+                .idempotent(True) \
                 .apost()
             resp.raise_for_status()
         except HTTPStatusError as exc:
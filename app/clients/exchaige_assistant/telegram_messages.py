@@ -1,6 +1,8 @@
 """
 ExchaigeAssistantTelegramMessages
 """
+from typing import Optional
+
 from httpx import HTTPStatusError
 
 from app.libs.decorators.sentry_tracer import distributed_trace
@@ -16,16 +18,17 @@ class ExchaigeAssistantTelegramMessages(ExchaigeAssistantBase):
         self._resource = "telegram/messages"
 
     @distributed_trace()
-    async def send_payment_account(self, data: dict):
+    async def send_payment_account(self, data: dict, idempotency_key: Optional[str] = None):
         """
         send the payment account
         :param data:
+        :param idempotency_key:
         :return:
         """
         url = self._get_resource_url(resource=self._resource, path="/payment_account")
         try:
             resp = await http_client.create(url=url) \
-                .add_headers(self._headers) \
+                .add_headers(self._get_headers(idempotency_key)) \
                 .add_json(data) \
                 .apost()
             resp.raise_for_status()
@@ -33,17 +36,18 @@ class ExchaigeAssistantTelegramMessages(ExchaigeAssistantBase):
             raise exc
 
     @distributed_trace()
-    async def update_payment_account_status(self, group_id: int, data: dict):
+    async def update_payment_account_status(self, group_id: int, data: dict, idempotency_key: Optional[str] = None):
         """
         update payment account status
         :param group_id:
         :param data:
+        :param idempotency_key:
         :return:
         """
         url = self._get_resource_url(resource=self._resource, path=f"/payment_account_status/{group_id}")
         try:
             resp = await http_client.create(url=url) \
-                .add_headers(self._headers) \
+                .add_headers(self._get_headers(idempotency_key)) \
                 .add_json(data) \
                 .aput()
             resp.raise_for_status()
@@ -51,17 +55,18 @@ class ExchaigeAssistantTelegramMessages(ExchaigeAssistantBase):
             raise exc
 
     @distributed_trace()
-    async def payment_account_out_of_stock(self, group_id: int, data: dict):
+    async def payment_account_out_of_stock(self, group_id: int, data: dict, idempotency_key: Optional[str] = None):
         """
         payment account out of stock
         :param group_id:
         :param data:
+        :param idempotency_key:
         :return:
         """
         url = self._get_resource_url(resource=self._resource, path=f"/order_payment_account_status/{group_id}")
         try:
             resp = await http_client.create(url=url) \
-                .add_headers(self._headers) \
+                .add_headers(self._get_headers(idempotency_key)) \
                 .add_json(data) \
                 .aput()
             resp.raise_for_status()
@@ -69,16 +74,17 @@ class ExchaigeAssistantTelegramMessages(ExchaigeAssistantBase):
             raise exc
 
     @distributed_trace()
-    async def confirm_pay(self, data: dict):
+    async def confirm_pay(self, data: dict, idempotency_key: Optional[str] = None):
         """
         confirm pay
         :param data:
+        :param idempotency_key:
         :return:
         """
         url = self._get_resource_url(resource=self._resource, path="/confirm_pay")
         try:
             resp = await http_client.create(url=url) \
-                .add_headers(self._headers) \
+                .add_headers(self._get_headers(idempotency_key)) \
                 .add_json(data) \
                 .apost()
             resp.raise_for_status()
@@ -3,7 +3,9 @@ Configuration
 """
 import json
 import os
+import tempfile
 from pathlib import Path, PosixPath
+from typing import Optional
 
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings
@@ -33,6 +35,54 @@ class Configuration(BaseSettings):
     # [JCN]
     JCN_EXCHAIGE_ASSISTANT_URL: str = os.getenv(key="JCN_EXCHAIGE_ASSISTANT_URL")
     JCN_EXCHAIGE_ASSISTANT_API_KEY: str = os.getenv(key="JCN_EXCHAIGE_ASSISTANT_API_KEY")
+    JCN_EXCHAIGE_ASSISTANT_HTTP2: bool = os.getenv(key="JCN_EXCHAIGE_ASSISTANT_HTTP2", default=False)
+    JCN_EXCHAIGE_ASSISTANT_MAX_RETRIES: int = os.getenv(key="JCN_EXCHAIGE_ASSISTANT_MAX_RETRIES", default=2)
+
+    # [HttpClient]
+    HTTP_CLIENT_MAX_CONNECTIONS: int = os.getenv(key="HTTP_CLIENT_MAX_CONNECTIONS", default=100)
+    HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS: int = os.getenv(key="HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS", default=20)
+    HTTP_CLIENT_KEEPALIVE_EXPIRY: float = os.getenv(key="HTTP_CLIENT_KEEPALIVE_EXPIRY", default=30)
+    HTTP_CLIENT_CIRCUIT_FAILURE_THRESHOLD: int = os.getenv(key="HTTP_CLIENT_CIRCUIT_FAILURE_THRESHOLD", default=5)
+    HTTP_CLIENT_CIRCUIT_RESET_TIMEOUT: float = os.getenv(key="HTTP_CLIENT_CIRCUIT_RESET_TIMEOUT", default=30)
+
+    # [Cache]
+    CURRENCY_CACHE_TTL: float = os.getenv(key="CURRENCY_CACHE_TTL", default=600)
+    CURRENCY_CACHE_REFRESH_AHEAD: float = os.getenv(key="CURRENCY_CACHE_REFRESH_AHEAD", default=60)
+    CURRENCY_CACHE_STALE_IF_ERROR: float = os.getenv(key="CURRENCY_CACHE_STALE_IF_ERROR", default=3600)
+    ACCOUNT_INFO_REFRESH_INTERVAL: float = os.getenv(key="ACCOUNT_INFO_REFRESH_INTERVAL", default=3600)
+    ACCOUNT_INFO_CACHE_SIZE: int = os.getenv(key="ACCOUNT_INFO_CACHE_SIZE", default=10000)
+    VENDOR_DIRECTORY_RECONCILE_INTERVAL: float = os.getenv(key="VENDOR_DIRECTORY_RECONCILE_INTERVAL", default=900)
+    RECEIPT_CACHE_DIR: str = os.getenv(
+        key="RECEIPT_CACHE_DIR",
+        default=os.path.join(tempfile.gettempdir(), "jcn_exchaige_assistant", "receipts")
+    )
+    RECEIPT_CACHE_MAX_BYTES: int = os.getenv(key="RECEIPT_CACHE_MAX_BYTES", default=256 * 1024 * 1024)
+    IDEMPOTENCY_TTL: float = os.getenv(key="IDEMPOTENCY_TTL", default=3600)
+    IDEMPOTENCY_LOCK_TTL: float = os.getenv(key="IDEMPOTENCY_LOCK_TTL", default=30)
+
+    # [Bookkeeping]
+    BOOKKEEPING_WORKERS: int = os.getenv(key="BOOKKEEPING_WORKERS", default=4)
+    BOOKKEEPING_QUEUE_SIZE: int = os.getenv(key="BOOKKEEPING_QUEUE_SIZE", default=1000)
+    BOOKKEEPING_MAX_RETRIES: int = os.getenv(key="BOOKKEEPING_MAX_RETRIES", default=3)
+    BOOKKEEPING_RETRY_INTERVAL: float = os.getenv(key="BOOKKEEPING_RETRY_INTERVAL", default=1)
+    ACCOUNT_WRITE_BEHIND_WINDOW: float = os.getenv(key="ACCOUNT_WRITE_BEHIND_WINDOW", default=0.5)
+    ACCOUNT_WRITE_BEHIND_MAX_ITEMS: int = os.getenv(key="ACCOUNT_WRITE_BEHIND_MAX_ITEMS", default=100)
+    ACCOUNT_BULK_UPSERT_RECHECK_INTERVAL: float = os.getenv(key="ACCOUNT_BULK_UPSERT_RECHECK_INTERVAL", default=3600)
+
+    # [Receipts]
+    CHECK_RECEIPT_WORKERS: int = os.getenv(key="CHECK_RECEIPT_WORKERS", default=8)
+    CHECK_RECEIPT_QUEUE_SIZE: int = os.getenv(key="CHECK_RECEIPT_QUEUE_SIZE", default=512)
+    CHECK_RECEIPT_MAX_RETRIES: int = os.getenv(key="CHECK_RECEIPT_MAX_RETRIES", default=3)
+    CHECK_RECEIPT_RETRY_INTERVAL: float = os.getenv(key="CHECK_RECEIPT_RETRY_INTERVAL", default=1)
+    CHECK_RECEIPT_DEAD_LETTER_SIZE: int = os.getenv(key="CHECK_RECEIPT_DEAD_LETTER_SIZE", default=1000)
+
+    # [Outbox]
+    OUTBOX_WORKERS: int = os.getenv(key="OUTBOX_WORKERS", default=4)
+    OUTBOX_MAX_RETRIES: int = os.getenv(key="OUTBOX_MAX_RETRIES", default=5)
+    OUTBOX_RETRY_INTERVAL: float = os.getenv(key="OUTBOX_RETRY_INTERVAL", default=1)
+    OUTBOX_CLAIM_IDLE: float = os.getenv(key="OUTBOX_CLAIM_IDLE", default=120)
+    OUTBOX_POLL_INTERVAL: float = os.getenv(key="OUTBOX_POLL_INTERVAL", default=5)
+    OUTBOX_DEAD_LETTER_SIZE: int = os.getenv(key="OUTBOX_DEAD_LETTER_SIZE", default=10000)
 
     # [Redis]
     REDIS_URL: str = os.getenv(key="REDIS_URL", default="redis://localhost:6379")
@@ -40,7 +90,28 @@ class Configuration(BaseSettings):
     # [Telegram]
     TELEGRAM_BOT_USERNAME: str = os.getenv(key="TELEGRAM_BOT_USERNAME")
     TELEGRAM_BOT_TOKEN: str = os.getenv(key="TELEGRAM_BOT_TOKEN")
+    TELEGRAM_WEBHOOK_SECRET_TOKEN: Optional[str] = os.getenv(key="TELEGRAM_WEBHOOK_SECRET_TOKEN") or None
     TELEGRAM_BOT_TYPE: BotType = BotType.VENDORS
+    TELEGRAM_RATE_LIMIT_GLOBAL: float = os.getenv(key="TELEGRAM_RATE_LIMIT_GLOBAL", default=30)
+    TELEGRAM_RATE_LIMIT_GROUP: float = os.getenv(key="TELEGRAM_RATE_LIMIT_GROUP", default=20)
+    TELEGRAM_RATE_LIMIT_PRIVATE: float = os.getenv(key="TELEGRAM_RATE_LIMIT_PRIVATE", default=1)
+    TELEGRAM_RATE_LIMIT_MAX_RETRIES: int = os.getenv(key="TELEGRAM_RATE_LIMIT_MAX_RETRIES", default=2)
+    TELEGRAM_FAN_OUT_CONCURRENCY: int = os.getenv(key="TELEGRAM_FAN_OUT_CONCURRENCY", default=32)
+    TELEGRAM_CONNECTION_POOL_SIZE: int = os.getenv(key="TELEGRAM_CONNECTION_POOL_SIZE", default=64)
+    TELEGRAM_POOL_TIMEOUT: float = os.getenv(key="TELEGRAM_POOL_TIMEOUT", default=5)
+    TELEGRAM_CONNECT_TIMEOUT: float = os.getenv(key="TELEGRAM_CONNECT_TIMEOUT", default=5)
+    TELEGRAM_READ_TIMEOUT: float = os.getenv(key="TELEGRAM_READ_TIMEOUT", default=5)
+    TELEGRAM_WRITE_TIMEOUT: float = os.getenv(key="TELEGRAM_WRITE_TIMEOUT", default=5)
+    TELEGRAM_HTTP2: bool = os.getenv(key="TELEGRAM_HTTP2", default=False)
+    TELEGRAM_UPDATE_DEDUP_WINDOW: int = os.getenv(key="TELEGRAM_UPDATE_DEDUP_WINDOW", default=65536)
+    TELEGRAM_UPDATE_DEDUP_TTL: int = os.getenv(key="TELEGRAM_UPDATE_DEDUP_TTL", default=24 * 60 * 60)
+    TELEGRAM_UPDATE_QUEUE_SIZE: int = os.getenv(key="TELEGRAM_UPDATE_QUEUE_SIZE", default=10000)
+    BROADCAST_JOB_CONCURRENCY: int = os.getenv(key="BROADCAST_JOB_CONCURRENCY", default=16)
+    BROADCAST_JOB_TTL: int = os.getenv(key="BROADCAST_JOB_TTL", default=7 * 24 * 60 * 60)
+    BROADCAST_JOB_LEASE_TTL: int = os.getenv(key="BROADCAST_JOB_LEASE_TTL", default=30)
+    RECEIPT_FILE_ID_TTL: int = os.getenv(key="RECEIPT_FILE_ID_TTL", default=7 * 24 * 60 * 60)
+    RECEIPT_UPLOAD_MAX_MEMORY: int = os.getenv(key="RECEIPT_UPLOAD_MAX_MEMORY", default=1024 * 1024)
+    RECEIPT_UPLOAD_MAX_IN_FLIGHT_BYTES: int = os.getenv(key="RECEIPT_UPLOAD_MAX_IN_FLIGHT_BYTES", default=32 * 1024 * 1024)
 
     # [Sentry]
     SENTRY_URL: str = os.getenv(key="SENTRY_URL")
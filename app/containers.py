@@ -2,12 +2,11 @@
 Container
 """
 from dependency_injector import containers, providers
-from telegram import Bot
 
-from app.config import settings
-from app.handlers import TelegramBotMessagesHandler, TelegramMessagesHandler
+from app.handlers import BroadcastJobs, TelegramBotMessagesHandler, TelegramMessagesHandler
 from app.libs.database import RedisPool
-from app.providers import ExchaigeAssistantProvider
+from app.libs.telegram import shared_bot
+from app.providers import ExchaigeAssistantProvider, vendor_directory as _vendor_directory
 
 
 # pylint: disable=too-few-public-methods,c-extension-no-member
@@ -19,26 +18,38 @@ class Container(containers.DeclarativeContainer):
         packages=["app.bots", "app.handlers", "app.routers"],
     )
 
+    # resources are opened once by the application lifespan (init_resources) and closed on shutdown,
+    # the handlers are factories: one instance per request / update
+
     # [bot]
-    bot = providers.Resource(
-        Bot,
-        token=settings.TELEGRAM_BOT_TOKEN
-    )
+    # the Application's bot, it opens and closes its connection pool
+    bot = providers.Object(shared_bot)
 
     # [database]
-    redis_pool = providers.Singleton(RedisPool)
+    redis_pool = providers.Resource(RedisPool)
 
     # [providers]
     exchaige_assistant_provider = providers.Factory(ExchaigeAssistantProvider)
+    # process-wide, shared with the background tasks
+    vendor_directory = providers.Object(_vendor_directory)
 
     # [handlers]
     telegram_bot_messages_handler = providers.Factory(
         TelegramBotMessagesHandler,
         redis=redis_pool,
-        exchaige_assistant_provider=exchaige_assistant_provider
+        exchaige_assistant_provider=exchaige_assistant_provider,
+        vendor_directory=vendor_directory
+    )
+    broadcast_jobs = providers.Factory(
+        BroadcastJobs,
+        bot=bot,
+        redis=redis_pool
     )
     telegram_messages_handler = providers.Factory(
         TelegramMessagesHandler,
         bot=bot,
-        exchaige_assistant_provider=exchaige_assistant_provider
+        exchaige_assistant_provider=exchaige_assistant_provider,
+        vendor_directory=vendor_directory,
+        broadcast_jobs=broadcast_jobs,
+        redis=redis_pool
     )
@@ -2,4 +2,4 @@
 Top level handlers package
 """
 from .telegram_bot import TelegramBotMessagesHandler
-from .telegram import TelegramMessagesHandler
+from .telegram import BroadcastJobs, TelegramMessagesHandler
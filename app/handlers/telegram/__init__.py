@@ -1,8 +1,11 @@
 """
 Top-level package for Telegram handlers.
 """
-from .messages import TelegramMessagesHandler
+from .broadcast_jobs import BroadcastJobs
+from .messages import TelegramMessagesHandler, receipt_checks
 
 __all__ = [
-    "TelegramMessagesHandler"
+    "BroadcastJobs",
+    "TelegramMessagesHandler",
+    "receipt_checks",
 ]
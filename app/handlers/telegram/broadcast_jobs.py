@@ -0,0 +1,267 @@
+"""
+BroadcastJobs
+"""
+import asyncio
+import json
+import time
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+from redis.exceptions import RedisError
+from telegram import Bot, InlineKeyboardMarkup
+
+from app.config import settings
+from app.libs.consts.enums import BroadcastJobStatus
+from app.libs.database import RedisPool
+from app.libs.logger import logger
+from app.libs.metrics import metrics
+from app.libs.telegram import DeliveryResult, fan_out
+from app.schemas.telegram.broadcast import BroadcastJob
+
+# the jobs sending in this process, by id
+_running: Dict[str, asyncio.Task] = {}
+
+
+class BroadcastJobs:
+    """
+    Broadcasts sent in the background, their progress is kept in Redis:
+    - {app}:broadcast_job:{id}          hash, the job and its message
+    - {app}:broadcast_job:{id}:results  hash, chat id -> DeliveryResult
+    - {app}:broadcast_jobs:active       set, the jobs to resume after a restart
+    - {app}:broadcast_job:{id}:lease    the process running the job, renewed while it runs
+    A job runs in the process holding its lease, the others wait for it to be released or to expire.
+    A resumed job skips the chats with a result, a message in flight when the process stopped may be sent twice.
+    """
+
+    def __init__(self, bot: Bot, redis: RedisPool):
+        self._bot = bot
+        self._redis = redis.create()
+
+    @staticmethod
+    def redis_name(name: str) -> str:
+        """
+
+        :return:
+        """
+        return f"{settings.APP_NAME}:{name}"
+
+    async def submit(
+        self,
+        chat_ids: List[int],
+        text: str,
+        parse_mode: Optional[str] = None,
+        reply_markup: Optional[InlineKeyboardMarkup] = None
+    ) -> BroadcastJob:
+        """
+        Store a broadcast and start sending it in the background
+        :param chat_ids:
+        :param text:
+        :param parse_mode:
+        :param reply_markup:
+        :return:
+        """
+        job_id = uuid4().hex
+        message = {
+            "text": text,
+            "parse_mode": parse_mode,
+            "reply_markup": reply_markup.to_dict() if reply_markup else None
+        }
+        job = BroadcastJob(job_id=job_id, status=BroadcastJobStatus.PENDING, total=len(chat_ids), created_at=time.time())
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(
+                name=self.redis_name(f"broadcast_job:{job_id}"),
+                mapping={
+                    "status": job.status.value,
+                    "total": job.total,
+                    "sent": 0,
+                    "failed": 0,
+                    "created_at": job.created_at,
+                    "chat_ids": json.dumps(chat_ids),
+                    "message": json.dumps(message),
+                }
+            )
+            pipe.sadd(self.redis_name("broadcast_jobs:active"), job_id)
+            await pipe.execute()
+        metrics.incr("broadcast_job.jobs", status="submitted")
+        self._start(job_id)
+        return job
+
+    async def get(self, job_id: str) -> Optional[BroadcastJob]:
+        """
+        The job with its progress and failures
+        :param job_id:
+        :return:
+        """
+        data = await self._redis.hgetall(self.redis_name(f"broadcast_job:{job_id}"))
+        if not data:
+            return None
+        results = await self._redis.hvals(self.redis_name(f"broadcast_job:{job_id}:results"))
+        failures = [result for result in map(DeliveryResult.model_validate_json, results) if not result.ok]
+        return BroadcastJob(
+            job_id=job_id,
+            status=data["status"],
+            total=data["total"],
+            sent=data["sent"],
+            failed=data["failed"],
+            created_at=data["created_at"],
+            started_at=data.get("started_at"),
+            finished_at=data.get("finished_at"),
+            failures=failures
+        )
+
+    async def resume(self) -> int:
+        """
+        Restart the jobs left unfinished by a previous process
+        :return: number of resumed jobs
+        """
+        job_ids = await self._redis.smembers(self.redis_name("broadcast_jobs:active"))
+        for job_id in job_ids:
+            self._start(job_id)
+        if job_ids:
+            logger.info(f"resumed {len(job_ids)} broadcast jobs")
+        return len(job_ids)
+
+    @staticmethod
+    async def stop() -> None:
+        """
+        Stop the jobs of this process, they are resumed on the next start
+        :return:
+        """
+        tasks = list(_running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _acquire_lease(self, job_id: str, token: str) -> bool:
+        """
+        Take the lease of a job, wait while another process holds it
+        :param job_id:
+        :param token: identifies this run of the job
+        :return: False when the job isn't active anymore
+        """
+        lease_name = self.redis_name(f"broadcast_job:{job_id}:lease")
+        waiting = False
+        while not await self._redis.set(lease_name, token, nx=True, ex=settings.BROADCAST_JOB_LEASE_TTL):
+            if not await self._redis.sismember(self.redis_name("broadcast_jobs:active"), job_id):
+                return False
+            if not waiting:
+                waiting = True
+                logger.info(f"broadcast job {job_id} runs in another process, waiting for its lease")
+            await asyncio.sleep(settings.BROADCAST_JOB_LEASE_TTL / 3)
+        return True
+
+    async def _keep_lease(self, job_id: str, token: str, task: asyncio.Task) -> None:
+        """
+        Renew the lease of a running job, stop the job when the lease was lost
+        :param job_id:
+        :param token:
+        :param task: the task running the job
+        :return:
+        """
+        lease_name = self.redis_name(f"broadcast_job:{job_id}:lease")
+        while True:
+            await asyncio.sleep(settings.BROADCAST_JOB_LEASE_TTL / 3)
+            try:
+                if await self._redis.get(lease_name) != token:
+                    logger.warning(f"broadcast job {job_id} lost its lease, stopping")
+                    task.cancel()
+                    return
+                await self._redis.expire(lease_name, settings.BROADCAST_JOB_LEASE_TTL)
+            except RedisError as exc:
+                logger.warning(f"broadcast job {job_id} lease not renewed: {exc}")
+
+    async def _release_lease(self, job_id: str, token: str) -> None:
+        """
+        :param job_id:
+        :param token:
+        :return:
+        """
+        lease_name = self.redis_name(f"broadcast_job:{job_id}:lease")
+        try:
+            if await self._redis.get(lease_name) == token:
+                await self._redis.delete(lease_name)
+        except RedisError as exc:
+            logger.warning(f"broadcast job {job_id} lease not released, it expires: {exc}")
+
+    def _start(self, job_id: str) -> None:
+        """
+        :param job_id:
+        :return:
+        """
+        if job_id in _running:
+            return
+        task = asyncio.create_task(self._run(job_id), name=f"broadcast_job-{job_id}")
+        _running[job_id] = task
+        task.add_done_callback(lambda _: _running.pop(job_id, None))
+
+    async def _run(self, job_id: str) -> None:
+        """
+        :param job_id:
+        :return:
+        """
+        token = uuid4().hex
+        try:
+            if not await self._acquire_lease(job_id, token):
+                return
+        except RedisError as exc:
+            # left active, the next start resumes it
+            logger.exception(exc)
+            metrics.incr("broadcast_job.jobs", status="interrupted")
+            return
+        keeper = asyncio.create_task(self._keep_lease(job_id, token, asyncio.current_task()))
+        try:
+            await self._send(job_id)
+        finally:
+            keeper.cancel()
+            await self._release_lease(job_id, token)
+
+    async def _send(self, job_id: str) -> None:
+        """
+        :param job_id:
+        :return:
+        """
+        job_name = self.redis_name(f"broadcast_job:{job_id}")
+        results_name = self.redis_name(f"broadcast_job:{job_id}:results")
+        try:
+            data = await self._redis.hgetall(job_name)
+            if not data:
+                await self._redis.srem(self.redis_name("broadcast_jobs:active"), job_id)
+                return
+            done = {int(chat_id) for chat_id in await self._redis.hkeys(results_name)}
+            chat_ids = [chat_id for chat_id in json.loads(data["chat_ids"]) if chat_id not in done]
+            message = json.loads(data["message"])
+            reply_markup = InlineKeyboardMarkup.de_json(message["reply_markup"], self._bot) if message["reply_markup"] else None
+            started_at = float(data.get("started_at") or time.time())
+            await self._redis.hset(job_name, mapping={"status": BroadcastJobStatus.RUNNING.value, "started_at": started_at})
+
+            async def _record(result: DeliveryResult) -> None:
+                async with self._redis.pipeline(transaction=True) as pipe:
+                    pipe.hset(results_name, str(result.chat_id), result.model_dump_json())
+                    pipe.hincrby(job_name, "sent" if result.ok else "failed", 1)
+                    await pipe.execute()
+
+            await fan_out(
+                chat_ids=chat_ids,
+                send=lambda chat_id: self._bot.send_message(
+                    chat_id=chat_id,
+                    text=message["text"],
+                    parse_mode=message["parse_mode"],
+                    reply_markup=reply_markup
+                ),
+                concurrency=settings.BROADCAST_JOB_CONCURRENCY,
+                on_result=_record
+            )
+
+            finished_at = time.time()
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.hset(job_name, mapping={"status": BroadcastJobStatus.DONE.value, "finished_at": finished_at})
+                pipe.expire(job_name, settings.BROADCAST_JOB_TTL)
+                pipe.expire(results_name, settings.BROADCAST_JOB_TTL)
+                pipe.srem(self.redis_name("broadcast_jobs:active"), job_id)
+                await pipe.execute()
+            metrics.incr("broadcast_job.jobs", status="done")
+            metrics.observe("broadcast_job.duration", finished_at - started_at)
+        except Exception as exc:
+            # left active, the next start resumes it
+            logger.exception(exc)
+            metrics.incr("broadcast_job.jobs", status="interrupted")
@@ -1,17 +1,63 @@
 """
 TelegramMessagesHandler
 """
+import asyncio
+import json
+import time
+from functools import partial
+from typing import Any, Awaitable, Callable, List, Optional
+from uuid import UUID
+
+import httpx
 import telegram
 from fastapi import HTTPException
 from starlette import status
-from telegram import Bot, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram import Bot, InlineKeyboardMarkup, InlineKeyboardButton, Message
 from telegram.constants import ParseMode
 
+from app.config import settings
+from app.libs.cache import IdempotencyStore, TelegramFileIdCache
 from app.libs.consts.enums import BotType
 from app.libs.consts.messages import PaymentAccountMessage, ExchangeRateMessage, HurryPaymentAccountMessage, ConfirmPayMessage
+from app.libs.database import RedisPool
 from app.libs.logger import logger
-from app.providers import ExchaigeAssistantProvider
-from app.serializers.v1.telegram import PaymentAccount, CheckReceipt, ConfirmPayment, TelegramBroadcast
+from app.libs.telegram import DeliveryResult, StreamingInputFile, StreamingUploads, fan_out
+from app.libs.workers import KeyedWorkQueue
+from app.providers import ExchaigeAssistantProvider, VendorDirectory
+from app.schemas.telegram.broadcast import BroadcastJob, BulkBroadcastResult
+from app.serializers.v1.telegram import (
+    PaymentAccount,
+    CheckReceipt,
+    ConfirmPayment,
+    TelegramBroadcast,
+    TelegramBroadcastJob,
+    TelegramBulkBroadcast,
+)
+from .broadcast_jobs import BroadcastJobs
+
+# upstream receipt (file id, file name) -> Telegram file_id of its first upload
+receipt_file_ids = TelegramFileIdCache(name="receipt", ttl=settings.RECEIPT_FILE_ID_TTL)
+# receipts relayed from ExchaigeAssistant to Telegram, bounded in memory per receipt and in total
+receipt_uploads = StreamingUploads(
+    name="receipt",
+    max_memory=settings.RECEIPT_UPLOAD_MAX_MEMORY,
+    max_in_flight_bytes=settings.RECEIPT_UPLOAD_MAX_IN_FLIGHT_BYTES
+)
+# the payment messages by idempotency key, a retried request gets the message sent the first time
+payment_messages = IdempotencyStore(
+    name="payment_message",
+    ttl=settings.IDEMPOTENCY_TTL,
+    lock_ttl=settings.IDEMPOTENCY_LOCK_TTL
+)
+# check_receipt off the request, in order per order, a rejected receipt (4xx) isn't retried
+receipt_checks = KeyedWorkQueue(
+    name="check_receipt",
+    workers=settings.CHECK_RECEIPT_WORKERS,
+    maxsize=settings.CHECK_RECEIPT_QUEUE_SIZE,
+    max_retries=settings.CHECK_RECEIPT_MAX_RETRIES,
+    retry_interval=settings.CHECK_RECEIPT_RETRY_INTERVAL,
+    should_retry=lambda exc: not (isinstance(exc, HTTPException) and exc.status_code < 500)
+)
 
 
 class TelegramMessagesHandler:
@@ -20,10 +66,16 @@ class TelegramMessagesHandler:
     def __init__(
         self,
         bot: Bot,
-        exchaige_assistant_provider: ExchaigeAssistantProvider
+        exchaige_assistant_provider: ExchaigeAssistantProvider,
+        vendor_directory: VendorDirectory,
+        broadcast_jobs: BroadcastJobs,
+        redis: RedisPool
     ):
         self._bot = bot
         self._exchaige_assistant_provider = exchaige_assistant_provider
+        self._vendor_directory = vendor_directory
+        self._broadcast_jobs = broadcast_jobs
+        self._redis = redis.create()
 
     async def broadcast_message(self, model: TelegramBroadcast):
         """
@@ -43,31 +95,128 @@ class TelegramMessagesHandler:
         else:
             return message.to_dict()
 
-    async def exchange_rate_msg(self):
+    async def get_recipients(self, model: TelegramBulkBroadcast) -> List[int]:
+        """
+        the chat ids of a bulk broadcast, without duplicates
+        :param model:
+        :return:
+        """
+        if model.chat_ids is not None:
+            return list(dict.fromkeys(model.chat_ids))
+        vendors = await self._vendor_directory.get_vendors()
+        status_filter = model.vendor_filter.payment_account_status
+        return [
+            vendor.id for vendor in vendors
+            if status_filter is None or vendor.payment_account_status == status_filter
+        ]
+
+    async def broadcast_messages(self, model: TelegramBulkBroadcast) -> BulkBroadcastResult:
         """
-        exchange rate msg
+        broadcast message to many chats under the bot's rate limits
+        :param model:
         :return:
         """
-        vendors = await self._exchaige_assistant_provider.get_vendors()
+        chat_ids = await self.get_recipients(model=model)
+        results = await fan_out(
+            chat_ids=chat_ids,
+            send=lambda chat_id: self._bot.send_message(chat_id=chat_id, text=model.message),
+            concurrency=settings.TELEGRAM_FAN_OUT_CONCURRENCY
+        )
+        sent = sum(1 for result in results if result.ok)
+        return BulkBroadcastResult(total=len(results), sent=sent, failed=len(results) - sent, results=results)
+
+    async def exchange_rate_msg(self) -> List[DeliveryResult]:
+        """
+        exchange rate msg, sent to the vendors concurrently under the bot's rate limits
+        :return: delivery result of each vendor
+        """
+        vendors = await self._vendor_directory.get_vendors()
         message = ExchangeRateMessage.format()
         buttons = InlineKeyboardMarkup([(InlineKeyboardButton("Provide", callback_data="EXCHANGE_RATE provide"),)])
-        for vendor in vendors:
-            try:
-                await self._bot.send_message(
-                    chat_id=vendor.id,
-                    text=message.text,
-                    parse_mode=message.parse_mode,
-                    reply_markup=buttons
-                )
-            except telegram.error.BadRequest as e:
-                logger.error(e)
-                continue
+        return await fan_out(
+            chat_ids=[vendor.id for vendor in vendors],
+            send=lambda chat_id: self._bot.send_message(
+                chat_id=chat_id,
+                text=message.text,
+                parse_mode=message.parse_mode,
+                reply_markup=buttons
+            ),
+            concurrency=settings.TELEGRAM_FAN_OUT_CONCURRENCY
+        )
 
-    async def payment_account(self, model: PaymentAccount):
+    async def broadcast_message_job(self, model: TelegramBroadcastJob) -> BroadcastJob:
+        """
+        broadcast message to many chats in the background
+        :param model:
+        :return:
+        """
+        chat_ids = await self.get_recipients(model=model)
+        return await self._broadcast_jobs.submit(chat_ids=chat_ids, text=model.message)
+
+    async def exchange_rate_msg_job(self) -> BroadcastJob:
+        """
+        exchange rate msg sent in the background
+        :return:
+        """
+        vendors = await self._vendor_directory.get_vendors()
+        message = ExchangeRateMessage.format()
+        buttons = InlineKeyboardMarkup([(InlineKeyboardButton("Provide", callback_data="EXCHANGE_RATE provide"),)])
+        return await self._broadcast_jobs.submit(
+            chat_ids=[vendor.id for vendor in vendors],
+            text=message.text,
+            parse_mode=message.parse_mode,
+            reply_markup=buttons
+        )
+
+    async def get_broadcast_job(self, job_id: str) -> BroadcastJob:
+        """
+        progress of a broadcast job
+        :param job_id:
+        :return:
+        """
+        job = await self._broadcast_jobs.get(job_id=job_id)
+        if job is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Broadcast job {job_id} not found")
+        return job
+
+    async def _send_once(
+        self,
+        endpoint: str,
+        order_id: Optional[UUID],
+        idempotency_key: Optional[str],
+        send: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        send a payment message once per idempotency key, by default once per order and endpoint
+        :param endpoint:
+        :param order_id: the key of the requests without one, None sends each of them
+        :param idempotency_key: the client's Idempotency-Key header
+        :param send:
+        :return: the response of the first request
+        """
+        if idempotency_key is None and order_id is None:
+            return await send()
+        key = f"{endpoint}:{idempotency_key or order_id}"
+        return await payment_messages.run(redis=self._redis, key=key, func=send)
+
+    async def payment_account(self, model: PaymentAccount, idempotency_key: Optional[str] = None):
         """
         payment telegram
         receive
         :param model:
+        :param idempotency_key:
+        :return:
+        """
+        return await self._send_once(
+            endpoint="payment_account",
+            order_id=model.order_id,
+            idempotency_key=idempotency_key,
+            send=partial(self._payment_account, model)
+        )
+
+    async def _payment_account(self, model: PaymentAccount):
+        """
+        :param model:
         :return:
         """
         message = PaymentAccountMessage.format(
@@ -102,9 +251,22 @@ class TelegramMessagesHandler:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
         return resp_message.to_dict()
 
-    async def hurry_payment_account(self, model: PaymentAccount):
+    async def hurry_payment_account(self, model: PaymentAccount, idempotency_key: Optional[str] = None):
+        """
+        hurry the payment account, an order may be hurried again: only a retry with the same idempotency key is deduplicated
+        :param model:
+        :param idempotency_key:
+        :return:
+        """
+        return await self._send_once(
+            endpoint="hurry_payment_account",
+            order_id=None,
+            idempotency_key=idempotency_key,
+            send=partial(self._hurry_payment_account, model)
+        )
+
+    async def _hurry_payment_account(self, model: PaymentAccount):
         """
-        hurry the payment account
         :param model:
         :return:
         """
@@ -140,40 +302,136 @@ class TelegramMessagesHandler:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
         return resp_message.to_dict()
 
-    async def check_receipt(self, model: CheckReceipt):
+    @staticmethod
+    def dead_letter_name() -> str:
+        """
+        Redis list of the receipts check_receipt gave up on, newest first
+        :return:
         """
-        send receipt
+        return f"{settings.APP_NAME}:check_receipt:dead_letter"
+
+    def queue_check_receipt(self, model: CheckReceipt) -> None:
+        """
+        queue check_receipt on the receipt workers, 429 when the queue is full
         :param model:
         :return:
         """
+        async def _dead_letter(exc: Exception) -> None:
+            entry = json.dumps({"receipt": model.model_dump(mode="json"), "error": repr(exc), "failed_at": time.time()})
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.lpush(self.dead_letter_name(), entry)
+                pipe.ltrim(self.dead_letter_name(), 0, settings.CHECK_RECEIPT_DEAD_LETTER_SIZE - 1)
+                await pipe.execute()
+
         try:
-            file_content = await self._exchaige_assistant_provider.get_file(file_id=model.file_id, file_name=model.file_name)
-            buttons = InlineKeyboardMarkup(
-                [
-                    (
-                        InlineKeyboardButton(
-                            text="Confirm payment",
-                            callback_data=f"CONFIRM_PAY {model.customer_id} {model.order_id}"
-                        ),
-                    )
-                ]
+            receipt_checks.submit_nowait(
+                key=model.order_id,
+                job=partial(self.check_receipt, model),
+                dead_letter=_dead_letter
             )
-            resp_message = await self._bot.send_photo(
-                chat_id=model.vendor_id,
-                photo=file_content,
-                reply_markup=buttons
+        except asyncio.QueueFull:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="too many receipts waiting, retry later",
+                headers={"Retry-After": str(max(1, int(settings.CHECK_RECEIPT_RETRY_INTERVAL)))}
             )
+
+    async def check_receipt(self, model: CheckReceipt):
+        """
+        send receipt, a receipt sent before is referenced by its Telegram file_id instead of being uploaded again
+        :param model:
+        :return:
+        """
+        cache_key = f"{model.file_id}:{model.file_name}"
+        buttons = InlineKeyboardMarkup(
+            [
+                (
+                    InlineKeyboardButton(
+                        text="Confirm payment",
+                        callback_data=f"CONFIRM_PAY {model.customer_id} {model.order_id}"
+                    ),
+                )
+            ]
+        )
+        try:
+            photo = await receipt_file_ids.get(redis=self._redis, key=cache_key)
+            if photo is None:
+                resp_message = await self._upload_receipt(model, buttons)
+            else:
+                try:
+                    resp_message = await self._bot.send_photo(chat_id=model.vendor_id, photo=photo, reply_markup=buttons)
+                except telegram.error.BadRequest as e:
+                    # the file_id is no longer accepted, upload the file again
+                    logger.warning(f"cached receipt {cache_key} rejected: {e}")
+                    await receipt_file_ids.forget(redis=self._redis, key=cache_key)
+                    photo = None
+                    resp_message = await self._upload_receipt(model, buttons)
+            if photo is None and resp_message.photo:
+                # the largest size is the uploaded image
+                await receipt_file_ids.set(redis=self._redis, key=cache_key, file_id=resp_message.photo[-1].file_id)
             print(resp_message)
         except telegram.error.BadRequest as e:
             logger.error(e)
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        except httpx.HTTPStatusError as e:
+            logger.error(e)
+            code = e.response.status_code
+            if code < 500 and code not in (status.HTTP_408_REQUEST_TIMEOUT, status.HTTP_429_TOO_MANY_REQUESTS):
+                # the upstream won't serve this receipt, e.g. a 404: not retried
+                raise HTTPException(status_code=code, detail=str(e))
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
         except Exception as e:
             logger.error(e)
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
-    async def confirm_payment(self, model: ConfirmPayment):
+    async def _upload_receipt(self, model: CheckReceipt, buttons: InlineKeyboardMarkup) -> Message:
+        """
+        relay the receipt from ExchaigeAssistant to Telegram, from the local disk cache,
+        or spooled when the cache is disabled, instead of loaded in memory
+        :param model:
+        :param buttons:
+        :return:
+        """
+        provider = self._exchaige_assistant_provider
+        if provider.files_cached:
+            async with provider.open_file(file_id=model.file_id, file_name=model.file_name) as file:
+                return await self._bot.send_photo(
+                    chat_id=model.vendor_id,
+                    photo=StreamingInputFile(file, filename=model.file_name),
+                    reply_markup=buttons
+                )
+        async with self._exchaige_assistant_provider.stream_file(file_id=model.file_id, file_name=model.file_name) as resp:
+            size = resp.headers.get("content-length")
+            async with receipt_uploads.spool(
+                chunks=await resp.aiter_bytes(StreamingUploads.CHUNK_SIZE),
+                filename=model.file_name,
+                size=int(size) if size else None
+            ) as upload:
+                # the body is spooled, the connection is not needed during the upload
+                await resp.aclose()
+                return await self._bot.send_photo(
+                    chat_id=model.vendor_id,
+                    photo=upload.input_file(),
+                    reply_markup=buttons
+                )
+
+    async def confirm_payment(self, model: ConfirmPayment, idempotency_key: Optional[str] = None):
         """
         confirm payment
+        :param model:
+        :param idempotency_key:
+        :return:
+        """
+        return await self._send_once(
+            endpoint="confirm_payment",
+            order_id=model.order_id,
+            idempotency_key=idempotency_key,
+            send=partial(self._confirm_payment, model)
+        )
+
+    async def _confirm_payment(self, model: ConfirmPayment):
+        """
+        :param model:
         :return:
         """
         message = ConfirmPayMessage.format()
@@ -1,4 +1,5 @@
 """
 Top level package for telegram_bot handlers.
 """
+from .base import bookkeeping
 from .messages import TelegramBotMessagesHandler
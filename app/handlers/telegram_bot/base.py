@@ -3,19 +3,38 @@ TelegramBotMessagesHandler
 """
 import abc
 import asyncio
-from typing import Optional, Tuple
+from functools import partial
+from typing import Dict, Optional, Set, Tuple
 
 from telegram import Update, ChatMemberUpdated, ChatMember, Chat, User
 
 from app.config import settings
 from app.context import CustomContext
+from app.libs.cache import FingerprintCache
 from app.libs.consts.enums import PaymentAccountStatus
 from app.libs.database import RedisPool
 from app.libs.decorators.sentry_tracer import distributed_trace
 from app.libs.logger import logger
-from app.providers import ExchaigeAssistantProvider
+from app.libs.workers import KeyedWorkQueue
+from app.providers import ExchaigeAssistantProvider, VendorDirectory
 from app.schemas.telegram.account import TelegramAccount, TelegramChatGroup
 
+# what was last written upstream for the accounts, the groups and their memberships
+account_info_fingerprints = FingerprintCache(
+    name="account_info",
+    ttl=settings.ACCOUNT_INFO_REFRESH_INTERVAL,
+    maxsize=settings.ACCOUNT_INFO_CACHE_SIZE
+)
+_remembering: Set[asyncio.Task] = set()
+# upstream bookkeeping writes, off the reply path and in order per chat.
+# The jobs only buffer the writes: the write-behind buffer retries the upstream failures, not this queue
+bookkeeping = KeyedWorkQueue(
+    name="bookkeeping",
+    workers=settings.BOOKKEEPING_WORKERS,
+    maxsize=settings.BOOKKEEPING_QUEUE_SIZE,
+    max_retries=0
+)
+
 
 class TelegramBotBaseHandler:
     """TelegramBotMessagesHandler"""
@@ -23,10 +42,12 @@ class TelegramBotBaseHandler:
     def __init__(
         self,
         redis: RedisPool,
-        exchaige_assistant_provider: ExchaigeAssistantProvider
+        exchaige_assistant_provider: ExchaigeAssistantProvider,
+        vendor_directory: VendorDirectory
     ):
         self._redis = redis.create()
         self._exchaige_assistant_provider = exchaige_assistant_provider
+        self._vendor_directory = vendor_directory
 
     @abc.abstractmethod
     async def receive_message(self, update: Update, context: CustomContext) -> None:
@@ -73,26 +94,89 @@ class TelegramBotBaseHandler:
         self,
         account: TelegramAccount,
         chat_group: TelegramChatGroup,
-        is_customer_service: bool = False
+        is_customer_service: bool = False,
+        skip_unchanged: bool = False
     ) -> None:
         """
         setup account info
         :param account:
         :param chat_group:
         :param is_customer_service:
+        :param skip_unchanged: skip the writes whose payload hasn't changed within the refresh interval
         :return:
         """
-        tasks = [
-            self._exchaige_assistant_provider.set_account(account=account),
-            self._exchaige_assistant_provider.set_group(group=chat_group)
-        ]
-        await asyncio.gather(*tasks)
         data = {
             "account_id": account.id,
             "chat_group_id": chat_group.id,
             "is_customer_service": is_customer_service
         }
-        await self._exchaige_assistant_provider.init_chat_group_member(data=data)
+        account_key = f"account:{account.id}"
+        group_key = f"group:{chat_group.id}"
+        member_key = f"member:{chat_group.id}:{account.id}"
+        fingerprints = {
+            account_key: account_info_fingerprints.fingerprint(account),
+            group_key: account_info_fingerprints.fingerprint(chat_group),
+            member_key: account_info_fingerprints.fingerprint(data),
+        }
+        if skip_unchanged:
+            changed = await account_info_fingerprints.changed(redis=self._redis, fingerprints=fingerprints)
+        else:
+            changed = set(fingerprints)
+        if not changed:
+            return
+
+        # buffered and sent in bulk with the other chats' writes
+        writes = {}
+        if account_key in changed:
+            writes[account_key] = self._exchaige_assistant_provider.queue_set_account(account=account)
+        if group_key in changed:
+            writes[group_key] = self._exchaige_assistant_provider.queue_set_group(group=chat_group)
+        if member_key in changed:
+            writes[member_key] = self._exchaige_assistant_provider.queue_init_chat_group_member(data=data)
+        task = asyncio.create_task(self._remember_written(writes=writes, fingerprints=fingerprints))
+        _remembering.add(task)
+        task.add_done_callback(_remembering.discard)
+
+    async def _remember_written(self, writes: Dict[str, asyncio.Future], fingerprints: Dict[str, str]) -> None:
+        """
+        Remember the fingerprints of the writes once they are flushed upstream
+        :param writes:
+        :param fingerprints:
+        :return:
+        """
+        results = await asyncio.gather(*writes.values(), return_exceptions=True)
+        written = {
+            key: fingerprints[key]
+            for key, result in zip(writes, results)
+            if not isinstance(result, BaseException)
+        }
+        await account_info_fingerprints.remember(redis=self._redis, fingerprints=written)
+
+    async def submit_account_info(
+        self,
+        account: TelegramAccount,
+        chat_group: TelegramChatGroup,
+        is_customer_service: bool = False,
+        skip_unchanged: bool = False
+    ) -> None:
+        """
+        Queue setup_account_info on the bookkeeping pipeline
+        :param account:
+        :param chat_group:
+        :param is_customer_service:
+        :param skip_unchanged:
+        :return:
+        """
+        await bookkeeping.submit(
+            key=chat_group.id,
+            job=partial(
+                self.setup_account_info,
+                account=account,
+                chat_group=chat_group,
+                is_customer_service=is_customer_service,
+                skip_unchanged=skip_unchanged
+            )
+        )
 
     @distributed_trace()
     async def track_chats(self, update: Update, context: CustomContext) -> None:
@@ -120,16 +204,18 @@ class TelegramBotBaseHandler:
             except Exception as exc:
                 logger.exception(exc)
 
-        await self.setup_account_info(
+        chat_group = TelegramChatGroup(
+            **chat.to_dict(),
+            in_group=is_member,
+            bot_type=settings.TELEGRAM_BOT_TYPE,
+            payment_account_status=PaymentAccountStatus.PREPARING
+        )
+        await self.submit_account_info(
             account=TelegramAccount(**update.effective_user.to_dict()),
-            chat_group=TelegramChatGroup(
-                **chat.to_dict(),
-                in_group=is_member,
-                bot_type=settings.TELEGRAM_BOT_TYPE,
-                payment_account_status=PaymentAccountStatus.PREPARING
-            ),
+            chat_group=chat_group,
             is_customer_service=True
         )
+        self._vendor_directory.upsert(group=chat_group)
 
     @distributed_trace()
     async def new_member_handler(self, update: Update, context: CustomContext) -> None:
@@ -139,17 +225,20 @@ class TelegramBotBaseHandler:
         :param context:
         :return:
         """
+        chat_group = TelegramChatGroup(
+            **update.effective_chat.to_dict(),
+            in_group=True,
+            bot_type=settings.TELEGRAM_BOT_TYPE
+        )
         for new_member in update.message.new_chat_members:
             if new_member.is_bot:
                 continue
-            await self.setup_account_info(
+            await self.submit_account_info(
                 account=TelegramAccount(**new_member.to_dict()),
-                chat_group=TelegramChatGroup(
-                    **update.effective_chat.to_dict(),
-                    in_group=True,
-                    bot_type=settings.TELEGRAM_BOT_TYPE
-                ),
+                chat_group=chat_group,
             )
+            # the group may have been renamed or missed by track_chats
+            self._vendor_directory.upsert(group=chat_group)
 
     @distributed_trace()
     async def left_member_handler(self, update: Update, context: CustomContext) -> None:
@@ -162,7 +251,13 @@ class TelegramBotBaseHandler:
         left_member: User = update.message.left_chat_member
         if left_member.is_bot:
             return
-        await self._exchaige_assistant_provider.delete_chat_group_member(
-            account_id=left_member.id,
-            group_id=update.effective_chat.id
-        )
+        group_id = update.effective_chat.id
+
+        async def _queue_delete() -> None:
+            # in order with the group's other bookkeeping, sent with the next write-behind flush
+            self._exchaige_assistant_provider.queue_delete_chat_group_member(
+                account_id=left_member.id,
+                group_id=group_id
+            )
+
+        await bookkeeping.submit(key=group_id, job=_queue_delete)
@@ -13,7 +13,7 @@ from app.libs.consts.messages import PaymentAccountStatusMessage
 from app.libs.database import RedisPool
 from app.libs.decorators.sentry_tracer import distributed_trace
 from app.libs.logger import logger
-from app.providers import ExchaigeAssistantProvider
+from app.providers import ExchaigeAssistantProvider, VendorDirectory, exchaige_assistant_outbox
 from app.schemas.telegram.account import TelegramAccount, TelegramChatGroup
 from app.schemas.telegram.messages import PaymentAccountProcess
 from .base import TelegramBotBaseHandler
@@ -25,11 +25,13 @@ class TelegramBotMessagesHandler(TelegramBotBaseHandler):
     def __init__(
         self,
         redis: RedisPool,
-        exchaige_assistant_provider: ExchaigeAssistantProvider
+        exchaige_assistant_provider: ExchaigeAssistantProvider,
+        vendor_directory: VendorDirectory
     ):
         super().__init__(
             redis=redis,
-            exchaige_assistant_provider=exchaige_assistant_provider
+            exchaige_assistant_provider=exchaige_assistant_provider,
+            vendor_directory=vendor_directory
         )
         self._exchaige_assistant_provider = exchaige_assistant_provider
 
@@ -41,6 +43,21 @@ class TelegramBotMessagesHandler(TelegramBotBaseHandler):
         """
         return f"{settings.APP_NAME}:{name}"
 
+    async def append_intent(self, action: str, idempotency_key: str, **payload) -> None:
+        """
+        Hand a state-changing ExchaigeAssistant call to the outbox, it is delivered in the background
+        :param action: the ExchaigeAssistantProvider method
+        :param idempotency_key:
+        :param payload: its JSON serializable arguments
+        :return:
+        """
+        await exchaige_assistant_outbox.append(
+            self._redis,
+            action=action,
+            payload=payload,
+            idempotency_key=idempotency_key
+        )
+
     @distributed_trace()
     async def receive_message(self, update: Update, context: CustomContext) -> None:
         """
@@ -49,13 +66,14 @@ class TelegramBotMessagesHandler(TelegramBotBaseHandler):
         :param context:
         :return:
         """
-        await self.setup_account_info(
+        await self.submit_account_info(
             account=TelegramAccount(**update.effective_user.to_dict()),
             chat_group=TelegramChatGroup(
                 **update.effective_chat.to_dict(),
                 in_group=True,
                 bot_type=settings.TELEGRAM_BOT_TYPE
-            )
+            ),
+            skip_unchanged=True
         )
         chat_id = update.effective_chat.id
         reply_message_id = update.effective_message.reply_to_message.message_id if update.effective_message.reply_to_message else None
@@ -117,8 +135,17 @@ class TelegramBotMessagesHandler(TelegramBotBaseHandler):
             exchange_rate_list = message.split("\n")
         else:
             exchange_rate_list = [message]
-        currencies = await self._exchaige_assistant_provider.get_currencies()
-        currency_symbol_mapping = {currency.symbol: currency.id for currency in currencies.currencies}
+        try:
+            currencies = await self._exchaige_assistant_provider.get_currencies()
+        except Exception as e:
+            # fails fast while the ExchaigeAssistant circuit is open
+            logger.exception(e)
+            await update.effective_message.reply_text(
+                text="Sorry, something went wrong\. Please try again later\.",
+                parse_mode=ParseMode.MARKDOWN_V2
+            )
+            return
+        currency_symbol_mapping = currencies.symbol_mapping
         errors = []
         currency_rates = []
         for exchange_rate in exchange_rate_list:
@@ -166,7 +193,9 @@ class TelegramBotMessagesHandler(TelegramBotBaseHandler):
                     }
                 )
         try:
-            await self._exchaige_assistant_provider.update_exchange_rate(
+            await self.append_intent(
+                action="update_exchange_rate",
+                idempotency_key=f"update_exchange_rate:{update.update_id}",
                 group_id=update.effective_chat.id,
                 currency_rates=currency_rates
             )
@@ -227,11 +256,13 @@ class TelegramBotMessagesHandler(TelegramBotBaseHandler):
         callback_query = update.callback_query
         _, customer_id, order_id = cast(str, callback_query.data).split()
         try:
-            await self._exchaige_assistant_provider.payment_account_out_of_stock(
+            await self.append_intent(
+                action="payment_account_out_of_stock",
+                idempotency_key=f"payment_account_out_of_stock:{order_id}",
                 group_id=update.effective_chat.id,
                 customer_id=int(customer_id),
                 order_id=order_id,
-                status=PaymentAccountStatus.OUT_OF_STOCK
+                status=PaymentAccountStatus.OUT_OF_STOCK.value
             )
             edit_text = f"{update.effective_message.text_markdown_v2}\n\n\(Selected *Out of Stock*\)"
             await update.effective_message.edit_text(
@@ -256,11 +287,13 @@ class TelegramBotMessagesHandler(TelegramBotBaseHandler):
         """
         message = update.effective_message
         try:
-            await self._exchaige_assistant_provider.send_payment_account(
+            await self.append_intent(
+                action="send_payment_account",
+                idempotency_key=f"send_payment_account:{message.chat_id}:{message.message_id}",
                 message=message.text,
                 message_id=message.message_id,
                 customer_id=model.customer_id,
-                order_id=model.order_id
+                order_id=str(model.order_id)
             )
         except Exception as e:
             logger.exception(e)
@@ -311,8 +344,14 @@ class TelegramBotMessagesHandler(TelegramBotBaseHandler):
         callback_query = update.callback_query
         _, status = cast(str, callback_query.data).split()
         try:
-            await self._exchaige_assistant_provider.update_payment_account_status(
+            await self.append_intent(
+                action="update_payment_account_status",
+                idempotency_key=f"update_payment_account_status:{update.update_id}",
                 group_id=update.effective_chat.id,
+                status=PaymentAccountStatus(status).value
+            )
+            self._vendor_directory.update_payment_account_status(
+                vendor_id=update.effective_chat.id,
                 status=PaymentAccountStatus(status)
             )
             edit_text = f"{update.effective_message.text_markdown_v2}"
@@ -341,7 +380,9 @@ class TelegramBotMessagesHandler(TelegramBotBaseHandler):
         callback_query = update.callback_query
         _, customer_id, order_id = cast(str, callback_query.data).split()
         try:
-            await self._exchaige_assistant_provider.confirm_pay(
+            await self.append_intent(
+                action="confirm_pay",
+                idempotency_key=f"confirm_pay:{order_id}",
                 customer_id=int(customer_id),
                 order_id=order_id
             )
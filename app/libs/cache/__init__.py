@@ -0,0 +1,16 @@
+"""
+Top-level package for cache.
+"""
+from .disk_lru import DiskLRUCache
+from .fingerprint import FingerprintCache
+from .idempotency import IdempotencyStore
+from .refresh_ahead import RefreshAheadCache
+from .telegram_file import TelegramFileIdCache
+
+__all__ = [
+    "DiskLRUCache",
+    "FingerprintCache",
+    "IdempotencyStore",
+    "RefreshAheadCache",
+    "TelegramFileIdCache",
+]
@@ -0,0 +1,172 @@
+"""
+DiskLRUCache
+"""
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, IO, Optional, Union
+
+from app.libs.http_client import SingleFlight
+from app.libs.logger import logger
+from app.libs.metrics import metrics
+
+_TMP_PREFIX = ".tmp-"
+
+
+class _MappedFile(mmap.mmap):
+    """
+    Read only memory map, seek returns the new position like a file object's does,
+    so a request body built from it gets a content length
+    """
+
+    def seek(self, pos: int, whence: int = os.SEEK_SET) -> int:
+        super().seek(pos, whence)
+        return self.tell()
+
+
+class DiskLRUCache:
+    """
+    Files kept on the local disk up to `max_bytes`, the least recently used are evicted first.
+    - a file is written to a temporary file and renamed, a reader never sees a partial file
+    - a file is read through a memory map, its pages stay in the page cache rather than the heap
+    - concurrent misses of a file share one download
+    The recency survives a restart through the files' modification time, a max_bytes of 0 disables the cache.
+    """
+
+    def __init__(self, name: str, directory: Union[str, Path], max_bytes: int):
+        self.name = name
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._index: Optional["OrderedDict[str, int]"] = None
+        self._single_flight = SingleFlight(name=f"disk_cache.{name}")
+        metrics.register_collector(f"disk_cache.{name}", self._collect)
+
+    @property
+    def enabled(self) -> bool:
+        """enabled"""
+        return self.max_bytes > 0
+
+    def _collect(self) -> dict:
+        """
+        :return:
+        """
+        hits = metrics.get_counter("disk_cache.lookups", cache=self.name, result="hit")
+        misses = metrics.get_counter("disk_cache.lookups", cache=self.name, result="miss")
+        return {
+            f"disk_cache.bytes{{cache={self.name}}}": self.size,
+            f"disk_cache.files{{cache={self.name}}}": len(self._index or ()),
+            f"disk_cache.hit_rate{{cache={self.name}}}": hits / (hits + misses) if hits + misses else 0.0,
+        }
+
+    @staticmethod
+    def digest(key: str) -> str:
+        """
+        file name of a key
+        :param key:
+        :return:
+        """
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @property
+    def index(self) -> "OrderedDict[str, int]":
+        """digest -> size, least recently used first, loaded from the directory on first use"""
+        if self._index is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            entries = []
+            for path in self.directory.iterdir():
+                if path.name.startswith(_TMP_PREFIX):
+                    # left over by an interrupted write
+                    path.unlink(missing_ok=True)
+                    continue
+                stat = path.stat()
+                entries.append((stat.st_mtime, path.name, stat.st_size))
+            self._index = OrderedDict((name, size) for _, name, size in sorted(entries))
+            self.size = sum(self._index.values())
+            self._evict()
+        return self._index
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """
+        Drop the least recently used files until the cache fits `max_bytes`
+        :param keep: the file just written, kept even when it alone exceeds the limit
+        :return:
+        """
+        for digest in list(self._index):
+            if self.size <= self.max_bytes:
+                return
+            if digest == keep:
+                continue
+            self.size -= self._index.pop(digest)
+            (self.directory / digest).unlink(missing_ok=True)
+            metrics.incr("disk_cache.evictions", cache=self.name)
+
+    def _open(self, digest: str) -> Optional[IO[bytes]]:
+        """
+        Memory map of a cached file, None when it isn't cached
+        :param digest:
+        :return:
+        """
+        if digest not in self.index:
+            return None
+        path = self.directory / digest
+        try:
+            with open(path, "rb") as file:
+                if self.index[digest] == 0:
+                    data = io.BytesIO()
+                else:
+                    data = _MappedFile(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            self.size -= self.index.pop(digest)
+            return None
+        self.index.move_to_end(digest)
+        os.utime(path)
+        return data
+
+    async def put(self, key: str, write: Callable[[IO[bytes]], Awaitable[None]]) -> None:
+        """
+        Write a file, atomically
+        :param key:
+        :param write: writes the content to the file it is given, e.g. the chunks of a download
+        :return:
+        """
+        digest = self.digest(key)
+        index = self.index
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=_TMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                await write(file)
+            os.replace(tmp_path, self.directory / digest)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        size = os.path.getsize(self.directory / digest)
+        self.size += size - index.pop(digest, 0)
+        index[digest] = size
+        self._evict(keep=digest)
+
+    @asynccontextmanager
+    async def open(self, key: str, download: Callable[[IO[bytes]], Awaitable[None]]) -> AsyncIterator[IO[bytes]]:
+        """
+        Read a file, downloaded on a miss
+        :param key:
+        :param download: writes the content to the file it is given
+        :return: a read only memory map of the file
+        """
+        digest = self.digest(key)
+        data = self._open(digest)
+        metrics.incr("disk_cache.lookups", cache=self.name, result="miss" if data is None else "hit")
+        while data is None:
+            await self._single_flight.do(key=digest, func=lambda: self.put(key, download))
+            data = self._open(digest)
+            if data is None:
+                logger.info(f"disk cache {self.name}: {key} evicted before it was read, downloading again")
+        try:
+            yield data
+        finally:
+            data.close()
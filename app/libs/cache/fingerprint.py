@@ -0,0 +1,128 @@
+"""
+FingerprintCache
+"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Set, Tuple
+
+from pydantic import BaseModel
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.libs.logger import logger
+from app.libs.metrics import metrics
+
+
+class FingerprintCache:
+    """
+    Remembers the fingerprint of the last payload written upstream per key for `ttl` seconds,
+    so unchanged payloads can skip the write until the refresh interval has elapsed.
+    A bounded in-process LRU sits in front of Redis, which is shared by all the workers.
+    """
+
+    def __init__(self, name: str, ttl: float, maxsize: int = 10000):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._local: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    @staticmethod
+    def fingerprint(*payloads: Any) -> str:
+        """
+        Stable digest of pydantic models / json serializable values
+        :param payloads:
+        :return:
+        """
+        data = [payload.model_dump(mode="json") if isinstance(payload, BaseModel) else payload for payload in payloads]
+        return hashlib.blake2b(json.dumps(data, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+    def redis_name(self, key: str) -> str:
+        """
+        :param key:
+        :return:
+        """
+        return f"fingerprint:{self.name}:{key}"
+
+    def _get_local(self, key: str) -> Optional[str]:
+        """
+        :param key:
+        :return:
+        """
+        entry = self._local.get(key)
+        if entry is None:
+            return None
+        fingerprint, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._local[key]
+            return None
+        self._local.move_to_end(key)
+        return fingerprint
+
+    def _set_local(self, key: str, fingerprint: str, ttl: float) -> None:
+        """
+        :param key:
+        :param fingerprint:
+        :param ttl:
+        :return:
+        """
+        self._local[key] = (fingerprint, time.monotonic() + ttl)
+        self._local.move_to_end(key)
+        while len(self._local) > self.maxsize:
+            self._local.popitem(last=False)
+
+    async def changed(self, redis: Redis, fingerprints: Mapping[str, str]) -> Set[str]:
+        """
+        The keys whose fingerprint differs from the remembered one or has expired
+        :param redis:
+        :param fingerprints: key -> fingerprint
+        :return:
+        """
+        misses = []
+        for key, fingerprint in fingerprints.items():
+            if self._get_local(key) == fingerprint:
+                metrics.incr("fingerprint_cache.lookups", cache=self.name, result="local")
+            else:
+                misses.append(key)
+        if not misses:
+            return set()
+
+        changed = set(misses)
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                for key in misses:
+                    pipe.get(self.redis_name(key))
+                    pipe.pttl(self.redis_name(key))
+                results = await pipe.execute()
+        except RedisError as exc:
+            logger.warning(f"fingerprint cache {self.name} unavailable: {exc}")
+            results = [None, -2] * len(misses)
+        for index, key in enumerate(misses):
+            remembered, pttl = results[index * 2], results[index * 2 + 1]
+            if remembered is not None and remembered == fingerprints[key] and pttl > 0:
+                self._set_local(key, remembered, ttl=pttl / 1000)
+                changed.discard(key)
+                metrics.incr("fingerprint_cache.lookups", cache=self.name, result="redis")
+            else:
+                metrics.incr("fingerprint_cache.lookups", cache=self.name, result="miss")
+        return changed
+
+    async def remember(self, redis: Redis, fingerprints: Dict[str, str]) -> None:
+        """
+        Remember the fingerprints once their payloads are written upstream
+        :param redis:
+        :param fingerprints: key -> fingerprint
+        :return:
+        """
+        if not fingerprints:
+            return
+        for key, fingerprint in fingerprints.items():
+            self._set_local(key, fingerprint, ttl=self.ttl)
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                for key, fingerprint in fingerprints.items():
+                    pipe.set(name=self.redis_name(key), value=fingerprint, px=int(self.ttl * 1000))
+                await pipe.execute()
+        except RedisError as exc:
+            logger.warning(f"fingerprint cache {self.name} unavailable: {exc}")
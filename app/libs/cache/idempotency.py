@@ -0,0 +1,120 @@
+"""
+IdempotencyStore
+"""
+import asyncio
+import json
+import time
+from typing import Any, Awaitable, Callable
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.libs.http_client import SingleFlight
+from app.libs.logger import logger
+from app.libs.metrics import metrics
+
+_PENDING = "pending"
+
+
+class IdempotencyStore:
+    """
+    Runs a request once per idempotency key and remembers its response for `ttl` seconds, a replay gets it back.
+    The first request claims the key with SET NX for `lock_ttl` seconds, renewed while it runs:
+    concurrent duplicates wait for it, in this process and in the others, instead of running again.
+    A request which fails releases the key, its retry runs again.
+    """
+
+    def __init__(self, name: str, ttl: float, lock_ttl: float, poll_interval: float = 0.05):
+        self.name = name
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self._single_flight = SingleFlight(name=f"idempotency.{name}")
+
+    def redis_name(self, key: str) -> str:
+        """
+        :param key:
+        :return:
+        """
+        return f"idempotency:{self.name}:{key}"
+
+    async def run(self, redis: Redis, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        The response of the request `key`, `func` runs unless it already ran or is running
+        :param redis:
+        :param key:
+        :param func: returns a JSON serializable response
+        :return:
+        """
+        return await self._single_flight.do(key=key, func=lambda: self._run(redis, key, func))
+
+    async def _run(self, redis: Redis, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        :param redis:
+        :param key:
+        :param func:
+        :return:
+        """
+        name = self.redis_name(key)
+        waited_since = None
+        while True:
+            try:
+                claimed = await redis.set(name=name, value=_PENDING, nx=True, px=int(self.lock_ttl * 1000))
+                stored = None if claimed else await redis.get(name)
+            except RedisError as exc:
+                logger.warning(f"idempotency store {self.name} unavailable, running {key} unguarded: {exc}")
+                return await func()
+            if claimed:
+                break
+            if stored is not None and stored != _PENDING:
+                metrics.incr("idempotency.requests", store=self.name, result="replayed")
+                return json.loads(stored)["response"]
+            # running in another process, or released by its failure
+            if waited_since is None:
+                waited_since = time.monotonic()
+                metrics.incr("idempotency.requests", store=self.name, result="waited")
+            await asyncio.sleep(self.poll_interval)
+
+        if waited_since is not None:
+            metrics.observe("idempotency.wait", time.monotonic() - waited_since, store=self.name)
+        try:
+            response = await self._run_claimed(redis, key, func)
+        except BaseException:
+            try:
+                await redis.delete(name)
+            except RedisError as exc:
+                logger.warning(f"idempotency store {self.name} unavailable, {key} stays claimed: {exc}")
+            raise
+        metrics.incr("idempotency.requests", store=self.name, result="executed")
+        try:
+            await redis.set(name=name, value=json.dumps({"response": response}, default=str), ex=int(self.ttl))
+        except RedisError as exc:
+            logger.warning(f"idempotency store {self.name} unavailable, {key} not remembered: {exc}")
+        return response
+
+    async def _run_claimed(self, redis: Redis, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run `func`, its claim on the key is renewed every `lock_ttl` / 3 seconds until it returns
+        :param redis:
+        :param key:
+        :param func:
+        :return:
+        """
+        keeper = asyncio.create_task(self._keep_claim(redis, key))
+        try:
+            return await func()
+        finally:
+            keeper.cancel()
+
+    async def _keep_claim(self, redis: Redis, key: str) -> None:
+        """
+        :param redis:
+        :param key:
+        :return:
+        """
+        while True:
+            await asyncio.sleep(self.lock_ttl / 3)
+            try:
+                await redis.pexpire(self.redis_name(key), int(self.lock_ttl * 1000))
+            except RedisError as exc:
+                logger.warning(f"idempotency store {self.name} unavailable, {key} claim not renewed: {exc}")
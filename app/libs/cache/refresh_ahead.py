@@ -0,0 +1,119 @@
+"""
+RefreshAheadCache
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Generic, Optional, TypeVar
+
+from app.libs.logger import logger
+from app.libs.metrics import metrics
+
+T = TypeVar("T")
+
+
+class RefreshAheadCache(Generic[T]):
+    """
+    In-process cache of a single value with a TTL.
+    - fresh: served from memory
+    - within `refresh_ahead` seconds of the expiry: served from memory, reloaded in the background
+    - expired: reloaded, the stale value is served if the reload fails and it is less than
+      `stale_if_error` seconds past the expiry
+    Concurrent loads share one call of the loader, a load started before invalidate() isn't cached.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        loader: Optional[Callable[[], Awaitable[T]]] = None,
+        refresh_ahead: float = 0.0,
+        stale_if_error: float = 0.0
+    ):
+        self.name = name
+        self._loader = loader
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.stale_if_error = stale_if_error
+        self._value: Optional[T] = None
+        self._loaded_at: Optional[float] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._generation = 0
+
+    @property
+    def age(self) -> Optional[float]:
+        """seconds since the value was loaded"""
+        if self._loaded_at is None:
+            return None
+        return time.monotonic() - self._loaded_at
+
+    def invalidate(self) -> None:
+        """
+        Drop the cached value, the next get() loads it again
+        :return:
+        """
+        self._value = None
+        self._loaded_at = None
+        # a load in flight fetched the old value
+        self._generation += 1
+        self._refresh_task = None
+        metrics.incr("cache.invalidations", cache=self.name)
+
+    async def _load(self, loader: Callable[[], Awaitable[T]], generation: int) -> T:
+        """
+        :param loader:
+        :param generation: the generation the load was started in
+        :return:
+        """
+        value = await loader()
+        if generation != self._generation:
+            metrics.incr("cache.loads_discarded", cache=self.name)
+            return value
+        self._value = value
+        self._loaded_at = time.monotonic()
+        metrics.incr("cache.loads", cache=self.name)
+        return value
+
+    def _on_refreshed(self, task: asyncio.Task) -> None:
+        """
+        :param task:
+        :return:
+        """
+        if not task.cancelled() and task.exception():
+            metrics.incr("cache.refresh_errors", cache=self.name)
+            logger.warning(f"{self.name} refresh failed: {task.exception()}")
+
+    def _refresh(self, loader: Callable[[], Awaitable[T]]) -> asyncio.Task:
+        """
+        The refresh in flight, started when there is none
+        :param loader:
+        :return:
+        """
+        task = self._refresh_task
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = self._refresh_task = asyncio.create_task(self._load(loader, self._generation))
+            task.add_done_callback(self._on_refreshed)
+        return task
+
+    async def get(self, loader: Optional[Callable[[], Awaitable[T]]] = None) -> T:
+        """
+        :param loader: loads the value when it must be, the cache's loader by default
+        :return:
+        """
+        loader = loader or self._loader
+        age = self.age
+        if age is not None and age < self.ttl:
+            metrics.incr("cache.requests", cache=self.name, result="hit")
+            if age >= self.ttl - self.refresh_ahead:
+                self._refresh(loader)
+            return self._value
+
+        metrics.incr("cache.requests", cache=self.name, result="miss")
+        try:
+            # shield: a cancelled caller mustn't cancel the load the others wait for
+            return await asyncio.shield(self._refresh(loader))
+        except Exception as exc:
+            if age is None or age >= self.ttl + self.stale_if_error:
+                raise exc
+            metrics.incr("cache.stale_served", cache=self.name)
+            logger.warning(f"{self.name} reload failed, serving the stale value: {exc}")
+            return self._value
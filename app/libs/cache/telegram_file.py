@@ -0,0 +1,79 @@
+"""
+TelegramFileIdCache
+"""
+from typing import Optional
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.libs.logger import logger
+from app.libs.metrics import metrics
+
+
+class TelegramFileIdCache:
+    """
+    Remembers the Telegram file_id of a file once it has been uploaded, for `ttl` seconds,
+    so the next sends reference it instead of downloading and uploading the bytes again.
+    A Telegram file_id is valid for the bot that uploaded it, in any chat.
+    """
+
+    def __init__(self, name: str, ttl: float):
+        self.name = name
+        self.ttl = ttl
+        metrics.register_collector(f"telegram_file_cache.{name}", self._collect)
+
+    def _collect(self) -> dict:
+        """
+        :return:
+        """
+        hits = metrics.get_counter("telegram_file_cache.lookups", cache=self.name, result="hit")
+        misses = metrics.get_counter("telegram_file_cache.lookups", cache=self.name, result="miss")
+        lookups = hits + misses
+        return {f"telegram_file_cache.hit_rate{{cache={self.name}}}": hits / lookups if lookups else 0.0}
+
+    def redis_name(self, key: str) -> str:
+        """
+        :param key:
+        :return:
+        """
+        return f"telegram_file:{self.name}:{key}"
+
+    async def get(self, redis: Redis, key: str) -> Optional[str]:
+        """
+        The Telegram file_id of a file, None when it was never uploaded or has expired
+        :param redis:
+        :param key: the file at the source, e.g. its id and name upstream
+        :return:
+        """
+        try:
+            file_id = await redis.get(self.redis_name(key))
+        except RedisError as exc:
+            logger.warning(f"telegram file cache {self.name} unavailable: {exc}")
+            file_id = None
+        metrics.incr("telegram_file_cache.lookups", cache=self.name, result="miss" if file_id is None else "hit")
+        return file_id
+
+    async def set(self, redis: Redis, key: str, file_id: str) -> None:
+        """
+        Remember the Telegram file_id of an uploaded file
+        :param redis:
+        :param key:
+        :param file_id:
+        :return:
+        """
+        try:
+            await redis.set(name=self.redis_name(key), value=file_id, ex=int(self.ttl))
+        except RedisError as exc:
+            logger.warning(f"telegram file cache {self.name} unavailable: {exc}")
+
+    async def forget(self, redis: Redis, key: str) -> None:
+        """
+        Drop a file_id Telegram no longer accepts
+        :param redis:
+        :param key:
+        :return:
+        """
+        try:
+            await redis.delete(self.redis_name(key))
+        except RedisError as exc:
+            logger.warning(f"telegram file cache {self.name} unavailable: {exc}")
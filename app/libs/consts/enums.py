@@ -16,6 +16,13 @@ class PaymentAccountStatus(StrEnum):
     OUT_OF_STOCK = "out_of_stock"
 
 
+class BroadcastJobStatus(StrEnum):
+    """BroadcastJobStatus"""
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+
+
 class Language(StrEnum):
     """Language"""
     EN_US = "en-us"
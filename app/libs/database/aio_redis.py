@@ -7,7 +7,9 @@ from app.config import settings
 
 
 class RedisPool:
-    """RedisPool"""
+    """
+    RedisPool, the connection pool of the process, the container opens it once and closes it on shutdown
+    """
 
     def __init__(self):
         self._uri = settings.REDIS_URL
@@ -28,3 +30,19 @@ class RedisPool:
         )
         self._redis = session
         return session
+
+    async def close(self) -> None:
+        """
+        Close the connections of the pool
+        :return:
+        """
+        if self._redis is None:
+            return
+        redis, self._redis = self._redis, None
+        await redis.aclose()
+
+    async def __aenter__(self) -> "RedisPool":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
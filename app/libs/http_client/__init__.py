@@ -1,8 +1,20 @@
 """
 Top-level package for http_client.
 """
-from .http_client import http_client
+from .http_client import http_client, HttpClient, HttpDefaults, HttpHostOptions
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, CircuitState
+from .retry import RetryPolicy, RetryBudget
+from .single_flight import SingleFlight
 
 __all__ = [
-    'http_client'
+    'http_client',
+    'HttpClient',
+    'HttpDefaults',
+    'HttpHostOptions',
+    'CircuitBreaker',
+    'CircuitOpenError',
+    'CircuitState',
+    'RetryPolicy',
+    'RetryBudget',
+    'SingleFlight',
 ]
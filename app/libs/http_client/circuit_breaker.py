@@ -0,0 +1,130 @@
+"""Circuit breaker"""
+import logging
+import time
+from enum import StrEnum
+from typing import Optional
+
+import httpx
+
+from app.libs.metrics import metrics
+
+breaker_logger = logging.getLogger("http_client")
+
+
+class CircuitState(StrEnum):
+    """CircuitState"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+CIRCUIT_STATE_VALUES = {
+    CircuitState.CLOSED: 0,
+    CircuitState.HALF_OPEN: 1,
+    CircuitState.OPEN: 2,
+}
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised without calling the host while its circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    CircuitBreaker of one host.
+    CLOSED: calls go through, `failure_threshold` consecutive failures open the circuit.
+    OPEN: calls fail fast with CircuitOpenError for `reset_timeout` seconds.
+    HALF_OPEN: `half_open_max_calls` probes go through, a success closes the circuit, a failure re-opens it.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        half_open_max_calls: int = 1
+    ):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._half_open_calls = 0
+        metrics.gauge("http_client.circuit_breaker.state", CIRCUIT_STATE_VALUES[self._state], host=host)
+
+    @property
+    def state(self) -> CircuitState:
+        """state"""
+        if self._state == CircuitState.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._transition(CircuitState.HALF_OPEN)
+        return self._state
+
+    def _transition(self, state: CircuitState) -> None:
+        """
+        :param state:
+        :return:
+        """
+        breaker_logger.warning(f"{self.host} circuit {self._state} -> {state}")
+        self._state = state
+        self._half_open_calls = 0
+        if state == CircuitState.OPEN:
+            self._opened_at = time.monotonic()
+        elif state == CircuitState.CLOSED:
+            self._failures = 0
+        metrics.gauge("http_client.circuit_breaker.state", CIRCUIT_STATE_VALUES[state], host=self.host)
+        metrics.incr("http_client.circuit_breaker.transitions", host=self.host, state=state.value)
+
+    def before_call(self) -> None:
+        """
+        Let the call through or fail fast
+        :return:
+        """
+        state = self.state
+        if state == CircuitState.CLOSED:
+            return
+        if state == CircuitState.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+            self._half_open_calls += 1
+            return
+        metrics.incr("http_client.circuit_breaker.rejected", host=self.host)
+        raise CircuitOpenError(f"Circuit of {self.host} is open, call rejected")
+
+    def release(self) -> None:
+        """
+        Give back the probe slot of a call which ended without telling whether the host is alive
+        (cancelled, failed on our side), the next call probes the host
+        :return:
+        """
+        if self._state == CircuitState.HALF_OPEN and self._half_open_calls > 0:
+            self._half_open_calls -= 1
+
+    def record_success(self) -> None:
+        """
+        :return:
+        """
+        if self._state == CircuitState.HALF_OPEN:
+            self._transition(CircuitState.CLOSED)
+        self._failures = 0
+
+    def record_failure(self) -> None:
+        """
+        :return:
+        """
+        if self._state == CircuitState.HALF_OPEN:
+            self._transition(CircuitState.OPEN)
+            return
+        self._failures += 1
+        if self._state == CircuitState.CLOSED and self._failures >= self.failure_threshold:
+            self._transition(CircuitState.OPEN)
+
+    def record_response(self, response: httpx.Response) -> None:
+        """
+        A 5xx counts as a failure, anything else proves the host is alive
+        :param response:
+        :return:
+        """
+        if response.status_code >= 500:
+            self.record_failure()
+        else:
+            self.record_success()
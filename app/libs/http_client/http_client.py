@@ -4,14 +4,18 @@ import json
 import logging
 import sys
 import time
+from contextlib import asynccontextmanager
 from copy import deepcopy
-from dataclasses import dataclass
-from typing import Any, Dict, Optional, Union, overload, AsyncIterator
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, Optional, Union, overload, AsyncIterator, Tuple
 
 import httpx
 from httpx._types import FileTypes  # noqa
 
 from app.config import settings
+from .circuit_breaker import CircuitBreaker
+from .retry import RetryPolicy, RetryState, RETRY_EXCEPTIONS
+from .single_flight import SingleFlight
 
 request_logger = logging.getLogger("http_client")
 handler = logging.StreamHandler(sys.stdout)
@@ -24,14 +28,41 @@ handler.setFormatter(
 request_logger.addHandler(handler)
 request_logger.setLevel(logging.DEBUG)
 
+try:
+    import h2  # noqa  # pylint: disable=unused-import
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+@dataclass
+class HttpHostOptions:
+    """HttpHostOptions, the per-host overrides of HttpDefaults"""
+    http2: Optional[bool] = None
+    http2_prior_knowledge: bool = False
+    max_retries: Optional[int] = None
+    max_connections: Optional[int] = None
+    max_keepalive_connections: Optional[int] = None
+    keepalive_expiry: Optional[float] = None
+
 
 @dataclass
 class HttpDefaults:
     """HttpDefaults"""
+    # pylint: disable=too-many-instance-attributes
     base_url: str = None
     verbose: bool = None
     timeout: int = 30
     retry_interval: int = 5
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+    hosts: Dict[str, HttpHostOptions] = field(default_factory=dict)
+    retry_policy: RetryPolicy = field(default_factory=RetryPolicy)
+    circuit_failure_threshold: int = 5
+    circuit_reset_timeout: float = 30.0
+    http2_downgrade_cooldown: float = 300.0
 
 
 @dataclass
@@ -52,6 +83,10 @@ class HttpOptions:
     cookies: Optional[dict] = None
     redirects: bool = True
     verify: bool = True
+    pooled: bool = True
+    idempotent: Optional[bool] = None
+    retry_policy: Optional[RetryPolicy] = None
+    coalesce: bool = True
 
 
 # pylint: disable=missing-function-docstring
@@ -126,8 +161,10 @@ class HttpResponse:
         return self._response.read()
 
     def json(self) -> dict:
-        """json"""
-        return self._response.json()
+        """json, parsed once and shared by the callers of a coalesced request"""
+        if self._json_result is None:
+            self._json_result = self._response.json()
+        return self._json_result
 
     def elapsed(self):
         """elapsed"""
@@ -137,6 +174,10 @@ class HttpResponse:
         """aread"""
         return await self._response.aread()
 
+    async def aclose(self):
+        """aclose, gives the connection of a streamed response back to the pool"""
+        return await self._response.aclose()
+
     async def aiter_bytes(
         self,
         chunk_size: Optional[int] = None
@@ -153,11 +194,18 @@ class HttpResponse:
 class HttpSession:
     """HttpSession"""
 
-    def __init__(self, url: str, defaults: HttpDefaults = None, options: HttpOptions = None):
+    def __init__(
+        self,
+        url: str,
+        defaults: HttpDefaults = None,
+        options: HttpOptions = None,
+        http_client: "HttpClient" = None
+    ):
         self._options = options or HttpOptions()
         self._options.url = url
         self._client: Optional[httpx.AsyncClient] = None
-        self._from_session: bool = False
+        self._http_client: Optional[HttpClient] = http_client
+        self._from_pool: bool = False
         self.defaults: HttpDefaults = defaults
         self._st = time.time()
 
@@ -169,6 +217,11 @@ class HttpSession:
     async def _ensure_client_build(self):
         if self._client:
             return True
+        if self._options.pooled and self._http_client:
+            # borrow the long-lived pool of this origin, the owner closes it
+            self._client = self._http_client.get_pool(url=self._build_url(), verify=self._options.verify)
+            self._from_pool = True
+            return True
         self._client = httpx.AsyncClient(
             timeout=self._options.timeout or self.defaults.timeout,
             verify=self._options.verify
@@ -181,6 +234,8 @@ class HttpSession:
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._from_pool:
+            return
         await self._client.__aexit__(exc_type, exc_val, exc_tb)
 
     @property
@@ -199,6 +254,24 @@ class HttpSession:
         self._options.retry_interval = retry_interval
         return self
 
+    def coalesce(self, coalesce: bool):
+        """coalesce, share the response of an identical GET already in flight"""
+        self._options.coalesce = coalesce
+        return self
+
+    def idempotent(self, idempotent: bool):
+        """
+        idempotent, overrides the retry policy's classification of this request,
+        True only where the upstream is known to apply a resent request once
+        """
+        self._options.idempotent = idempotent
+        return self
+
+    def retry_policy(self, policy: RetryPolicy):
+        """retry_policy"""
+        self._options.retry_policy = policy
+        return self
+
     def timeout(self, timeout: int):
         """timeout"""
         self._options.timeout = timeout
@@ -209,6 +282,11 @@ class HttpSession:
         self._options.redirects = allow
         return self
 
+    def pooled(self, pooled: bool):
+        """pooled"""
+        self._options.pooled = pooled
+        return self
+
     def add_header(self, name: str, value: Any):
         """add_header"""
         if not name or value is None:
@@ -401,20 +479,8 @@ class HttpSession:
     def _format_returns(response: httpx.Response):
         return HttpResponse(response)
 
-    def _format_response(
-        self,
-        method: str,
-        response: httpx.Response,
-        retry_count: int,
-        is_last_time: bool
-    ):
+    def _format_response(self, method: str, response: httpx.Response):
         if response.status_code >= 500:
-            if not is_last_time:
-                request_logger.debug(
-                    f'{method} {self._options.url} Server returned status code '
-                    f'{response.status_code} ready to retry {retry_count + 1} times'
-                )
-                return None
             request_logger.debug(
                 f'{method} {self._options.url} '
                 f'The server returns a status code {response.status_code}'
@@ -422,6 +488,18 @@ class HttpSession:
         self._log_verbose(lambda: f'{self._format_log_response(response)}')
         return self._format_returns(response)
 
+    def _retry_response_debug_log(self, method: str, response: httpx.Response, retry_count: int, delay: float):
+        request_logger.debug(
+            f'{method} {self._options.url} Server returned status code '
+            f'{response.status_code} ready to retry {retry_count + 1} times in {delay:.2f}s'
+        )
+
+    def _retry_exhausted_debug_log(self, method: str, response: httpx.Response):
+        request_logger.debug(
+            f'{method} {self._options.url} Server returned status code '
+            f'{response.status_code} Maximum number of retries reached'
+        )
+
     def _retry_error_debug_log(
         self,
         method: str,
@@ -440,6 +518,27 @@ class HttpSession:
                 f'Maximum number of retries reached'
             )
 
+    def _get_max_attempts(self) -> int:
+        max_retries = self._options.max_retries
+        if max_retries is None and self._http_client:
+            max_retries = self._http_client.get_host_options(self._build_url()).max_retries
+        return (max_retries or 0) + 1
+
+    def _get_circuit_breaker(self, params: dict) -> Optional[CircuitBreaker]:
+        if not self._http_client:
+            return None
+        return self._http_client.get_circuit_breaker(params['url'])
+
+    def _start_retry(self, method: str, params: dict) -> RetryState:
+        policy = self._options.retry_policy or self.defaults.retry_policy
+        return policy.start(
+            method=method,
+            url=httpx.URL(params['url']),
+            headers=params['headers'],
+            idempotent=self._options.idempotent,
+            base_delay=self._options.retry_interval
+        )
+
     def get(self) -> HttpResponse:
         """get"""
         return self.request('GET')
@@ -456,6 +555,21 @@ class HttpSession:
         """delete"""
         return self.request('DELETE')
 
+    @staticmethod
+    def _sleep_sync(delay: float) -> bool:
+        """
+        Sleep before a synchronous retry, refused inside an event loop thread
+        :param delay:
+        :return: False when the retry must be abandoned
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            time.sleep(delay)
+            return True
+        request_logger.warning('Synchronous request retry skipped, it would block the event loop, use arequest')
+        return False
+
     # pylint: disable=inconsistent-return-statements
     def request(self, method: str) -> HttpResponse:
         """request"""
@@ -464,44 +578,37 @@ class HttpSession:
         params = self._build_params(method)
         self._log_verbose(lambda: f'{method} {self._format_log_url(params)}')
         self._log_verbose(lambda: f'{self._format_log_params(params)}')
-        max_retries = 1 if not self._options.max_retries else self._options.max_retries + 1
-        for i in range(max_retries):
-            is_last_time = (i + 1) == max_retries
+        max_attempts = self._get_max_attempts()
+        retry = self._start_retry(method, params)
+        breaker = self._get_circuit_breaker(params)
+        for i in range(max_attempts):
+            is_last_time = (i + 1) == max_attempts
+            if breaker:
+                breaker.before_call()
             try:
                 response = httpx.request(method=method, **params)
-                if (
-                    response.status_code >= 500
-                    and not is_last_time
-                    and self._options.retry_interval is not None
-                ):
-                    time.sleep(self._options.retry_interval)
-                formatted_response = self._format_response(
-                    method,
-                    response,
-                    retry_count=i,
-                    is_last_time=is_last_time
-                )
-                if not formatted_response:
-                    continue
-                return formatted_response
-            except (
-                asyncio.TimeoutError,
-                ConnectionRefusedError,
-                httpx.ConnectError,
-                httpx.ConnectTimeout,
-                httpx.ReadTimeout
-            ) as exc:  # pylint: disable=invalid-name
-                if i == max_retries - 1:
+            except RETRY_EXCEPTIONS as exc:  # pylint: disable=invalid-name
+                if breaker:
+                    breaker.record_failure()
+                delay = None if is_last_time else retry.next_delay(exception=exc)
+                self._retry_error_debug_log(method, is_last_time=delay is None, exception=exc, retry_count=i)
+                if delay is None or not self._sleep_sync(delay):
                     raise exc
-                if self._options.retry_interval is not None:
-                    time.sleep(self._options.retry_interval)
-                self._retry_error_debug_log(
-                    method.upper(),
-                    is_last_time=is_last_time,
-                    exception=exc,
-                    retry_count=i
-                )
                 continue
+            except BaseException:
+                if breaker:
+                    breaker.release()
+                raise
+            if breaker:
+                breaker.record_response(response)
+            delay = None if is_last_time else retry.next_delay(response=response)
+            if delay is not None:
+                self._retry_response_debug_log(method, response, retry_count=i, delay=delay)
+                if self._sleep_sync(delay):
+                    continue
+                # like the last attempt: the answer is returned as is
+                self._retry_exhausted_debug_log(method, response)
+            return self._format_response(method, response)
 
     async def aget(self) -> HttpResponse:
         """aget"""
@@ -523,81 +630,331 @@ class HttpSession:
         """adelete"""
         return await self.arequest('DELETE')
 
+    async def _asend(self, method: str, params: dict, retry: RetryState) -> httpx.Response:
+        try:
+            response = await self._client.request(method=method, **params)
+            if self._from_pool and response.http_version == 'HTTP/2':
+                self._http_client.confirm_http2(self._client)
+            return response
+        except httpx.ProtocolError as exc:
+            # a protocol error before any HTTP/2 response is a negotiation failure, a read / write error is not
+            if not self._from_pool or not self._http_client.downgrade_http2(self._build_url(), self._client):
+                raise exc
+            self._client = self._http_client.get_pool(url=self._build_url(), verify=self._options.verify)
+            if not retry.idempotent:
+                # the request may have reached the server, the retry policy decides
+                raise exc
+            request_logger.debug(f'{method} {self._options.url} {repr(exc)} Retry over HTTP/1.1')
+            return await self._client.request(method=method, **params)
+
+    def _get_coalesce_key(self, method: str, params: dict) -> tuple:
+        return (
+            method,
+            str(httpx.URL(params['url'], params=params['params'])),
+            tuple(sorted((key.lower(), str(value)) for key, value in params['headers'].items())),
+            tuple(sorted((params['cookies'] or {}).items())),
+            self._options.verify,
+        )
+
     async def arequest(self, method: str) -> HttpResponse:
         """arequest"""
         assert method, 'method cannot be none'
         method = method.upper()
         params = self._build_params(method)
+        if method == 'GET' and self._options.coalesce and self._http_client:
+            return await self._http_client.single_flight.do(
+                key=self._get_coalesce_key(method, params),
+                func=lambda: self._arequest(method, params)
+            )
+        return await self._arequest(method, params)
+
+    @asynccontextmanager
+    async def astream(self, method: str = 'GET') -> AsyncIterator[HttpResponse]:
+        """
+        Send the request and hand out the response before its body is read, read it with aiter_bytes.
+        The body is never buffered as a whole: no retry, no coalescing
+        :param method:
+        :return:
+        """
+        assert method, 'method cannot be none'
+        method = method.upper()
+        params = self._build_params(method)
         is_created = await self._ensure_client_build()
-        max_retries = 1 if not self._options.max_retries else self._options.max_retries + 1
+        breaker = self._get_circuit_breaker(params)
+        self._log_verbose(lambda: f'{method} {self._format_log_url(params)} (stream)')
+        try:
+            if breaker:
+                breaker.before_call()
+            recorded = False
+            try:
+                async with self._client.stream(method=method, **params) as response:
+                    if breaker:
+                        breaker.record_response(response)
+                    recorded = True
+                    self._log_verbose(
+                        lambda: f'{response.status_code} content-type:{response.headers.get("content-type")}, '
+                                f'content-length:{response.headers.get("content-length")}'
+                    )
+                    yield HttpResponse(response)
+            except RETRY_EXCEPTIONS:
+                if breaker:
+                    breaker.record_failure()
+                raise
+            except BaseException:
+                if breaker and not recorded:
+                    breaker.release()
+                raise
+        finally:
+            if not is_created and not self._client.is_closed:
+                await self._client.aclose()
+
+    # pylint: disable=inconsistent-return-statements
+    async def _arequest(self, method: str, params: dict) -> HttpResponse:
+        is_created = await self._ensure_client_build()
+        max_attempts = self._get_max_attempts()
+        retry = self._start_retry(method, params)
+        breaker = self._get_circuit_breaker(params)
         self._log_verbose(lambda: f'{method} {self._format_log_url(params)}')
         self._log_verbose(lambda: f'{self._format_log_params(params)}')
-        for i in range(max_retries):
-            is_last_time = (i + 1) == max_retries
-            try:
-                response = await self._client.request(method=method, **params)
-                if (
-                    response.status_code >= 500
-                    and not is_last_time
-                    and self._options.retry_interval is not None
-                ):
-                    await asyncio.sleep(self._options.retry_interval)
-                formatted_response = self._format_response(
-                    method,
-                    response,
-                    retry_count=i,
-                    is_last_time=is_last_time
-                )
-                if not formatted_response:
+        try:
+            for i in range(max_attempts):
+                is_last_time = (i + 1) == max_attempts
+                if breaker:
+                    breaker.before_call()
+                try:
+                    response = await self._asend(method, params, retry)
+                except RETRY_EXCEPTIONS as exc:  # pylint: disable=invalid-name
+                    if breaker:
+                        breaker.record_failure()
+                    delay = None if is_last_time else retry.next_delay(exception=exc)
+                    self._retry_error_debug_log(method, is_last_time=delay is None, exception=exc, retry_count=i)
+                    if delay is None:
+                        raise exc
+                    await asyncio.sleep(delay)
                     continue
-                if not is_created and not self._client.is_closed:
-                    await self._client.aclose()
-                return formatted_response
-            except (
-                asyncio.TimeoutError,
-                ConnectionRefusedError,
-                httpx.ConnectTimeout,
-                httpx.ConnectError,
-                httpx.ReadTimeout,
-                httpx.RemoteProtocolError
-            ) as exc:  # pylint: disable=invalid-name
-                if is_last_time:
-                    if not is_created and not self._client.is_closed:
-                        await self._client.aclose()
-                    raise exc
-                if self._options.retry_interval is not None:
-                    await asyncio.sleep(self._options.retry_interval)
-                self._retry_error_debug_log(
-                    method.upper(),
-                    is_last_time=is_last_time,
-                    exception=exc,
-                    retry_count=i
-                )
-                continue
-            finally:
-                if is_last_time and not is_created and not self._client.is_closed:
-                    await self._client.aclose()
+                except BaseException:
+                    # cancelled or failed on our side (pool timeout, TLS, ...), the probe slot is given back
+                    if breaker:
+                        breaker.release()
+                    raise
+                if breaker:
+                    breaker.record_response(response)
+                delay = None if is_last_time else retry.next_delay(response=response)
+                if delay is not None:
+                    self._retry_response_debug_log(method, response, retry_count=i, delay=delay)
+                    await asyncio.sleep(delay)
+                    continue
+                return self._format_response(method, response)
+        finally:
+            if not is_created and not self._client.is_closed:
+                await self._client.aclose()
 
     async def aclose(self):
         """aclose"""
-        if not self._client:
+        if not self._client or self._from_pool:
             return
         await self._client.aclose()
 
 
-# pylint: disable=too-few-public-methods
 class HttpClient:
     """HttpClient"""
 
     def __init__(self, defaults: HttpDefaults = None):
-        self.defaults: HttpDefaults = defaults or HttpDefaults(verbose=settings.DEBUG)
+        self.defaults: HttpDefaults = defaults or HttpDefaults(
+            verbose=settings.DEBUG,
+            max_connections=settings.HTTP_CLIENT_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_CLIENT_KEEPALIVE_EXPIRY,
+            circuit_failure_threshold=settings.HTTP_CLIENT_CIRCUIT_FAILURE_THRESHOLD,
+            circuit_reset_timeout=settings.HTTP_CLIENT_CIRCUIT_RESET_TIMEOUT
+        )
+        self._pools: Dict[Tuple[str, bool], httpx.AsyncClient] = {}
+        self._http2_pools: Dict[Tuple[str, bool], httpx.AsyncClient] = {}
+        self._http2_confirmed: set = set()
+        self._circuit_breakers: Dict[str, CircuitBreaker] = {}
+        self.single_flight = SingleFlight(name="http_client")
+        # origin -> time.monotonic() until which it is spoken to over HTTP/1.1
+        self._http1_only: Dict[str, float] = {}
+        self._retired: list = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
 
     def create(self, url: str = None) -> HttpSession:
         """
         :param url:
         :return:
         """
-        return HttpSession(url, self.defaults, HttpOptions())
+        return HttpSession(url, self.defaults, HttpOptions(), http_client=self)
+
+    @staticmethod
+    def _get_origin(url: str) -> str:
+        """
+        scheme://host:port of the url
+        :param url:
+        :return:
+        """
+        parsed = httpx.URL(url)
+        return f"{parsed.scheme}://{parsed.host}:{parsed.port or (443 if parsed.scheme == 'https' else 80)}"
+
+    def configure_host(self, url: str, options: HttpHostOptions) -> None:
+        """
+        Set the per-host options of the url's origin, the pool is rebuilt when they change
+        :param url:
+        :param options:
+        :return:
+        """
+        origin = self._get_origin(url)
+        if self.defaults.hosts.get(origin) == options:
+            return
+        self.defaults.hosts[origin] = options
+        self._http1_only.pop(origin, None)
+        for key in [key for key in self._pools if key[0] == origin]:
+            self._retired.append(self._pools.pop(key))
+            self._http2_pools.pop(key, None)
+
+    def get_host_options(self, url: str) -> HttpHostOptions:
+        """
+        Resolve the per-host options of the url's origin over the defaults
+        :param url:
+        :return:
+        """
+        options = self.defaults.hosts.get(self._get_origin(url)) or HttpHostOptions()
+        return replace(
+            options,
+            http2=self.defaults.http2 if options.http2 is None else options.http2,
+            max_connections=options.max_connections or self.defaults.max_connections,
+            max_keepalive_connections=options.max_keepalive_connections or self.defaults.max_keepalive_connections,
+            keepalive_expiry=options.keepalive_expiry or self.defaults.keepalive_expiry
+        )
+
+    @staticmethod
+    def _build_limits(options: HttpHostOptions) -> httpx.Limits:
+        """
+        connection pool limits
+        :param options:
+        :return:
+        """
+        return httpx.Limits(
+            max_connections=options.max_connections,
+            max_keepalive_connections=options.max_keepalive_connections,
+            keepalive_expiry=options.keepalive_expiry
+        )
+
+    def _build_pool(self, origin: str, verify: bool) -> Tuple[httpx.AsyncClient, bool]:
+        """
+        Build the connection pool of the origin
+        :param origin:
+        :param verify:
+        :return: the pool and whether it speaks HTTP/2
+        """
+        options = self.get_host_options(origin)
+        http2 = options.http2 and origin not in self._http1_only
+        if http2 and not HTTP2_AVAILABLE:
+            request_logger.warning(f'{origin} HTTP/2 requested but the h2 package is missing, using HTTP/1.1')
+            self._http1_only[origin] = float('inf')
+            http2 = False
+        pool = httpx.AsyncClient(
+            timeout=self.defaults.timeout,
+            verify=verify,
+            limits=self._build_limits(options),
+            http1=not (http2 and options.http2_prior_knowledge),
+            http2=http2
+        )
+        return pool, http2
+
+    def get_pool(self, url: str, verify: bool = True) -> httpx.AsyncClient:
+        """
+        Get the long-lived keep-alive pool of the url's origin, build it when missing
+        :param url:
+        :param verify:
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # connections can't outlive the event loop they were opened on
+            self._pools.clear()
+            self._http2_pools.clear()
+            self._http2_confirmed.clear()
+            self._retired.clear()
+            self.single_flight.clear()
+            self._loop = loop
+        key = (self._get_origin(url), verify)
+        if self._http1_only.get(key[0], float('inf')) <= time.monotonic():
+            # the downgrade cooled down, try HTTP/2 again
+            del self._http1_only[key[0]]
+            for origin_key in [origin_key for origin_key in self._pools if origin_key[0] == key[0]]:
+                self._retired.append(self._pools.pop(origin_key))
+        pool = self._pools.get(key)
+        if pool is None or pool.is_closed:
+            pool, http2 = self._build_pool(origin=key[0], verify=verify)
+            self._pools[key] = pool
+            if http2:
+                self._http2_pools[key] = pool
+        return pool
+
+    def get_circuit_breaker(self, url: str) -> Optional[CircuitBreaker]:
+        """
+        The circuit breaker of the url's origin, None when disabled
+        :param url:
+        :return:
+        """
+        if self.defaults.circuit_failure_threshold <= 0:
+            return None
+        origin = self._get_origin(url)
+        breaker = self._circuit_breakers.get(origin)
+        if breaker is None:
+            breaker = self._circuit_breakers[origin] = CircuitBreaker(
+                host=origin,
+                failure_threshold=self.defaults.circuit_failure_threshold,
+                reset_timeout=self.defaults.circuit_reset_timeout
+            )
+        return breaker
+
+    def confirm_http2(self, pool: httpx.AsyncClient) -> None:
+        """
+        Remember the pool got an HTTP/2 response, its later failures aren't negotiation failures
+        :param pool:
+        :return:
+        """
+        self._http2_confirmed.add(pool)
+
+    def downgrade_http2(self, url: str, pool: httpx.AsyncClient) -> bool:
+        """
+        Fall the url's origin back to HTTP/1.1 for `http2_downgrade_cooldown` seconds
+        when its HTTP/2 pool fails before any HTTP/2 response
+        :param url:
+        :param pool: the pool the failed request was sent on
+        :return: False when there is nothing to fall back from
+        """
+        origin = self._get_origin(url)
+        if pool in self._http2_confirmed:
+            return False
+        if pool not in self._http2_pools.values():
+            # a concurrent request may have downgraded the origin already
+            return origin in self._http1_only and pool in self._retired
+        request_logger.warning(f'{origin} HTTP/2 failed before any response, falling back to HTTP/1.1')
+        self._http1_only[origin] = time.monotonic() + self.defaults.http2_downgrade_cooldown
+        for key in [key for key in self._pools if key[0] == origin]:
+            # requests in flight may still use the old pool, close it on shutdown
+            self._retired.append(self._pools.pop(key))
+            self._http2_pools.pop(key, None)
+        return True
+
+    @property
+    def pools(self) -> Dict[Tuple[str, bool], httpx.AsyncClient]:
+        """pools"""
+        return self._pools
+
+    async def aclose(self):
+        """
+        Close all the connection pools, called on application shutdown
+        :return:
+        """
+        pools, self._pools, self._retired = [*self._pools.values(), *self._retired], {}, []
+        self._http2_pools.clear()
+        self._http2_confirmed.clear()
+        for pool in pools:
+            if not pool.is_closed:
+                await pool.aclose()
 
 
 http_client = HttpClient()
@@ -0,0 +1,236 @@
+"""Retry policy"""
+import random
+import time
+from email.utils import parsedate_to_datetime
+from fnmatch import fnmatch
+from typing import Dict, Iterable, Optional
+
+import httpx
+
+# the request never reached the server, resending it is safe whatever the method
+CONNECT_EXCEPTIONS = (
+    ConnectionRefusedError,
+    httpx.ConnectTimeout,
+    httpx.ConnectError,
+)
+RETRY_EXCEPTIONS = (
+    *CONNECT_EXCEPTIONS,
+    TimeoutError,
+    httpx.ReadTimeout,
+    httpx.RemoteProtocolError,
+)
+
+
+class RetryBudget:
+    """
+    Token bucket capping retry amplification, every request deposits `ratio` token
+    and every retry withdraws a whole one, so retries stay under `ratio` of the traffic
+    once the initial `capacity` is spent
+    """
+
+    def __init__(self, ratio: float = 0.2, capacity: float = 10.0):
+        self.ratio = ratio
+        self.capacity = capacity
+        self._tokens = capacity
+
+    @property
+    def tokens(self) -> float:
+        """tokens"""
+        return self._tokens
+
+    def deposit(self) -> None:
+        """
+        Account one request
+        :return:
+        """
+        self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """
+        Take one retry out of the budget
+        :return: False when the budget is exhausted
+        """
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class RetryState:
+    """RetryState, the retry bookkeeping of one request"""
+
+    def __init__(
+        self,
+        policy: "RetryPolicy",
+        budget: RetryBudget,
+        idempotent: bool,
+        base_delay: float
+    ):
+        self._policy = policy
+        self._budget = budget
+        self._base_delay = base_delay
+        self._delay = base_delay
+        self.idempotent = idempotent
+
+    def next_delay(
+        self,
+        response: Optional[httpx.Response] = None,
+        exception: Optional[BaseException] = None
+    ) -> Optional[float]:
+        """
+        Seconds to wait before the next attempt
+        :param response:
+        :param exception:
+        :return: None when the attempt mustn't be retried
+        """
+        if not self._policy.is_retryable(self.idempotent, response=response, exception=exception):
+            return None
+        retry_after = self._policy.parse_retry_after(response) if response is not None else None
+        if retry_after is not None and retry_after > self._policy.max_retry_after:
+            # the server asks for more than we are willing to wait, give up right away
+            return None
+        if not self._budget.withdraw():
+            return None
+        if retry_after is not None:
+            # spread the callers told to come back at the same time
+            return retry_after + random.uniform(0, self._base_delay)
+        self._delay = self._policy.backoff(self._delay, base_delay=self._base_delay)
+        return self._delay
+
+
+class RetryPolicy:
+    """
+    RetryPolicy, pluggable into HttpDefaults / HttpSession,
+    subclass it to change the classification or the delays
+    """
+    IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+    RETRY_STATUS_CODES = frozenset((429, 500, 502, 503, 504))
+
+    def __init__(
+        self,
+        base_delay: float = 0.2,
+        max_delay: float = 10.0,
+        max_retry_after: float = 30.0,
+        budget_ratio: float = 0.2,
+        budget_capacity: float = 10.0,
+        idempotent_endpoints: Iterable[str] = ()
+    ):
+        """
+        :param base_delay: the first backoff, HttpSession.retry(retry_interval=) overrides it
+        :param max_delay: the backoff cap
+        :param max_retry_after: longest Retry-After honored, a longer one isn't retried
+        :param budget_ratio: retries allowed per request, per host
+        :param budget_capacity: retries allowed in a burst, per host
+        :param idempotent_endpoints: "METHOD /path" patterns (fnmatch) safe to resend, e.g. "POST */currency_rate"
+        """
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.budget_ratio = budget_ratio
+        self.budget_capacity = budget_capacity
+        self.idempotent_endpoints = tuple(idempotent_endpoints)
+        self._budgets: Dict[str, RetryBudget] = {}
+
+    def backoff(self, previous: float, base_delay: Optional[float] = None) -> float:
+        """
+        The delay before the next retry, with decorrelated jitter: the callers failing together don't retry together
+        :param previous: the previous delay, the base delay before the first retry
+        :param base_delay: defaults to `base_delay`
+        :return: min(max_delay, random(base, previous * 3))
+        """
+        base_delay = self.base_delay if base_delay is None else base_delay
+        return min(self.max_delay, random.uniform(base_delay, previous * 3))
+
+    def get_budget(self, url: httpx.URL) -> RetryBudget:
+        """
+        The retry budget of the url's host
+        :param url:
+        :return:
+        """
+        host = f"{url.host}:{url.port}" if url.port else url.host
+        budget = self._budgets.get(host)
+        if budget is None:
+            budget = self._budgets[host] = RetryBudget(ratio=self.budget_ratio, capacity=self.budget_capacity)
+        return budget
+
+    def is_idempotent(self, method: str, url: httpx.URL, headers: Optional[dict] = None) -> bool:
+        """
+        Whether the request can be resent after it may have reached the server: the methods idempotent by
+        definition and the configured endpoints, an Idempotency-Key header alone doesn't make the upstream dedupe.
+        The sessions of an upstream known to dedupe opt in with HttpSession.idempotent(True)
+        :param method:
+        :param url:
+        :param headers:
+        :return:
+        """
+        if method in self.IDEMPOTENT_METHODS:
+            return True
+        endpoint = f"{method} {url.path}"
+        return any(fnmatch(endpoint, pattern) for pattern in self.idempotent_endpoints)
+
+    def is_retryable(
+        self,
+        idempotent: bool,
+        response: Optional[httpx.Response] = None,
+        exception: Optional[BaseException] = None
+    ) -> bool:
+        """
+        Whether the failed attempt is worth another one
+        :param idempotent:
+        :param response:
+        :param exception:
+        :return:
+        """
+        if exception is not None:
+            return idempotent or isinstance(exception, CONNECT_EXCEPTIONS)
+        if response is None or response.status_code not in self.RETRY_STATUS_CODES:
+            return False
+        # 429 and 503 + Retry-After mean the request was not processed
+        return idempotent or (response.status_code in (429, 503) and "retry-after" in response.headers)
+
+    @staticmethod
+    def parse_retry_after(response: httpx.Response) -> Optional[float]:
+        """
+        Retry-After in seconds, either delta-seconds or an HTTP-date
+        :param response:
+        :return:
+        """
+        if response.status_code not in (429, 503):
+            return None
+        value = response.headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def start(
+        self,
+        method: str,
+        url: httpx.URL,
+        headers: Optional[dict] = None,
+        idempotent: Optional[bool] = None,
+        base_delay: Optional[float] = None
+    ) -> RetryState:
+        """
+        Start the retry bookkeeping of a request
+        :param method:
+        :param url:
+        :param headers:
+        :param idempotent: overrides the classification when set
+        :param base_delay:
+        :return:
+        """
+        budget = self.get_budget(url)
+        budget.deposit()
+        return RetryState(
+            policy=self,
+            budget=budget,
+            idempotent=self.is_idempotent(method, url, headers) if idempotent is None else idempotent,
+            base_delay=self.base_delay if base_delay is None else base_delay
+        )
@@ -0,0 +1,76 @@
+"""Single-flight request coalescing"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from app.libs.metrics import metrics
+
+
+class SingleFlight:
+    """
+    SingleFlight, concurrent calls with the same key share the first call's result
+    instead of running again
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        metrics.register_collector(f"{name}.single_flight", self._collect)
+
+    def _collect(self) -> Dict[str, float]:
+        """
+        hit rate of the coalescing
+        :return:
+        """
+        shared = metrics.get_counter(f"{self.name}.single_flight.calls", result="shared")
+        total = shared + metrics.get_counter(f"{self.name}.single_flight.calls", result="leader")
+        return {
+            f"{self.name}.single_flight.in_flight": len(self._calls),
+            f"{self.name}.single_flight.hit_rate": shared / total if total else 0.0,
+        }
+
+    def clear(self) -> None:
+        """
+        Forget the calls in flight, e.g. when their event loop is gone
+        :return:
+        """
+        self._calls.clear()
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run `func` unless a call with the same key is in flight, then wait for its result
+        :param key:
+        :param func:
+        :return:
+        """
+        future = self._calls.get(key)
+        if future is not None and future.get_loop() is not asyncio.get_running_loop():
+            # left over by a closed event loop
+            future = None
+        if future is not None:
+            metrics.incr(f"{self.name}.single_flight.calls", result="shared")
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # the leader was cancelled, not us, run on our own
+                return await func()
+
+        metrics.incr(f"{self.name}.single_flight.calls", result="leader")
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # mark the exception retrieved when nobody else was waiting
+            future.exception()
+            raise exc
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
@@ -0,0 +1,9 @@
+"""
+Top-level package for metrics.
+"""
+from .metrics import metrics, Metrics
+
+__all__ = [
+    "metrics",
+    "Metrics",
+]
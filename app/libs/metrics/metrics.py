@@ -0,0 +1,112 @@
+"""
+In-process metrics registry
+"""
+from collections import defaultdict
+from typing import Callable, Dict, Union
+
+Number = Union[int, float]
+
+
+class Metrics:
+    """
+    Metrics, counters / gauges / summaries keyed by name and labels,
+    served as JSON by the /api/metrics endpoint
+    """
+
+    def __init__(self):
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._gauges: Dict[str, float] = {}
+        self._summaries: Dict[str, Dict[str, float]] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, Number]]] = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> str:
+        """
+        name{label=value,...}
+        :param name:
+        :param labels:
+        :return:
+        """
+        if not labels:
+            return name
+        return f"{name}{{{','.join(f'{key}={value}' for key, value in sorted(labels.items()))}}}"
+
+    def incr(self, name: str, value: Number = 1, **labels) -> None:
+        """
+        Increase a counter
+        :param name:
+        :param value:
+        :param labels:
+        :return:
+        """
+        self._counters[self._key(name, labels)] += value
+
+    def gauge(self, name: str, value: Number, **labels) -> None:
+        """
+        Set a gauge
+        :param name:
+        :param value:
+        :param labels:
+        :return:
+        """
+        self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: Number, **labels) -> None:
+        """
+        Record a sample of a summary (count / sum / max)
+        :param name:
+        :param value:
+        :param labels:
+        :return:
+        """
+        key = self._key(name, labels)
+        summary = self._summaries.get(key)
+        if summary is None:
+            summary = self._summaries[key] = {"count": 0, "sum": 0.0, "max": value}
+        summary["count"] += 1
+        summary["sum"] += value
+        summary["max"] = max(summary["max"], value)
+
+    def register_collector(self, name: str, collector: Callable[[], Dict[str, Number]]) -> None:
+        """
+        Register a callback whose gauges are read at snapshot time, e.g. a queue depth
+        :param name:
+        :param collector: returns {metric name: value}
+        :return:
+        """
+        self._collectors[name] = collector
+
+    def get_counter(self, name: str, **labels) -> float:
+        """
+        Current value of a counter
+        :param name:
+        :param labels:
+        :return:
+        """
+        return self._counters.get(self._key(name, labels), 0)
+
+    def snapshot(self) -> dict:
+        """
+        All the metrics
+        :return:
+        """
+        gauges = dict(self._gauges)
+        for collector in self._collectors.values():
+            gauges.update(collector())
+        return {
+            "counters": dict(self._counters),
+            "gauges": gauges,
+            "summaries": {key: dict(value) for key, value in self._summaries.items()},
+        }
+
+    def reset(self) -> None:
+        """
+        Drop every recorded value, collectors are kept
+        :return:
+        """
+        self._counters.clear()
+        self._gauges.clear()
+        self._summaries.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,40 @@
+"""
+Top-level package for telegram.
+"""
+from .bot import shared_bot
+from .dedup import UpdateDeduplicator, UpdateIdWindow
+from .fan_out import DeliveryResult, fan_out
+from .ingest import LazyUpdateApplication, RawUpdate, secret_token_matches
+from .rate_limiter import TelegramRateLimiter, TokenBucket, telegram_rate_limiter
+from .request import TelegramRequest
+from .update_queue import PriorityUpdateQueue, UpdatePriority
+from .upload import InFlightBytes, SpooledUpload, StreamingInputFile, StreamingUploads
+
+__all__ = [
+    # bot
+    "shared_bot",
+    # dedup
+    "UpdateDeduplicator",
+    "UpdateIdWindow",
+    # fan_out
+    "DeliveryResult",
+    "fan_out",
+    # ingest
+    "LazyUpdateApplication",
+    "RawUpdate",
+    "secret_token_matches",
+    # rate_limiter
+    "TelegramRateLimiter",
+    "TokenBucket",
+    "telegram_rate_limiter",
+    # request
+    "TelegramRequest",
+    # update_queue
+    "PriorityUpdateQueue",
+    "UpdatePriority",
+    # upload
+    "InFlightBytes",
+    "SpooledUpload",
+    "StreamingInputFile",
+    "StreamingUploads",
+]
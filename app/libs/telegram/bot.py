@@ -0,0 +1,24 @@
+"""
+The bot of the process
+"""
+from telegram.ext import ExtBot
+
+from app.config import settings
+from .rate_limiter import telegram_rate_limiter
+from .request import TelegramRequest
+
+# shared by the update handlers (the Application) and the API handlers (the container),
+# the Application initializes and shuts it down
+shared_bot = ExtBot(
+    token=settings.TELEGRAM_BOT_TOKEN,
+    request=TelegramRequest(
+        name="bot",
+        connection_pool_size=settings.TELEGRAM_CONNECTION_POOL_SIZE,
+        http2=settings.TELEGRAM_HTTP2,
+        pool_timeout=settings.TELEGRAM_POOL_TIMEOUT,
+        connect_timeout=settings.TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=settings.TELEGRAM_READ_TIMEOUT,
+        write_timeout=settings.TELEGRAM_WRITE_TIMEOUT,
+    ),
+    rate_limiter=telegram_rate_limiter
+)
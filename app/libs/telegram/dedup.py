@@ -0,0 +1,123 @@
+"""
+Telegram update de-duplication
+"""
+from typing import Optional
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.libs.logger import logger
+from app.libs.metrics import metrics
+
+
+class UpdateIdWindow:
+    """
+    The update ids seen among the last `size` ids, one bit per id in a ring: the memory stays at size / 8 bytes.
+    Telegram numbers the updates of a bot sequentially, the ring slides forward with the highest id seen.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.highest: Optional[int] = None
+        self._bits = bytearray((size + 7) // 8)
+
+    def _clear(self, start: int, stop: int) -> None:
+        """
+        :param start: first id to clear
+        :param stop: last id to clear
+        :return:
+        """
+        if stop - start + 1 >= self.size:
+            self._bits[:] = bytes(len(self._bits))
+            return
+        for update_id in range(start, stop + 1):
+            slot = update_id % self.size
+            self._bits[slot >> 3] &= ~(1 << (slot & 7)) & 0xFF
+
+    def __contains__(self, update_id: int) -> bool:
+        """
+        Whether an update id was marked, False when it is older than the window
+        :param update_id:
+        :return:
+        """
+        if self.highest is None or update_id > self.highest or update_id <= self.highest - self.size:
+            return False
+        slot = update_id % self.size
+        return bool(self._bits[slot >> 3] & (1 << (slot & 7)))
+
+    def add(self, update_id: int) -> Optional[bool]:
+        """
+        Mark an update id as seen
+        :param update_id:
+        :return: True when it is new, False when it was seen, None when it is older than the window
+        """
+        if self.highest is None:
+            self.highest = update_id
+        elif update_id > self.highest:
+            self._clear(self.highest + 1, update_id)
+            self.highest = update_id
+        elif update_id <= self.highest - self.size:
+            return None
+        slot = update_id % self.size
+        mask = 1 << (slot & 7)
+        if self._bits[slot >> 3] & mask:
+            return False
+        self._bits[slot >> 3] |= mask
+        return True
+
+
+class UpdateDeduplicator:
+    """
+    Drops the updates Telegram delivers again, e.g. when the webhook answered too slowly.
+    The hot window is checked in memory, Redis remembers the ids for `ttl` seconds across the instances
+    and for the ids older than the window. An update is accepted when Redis is unavailable.
+    """
+
+    def __init__(self, name: str, window: int, ttl: float):
+        self.name = name
+        self.ttl = ttl
+        self._window = UpdateIdWindow(size=window)
+
+    def redis_name(self, update_id: int) -> str:
+        """
+        :param update_id:
+        :return:
+        """
+        return f"telegram_update:{self.name}:{update_id}"
+
+    def seen(self, update_id: int) -> bool:
+        """
+        Whether this instance received the update recently, no round trip: the webhook's check
+        :param update_id:
+        :return:
+        """
+        if update_id in self._window:
+            metrics.incr("telegram.updates", bot=self.name, result="duplicate", source="memory")
+            return True
+        return False
+
+    def mark(self, update_id: int) -> None:
+        """
+        Remember the update in memory, once it was queued: an update the webhook couldn't queue is delivered again
+        :param update_id:
+        :return:
+        """
+        self._window.add(update_id)
+
+    async def claim(self, redis: Redis, update_id: int) -> bool:
+        """
+        Mark the update as received in Redis, False when an instance did before
+        :param redis:
+        :param update_id:
+        :return:
+        """
+        try:
+            first = await redis.set(name=self.redis_name(update_id), value=1, nx=True, ex=int(self.ttl))
+        except RedisError as exc:
+            logger.warning(f"telegram update de-duplication {self.name} unavailable: {exc}")
+            first = True
+        if not first:
+            metrics.incr("telegram.updates", bot=self.name, result="duplicate", source="redis")
+            return False
+        metrics.incr("telegram.updates", bot=self.name, result="accepted")
+        return True
@@ -0,0 +1,68 @@
+"""
+Fan-out of one message to many chats
+"""
+import asyncio
+from typing import Awaitable, Callable, Iterable, List, Optional
+
+from pydantic import BaseModel, Field
+from telegram import Message
+from telegram.error import TelegramError
+
+from app.libs.logger import logger
+from app.libs.metrics import metrics
+
+
+class DeliveryResult(BaseModel):
+    """DeliveryResult"""
+    chat_id: int
+    ok: bool
+    message_id: Optional[int] = Field(default=None, description="Message ID")
+    error: Optional[str] = Field(default=None, description="Error")
+
+
+async def fan_out(
+    chat_ids: Iterable[int],
+    send: Callable[[int], Awaitable[Message]],
+    concurrency: int = 32,
+    on_result: Optional[Callable[[DeliveryResult], Awaitable[None]]] = None
+) -> List[DeliveryResult]:
+    """
+    Send to every chat with up to `concurrency` requests in flight, the bot's rate limiter paces them
+    :param chat_ids:
+    :param send: sends the message to one chat
+    :param concurrency:
+    :param on_result: called with each result as soon as it is known, e.g. to record the progress
+    :return: the delivery result of each chat, in order
+    :raises: the first error of `send` (other than a TelegramError) or of `on_result`, once every sender stopped
+    """
+    chat_ids = list(chat_ids)
+    results: List[Optional[DeliveryResult]] = [None] * len(chat_ids)
+    pending = iter(enumerate(chat_ids))
+
+    async def _worker():
+        for index, chat_id in pending:
+            try:
+                message = await send(chat_id)
+            except TelegramError as exc:
+                logger.error(f"failed to send to {chat_id}: {exc}")
+                results[index] = DeliveryResult(chat_id=chat_id, ok=False, error=str(exc))
+                metrics.incr("telegram.fan_out.deliveries", result="failed")
+            else:
+                results[index] = DeliveryResult(chat_id=chat_id, ok=True, message_id=message.message_id)
+                metrics.incr("telegram.fan_out.deliveries", result="ok")
+            if on_result is not None:
+                await on_result(results[index])
+
+    if not chat_ids:
+        return results
+    workers = [asyncio.create_task(_worker()) for _ in range(min(concurrency, len(chat_ids)))]
+    try:
+        done, _ = await asyncio.wait(workers, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        # an error or a cancellation stops the other senders before returning
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    for worker in done:
+        worker.result()
+    return results
@@ -0,0 +1,89 @@
+"""
+Telegram webhook ingestion
+"""
+import hmac
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+import orjson
+from telegram import Bot, Update
+from telegram.ext import Application
+
+from app.libs.metrics import metrics
+
+_loads = orjson.loads
+
+
+class RawUpdate:
+    """
+    An update as received by the webhook: its id, its type (message, callback_query, ...) and its JSON,
+    the Update object graph is built by the consumer (see LazyUpdateApplication)
+    """
+
+    __slots__ = ("update_id", "type", "data", "received_at")
+
+    def __init__(self, update_id: int, type_: str, data: dict):
+        self.update_id = update_id
+        self.type = type_
+        self.data = data
+        self.received_at = time.monotonic()
+
+    @classmethod
+    def parse(cls, body: bytes) -> "RawUpdate":
+        """
+        Read the id and type of an update, raises ValueError when the body isn't one
+        :param body:
+        :return:
+        """
+        data = _loads(body)
+        if not isinstance(data, dict) or not isinstance(data.get("update_id"), int):
+            raise ValueError("not a Telegram update")
+        type_ = next((key for key in data if key != "update_id"), "unknown")
+        return cls(update_id=data["update_id"], type_=type_, data=data)
+
+    def to_update(self, bot: Bot) -> Optional[Update]:
+        """
+        :param bot:
+        :return:
+        """
+        return Update.de_json(data=self.data, bot=bot)
+
+
+def secret_token_matches(expected: Optional[str], received: Optional[str]) -> bool:
+    """
+    Whether a webhook request carries the secret token given to set_webhook, any request does without one
+    :param expected: the configured secret token
+    :param received: the X-Telegram-Bot-Api-Secret-Token header
+    :return:
+    """
+    if not expected:
+        return True
+    return received is not None and hmac.compare_digest(expected.encode(), received.encode())
+
+
+class LazyUpdateApplication(Application):
+    """
+    Application accepting RawUpdate on its update queue, the Update is built when the update is processed,
+    after the update claim (e.g. the de-duplication across the instances) accepted it
+    """
+
+    _update_claim: Optional[Callable[[int], Awaitable[bool]]] = None
+
+    def set_update_claim(self, claim: Optional[Callable[[int], Awaitable[bool]]]) -> None:
+        """
+        :param claim: update id -> whether to process the update
+        :return:
+        """
+        self._update_claim = claim
+
+    async def process_update(self, update: Any) -> None:
+        """
+        :param update:
+        :return:
+        """
+        if isinstance(update, RawUpdate):
+            metrics.observe("telegram.updates.queue_wait", time.monotonic() - update.received_at, type=update.type)
+            if self._update_claim is not None and not await self._update_claim(update.update_id):
+                return
+            update = update.to_update(self.bot)
+        await super().process_update(update)
@@ -0,0 +1,205 @@
+"""
+TelegramRateLimiter
+"""
+import asyncio
+import contextlib
+import time
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from app.config import settings
+from app.libs.logger import logger
+from app.libs.metrics import metrics
+
+JSONDict = Dict[str, Any]
+
+
+class TokenBucket:
+    """
+    TokenBucket, `rate` tokens per second up to `capacity`, a paused bucket hands out no token until resumed
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        """
+        :param now:
+        :return:
+        """
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    @property
+    def paused(self) -> bool:
+        """paused"""
+        return time.monotonic() < self._paused_until
+
+    @property
+    def idle(self) -> bool:
+        """full and not paused, it can be dropped and rebuilt later"""
+        now = time.monotonic()
+        self._refill(now)
+        return self._tokens >= self.capacity and now >= self._paused_until
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hand out no token for `seconds`
+        :param seconds:
+        :return:
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> float:
+        """
+        Wait for a token
+        :return: seconds waited
+        """
+        started = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return now - started
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class TelegramRateLimiter(BaseRateLimiter[int]):
+    """
+    Rate limiter of the bots' requests, after the Telegram flood limits:
+    - every request to a chat takes a token of the bot-wide bucket (~30 messages per second)
+    - and one of the chat's lane, groups get ~20 messages per minute, private chats ~1 per second
+    A RetryAfter only pauses the lane of the chat it was raised for, the request is retried once it resumes.
+    """
+
+    MAX_LANES = 1024
+
+    def __init__(
+        self,
+        global_rate: float = 30,
+        group_rate: float = 20 / 60,
+        group_burst: float = 20,
+        private_rate: float = 1,
+        max_retries: int = 2
+    ):
+        """
+        :param global_rate: requests per second of the whole bot
+        :param group_rate: requests per second of one group / channel
+        :param group_burst: requests a group can take at once
+        :param private_rate: requests per second of one private chat
+        :param max_retries: retries after a RetryAfter, `rate_limit_args` overrides it per call
+        """
+        self.global_rate = global_rate
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.private_rate = private_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(rate=global_rate, capacity=global_rate)
+        self._lanes: Dict[Union[int, str], TokenBucket] = {}
+        metrics.register_collector("telegram.rate_limiter", self._collect)
+
+    def _collect(self) -> dict:
+        """
+        :return:
+        """
+        return {
+            "telegram.rate_limiter.lanes": len(self._lanes),
+            "telegram.rate_limiter.paused_lanes": sum(1 for lane in self._lanes.values() if lane.paused),
+        }
+
+    async def initialize(self) -> None:
+        """Does nothing."""
+
+    async def shutdown(self) -> None:
+        """Does nothing."""
+
+    @staticmethod
+    def is_group(chat_id: Union[int, str]) -> bool:
+        """
+        groups / channels have negative ids or @usernames
+        :param chat_id:
+        :return:
+        """
+        return isinstance(chat_id, str) or chat_id < 0
+
+    def get_lane(self, chat_id: Union[int, str]) -> TokenBucket:
+        """
+        The bucket of a chat
+        :param chat_id:
+        :return:
+        """
+        lane = self._lanes.get(chat_id)
+        if lane is not None:
+            return lane
+        if len(self._lanes) >= self.MAX_LANES:
+            for key in [key for key, bucket in self._lanes.items() if bucket.idle]:
+                del self._lanes[key]
+        if self.is_group(chat_id):
+            lane = TokenBucket(rate=self.group_rate, capacity=self.group_burst)
+        else:
+            lane = TokenBucket(rate=self.private_rate, capacity=max(1.0, self.private_rate))
+        self._lanes[chat_id] = lane
+        return lane
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, JSONDict, List[JSONDict]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, JSONDict, List[JSONDict]]:
+        """
+        Wait for the tokens of the chat, then send the request
+        :param callback:
+        :param args:
+        :param kwargs:
+        :param endpoint:
+        :param data:
+        :param rate_limit_args: max retries after a RetryAfter
+        :return:
+        """
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+        with contextlib.suppress(ValueError, TypeError):
+            chat_id = int(chat_id)
+        lane_type = "group" if self.is_group(chat_id) else "private"
+        max_retries = self.max_retries if rate_limit_args is None else rate_limit_args
+
+        attempt = 0
+        while True:
+            lane = self.get_lane(chat_id)
+            # the lane first, a paused chat mustn't hold a token of the others
+            waited = await lane.acquire()
+            waited += await self._global.acquire()
+            metrics.observe("telegram.rate_limiter.wait", waited, lane=lane_type)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                metrics.incr("telegram.rate_limiter.retry_after", lane=lane_type)
+                lane.pause(exc.retry_after + 0.1)
+                if attempt == max_retries:
+                    raise exc
+                attempt += 1
+                logger.info(f"Flood control on chat {chat_id} {endpoint}, retrying in {exc.retry_after} seconds")
+
+
+telegram_rate_limiter = TelegramRateLimiter(
+    global_rate=settings.TELEGRAM_RATE_LIMIT_GLOBAL,
+    group_rate=settings.TELEGRAM_RATE_LIMIT_GROUP / 60,
+    group_burst=settings.TELEGRAM_RATE_LIMIT_GROUP,
+    private_rate=settings.TELEGRAM_RATE_LIMIT_PRIVATE,
+    max_retries=settings.TELEGRAM_RATE_LIMIT_MAX_RETRIES
+)
@@ -0,0 +1,97 @@
+"""
+TelegramRequest
+"""
+import time
+from typing import Optional, Tuple
+
+from telegram.error import TimedOut
+from telegram.request import HTTPXRequest, RequestData
+
+from app.libs.http_client.http_client import HTTP2_AVAILABLE
+from app.libs.logger import logger
+from app.libs.metrics import metrics
+
+
+class TelegramRequest(HTTPXRequest):
+    """
+    HTTPXRequest reporting the saturation of its connection pool:
+    - telegram.http.in_flight / pool_size, the requests holding or waiting for a connection
+    - telegram.http.peak_in_flight, the most in flight since the last snapshot
+    - telegram.http.queued, the requests that found every connection busy
+    - telegram.http.pool_timeouts, the requests dropped after waiting `pool_timeout` for a connection
+    """
+
+    def __init__(self, name: str = "bot", connection_pool_size: int = 1, http2: bool = False, **kwargs):
+        """
+        :param name: label of the metrics
+        :param connection_pool_size:
+        :param http2: HTTP/1.1 when the h2 package is missing
+        :param kwargs: timeouts, see HTTPXRequest
+        """
+        if http2 and not HTTP2_AVAILABLE:
+            logger.warning(f"telegram request {name}: HTTP/2 requested but the h2 package is missing, using HTTP/1.1")
+            http2 = False
+        super().__init__(connection_pool_size=connection_pool_size, http_version="2" if http2 else "1.1", **kwargs)
+        self.name = name
+        self.connection_pool_size = connection_pool_size
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        metrics.register_collector(f"telegram.http.{name}", self._collect)
+
+    def _collect(self) -> dict:
+        """
+        :return:
+        """
+        peak, self.peak_in_flight = self.peak_in_flight, self.in_flight
+        return {
+            f"telegram.http.in_flight{{request={self.name}}}": self.in_flight,
+            f"telegram.http.peak_in_flight{{request={self.name}}}": peak,
+            f"telegram.http.pool_size{{request={self.name}}}": self.connection_pool_size,
+        }
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=HTTPXRequest.DEFAULT_NONE,
+        write_timeout=HTTPXRequest.DEFAULT_NONE,
+        connect_timeout=HTTPXRequest.DEFAULT_NONE,
+        pool_timeout=HTTPXRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        """
+        :param url:
+        :param method:
+        :param request_data:
+        :param read_timeout:
+        :param write_timeout:
+        :param connect_timeout:
+        :param pool_timeout:
+        :return:
+        """
+        if self.in_flight >= self.connection_pool_size:
+            metrics.incr("telegram.http.queued", request=self.name)
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.monotonic()
+        try:
+            return await super().do_request(
+                url=url,
+                method=method,
+                request_data=request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout,
+            )
+        except TimedOut as exc:
+            if exc.message.startswith("Pool timeout"):
+                metrics.incr("telegram.http.pool_timeouts", request=self.name)
+                logger.warning(
+                    f"telegram {self.name} connection pool exhausted, "
+                    f"{self.in_flight} requests for {self.connection_pool_size} connections"
+                )
+            raise exc
+        finally:
+            self.in_flight -= 1
+            metrics.observe("telegram.http.duration", time.monotonic() - started, request=self.name)
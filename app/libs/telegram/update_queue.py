@@ -0,0 +1,149 @@
+"""
+PriorityUpdateQueue
+"""
+import asyncio
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Callable, Deque, Dict, Optional
+
+from app.libs.metrics import metrics
+
+
+class UpdatePriority(IntEnum):
+    """
+    The classes of the queued updates, served in this order
+    """
+    PAYMENT = 0
+    FLOW = 1
+    MEMBERSHIP = 2
+    LOW = 3
+
+
+class PriorityUpdateQueue(asyncio.Queue):
+    """
+    Bounded update queue in front of the application, the updates are served by priority, then in order.
+    With `capacity` updates queued, a LOW update is shed, a higher one sheds the oldest LOW update queued
+    or waits for room: the webhook answers later and Telegram slows down.
+    The items `priority` doesn't classify (None), e.g. the stop signal of the application, aren't bounded and
+    are served once no update is left, the updates put after one are shed.
+    """
+
+    def __init__(self, name: str, capacity: int, priority: Callable[[object], Optional[UpdatePriority]]):
+        """
+        :param name:
+        :param capacity: updates queued
+        :param priority: the class of an item put
+        """
+        super().__init__()
+        self.name = name
+        self.capacity = capacity
+        self.priority = priority
+        self._room = asyncio.Event()
+        metrics.register_collector(f"telegram.update_queue.{name}", self._collect)
+
+    def _collect(self) -> dict:
+        """
+        :return:
+        """
+        return {
+            f"telegram.update_queue.depth{{queue={self.name},tier={tier.name.lower()}}}": len(updates)
+            for tier, updates in self._tiers.items()
+        }
+
+    def _init(self, maxsize: int) -> None:
+        """
+        :param maxsize: unused, the queue is bounded by `capacity`
+        :return:
+        """
+        self._tiers: Dict[UpdatePriority, Deque] = {tier: deque() for tier in UpdatePriority}
+        self._control: Deque = deque()
+
+    def _put(self, item) -> None:
+        """
+        :param item:
+        :return:
+        """
+        tier = self.priority(item)
+        (self._control if tier is None else self._tiers[tier]).append(item)
+
+    def _get(self):
+        """
+        :return:
+        """
+        self._room.set()
+        for updates in self._tiers.values():
+            if updates:
+                return updates.popleft()
+        return self._control.popleft()
+
+    def depth(self) -> int:
+        """
+        :return: the updates queued
+        """
+        return sum(len(updates) for updates in self._tiers.values())
+
+    def qsize(self) -> int:
+        """
+        :return:
+        """
+        return self.depth() + len(self._control)
+
+    def empty(self) -> bool:
+        """
+        :return:
+        """
+        return self.qsize() == 0
+
+    def _shed(self, tier: UpdatePriority) -> None:
+        """
+        :param tier:
+        :return:
+        """
+        metrics.incr("telegram.update_queue.updates", queue=self.name, tier=tier.name.lower(), result="shed")
+
+    def put_nowait(self, item) -> bool:
+        """
+        Queue an item, raises QueueFull when the queue is full of updates above LOW
+        :param item:
+        :return: False when the item was shed
+        """
+        tier = self.priority(item)
+        if tier is not None:
+            if self._control:
+                # the application is stopping
+                self._shed(tier)
+                return False
+            if self.depth() >= self.capacity:
+                low = self._tiers[UpdatePriority.LOW]
+                if tier is UpdatePriority.LOW:
+                    self._shed(tier)
+                    return False
+                if not low:
+                    raise asyncio.QueueFull
+                low.popleft()
+                self.task_done()
+                self._shed(UpdatePriority.LOW)
+        super().put_nowait(item)
+        if tier is not None:
+            metrics.incr("telegram.update_queue.updates", queue=self.name, tier=tier.name.lower(), result="queued")
+        return True
+
+    async def put(self, item) -> bool:
+        """
+        Queue an item, wait for room when the queue is full of updates above LOW
+        :param item:
+        :return: False when the item was shed
+        """
+        waited_since = None
+        while True:
+            try:
+                queued = self.put_nowait(item)
+                break
+            except asyncio.QueueFull:
+                waited_since = waited_since or time.monotonic()
+                self._room.clear()
+                await self._room.wait()
+        if waited_since is not None:
+            metrics.observe("telegram.update_queue.put_wait", time.monotonic() - waited_since, queue=self.name)
+        return queued
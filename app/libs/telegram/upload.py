@@ -0,0 +1,151 @@
+"""
+Streaming uploads to Telegram
+"""
+import asyncio
+import io
+import tempfile
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, IO, Optional
+
+from telegram import InputFile
+
+from app.libs.metrics import metrics
+
+
+class StreamingInputFile(InputFile):
+    """
+    InputFile handing its file object to the request instead of reading it, httpx sends it in 64KB chunks
+    (and rewinds it when the request is retried)
+    """
+
+    __slots__ = ()
+
+    def __init__(self, file: IO[bytes], filename: str):
+        super().__init__(b"", filename=filename)
+        self.input_file_content = file
+
+
+class SpooledUpload:
+    """
+    The body of a file on its way to Telegram, up to `max_memory` bytes are kept in memory,
+    a bigger file is moved to a temporary file
+    """
+
+    def __init__(self, filename: str, max_memory: int):
+        self.filename = filename
+        self.max_memory = max_memory
+        self.size = 0
+        self.on_disk = False
+        self._file: IO[bytes] = io.BytesIO()
+
+    def write(self, chunk: bytes) -> None:
+        """
+        :param chunk:
+        :return:
+        """
+        if not self.on_disk and self.size + len(chunk) > self.max_memory:
+            file = tempfile.TemporaryFile()
+            file.write(self._file.getvalue())
+            self._file.close()
+            self._file, self.on_disk = file, True
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def input_file(self) -> StreamingInputFile:
+        """
+        The file to pass to a send_photo / send_document
+        :return:
+        """
+        self._file.seek(0)
+        return StreamingInputFile(self._file, filename=self.filename)
+
+    def close(self) -> None:
+        """
+        :return:
+        """
+        self._file.close()
+
+
+class InFlightBytes:
+    """
+    Cap of the bytes the transfers hold in memory, a transfer waits until its share fits under the limit
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.reserved = 0
+        self.waiting = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, size: int) -> AsyncIterator[None]:
+        """
+        Hold `size` bytes of the budget
+        :param size:
+        :return:
+        """
+        size = min(size, self.limit)
+        async with self._condition:
+            self.waiting += 1
+            try:
+                await self._condition.wait_for(lambda: self.reserved + size <= self.limit)
+            finally:
+                self.waiting -= 1
+            self.reserved += size
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.reserved -= size
+                self._condition.notify_all()
+
+
+class StreamingUploads:
+    """
+    Relays files from an HTTP response to Telegram without holding them in memory as a whole:
+    at most `max_memory` bytes per transfer, the rest is spooled to disk,
+    and at most `max_in_flight_bytes` for all the transfers together
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, name: str, max_memory: int, max_in_flight_bytes: int):
+        self.name = name
+        self.max_memory = max_memory
+        self._budget = InFlightBytes(limit=max_in_flight_bytes)
+        metrics.register_collector(f"telegram.uploads.{name}", self._collect)
+
+    def _collect(self) -> dict:
+        """
+        :return:
+        """
+        return {
+            f"telegram.uploads.in_flight_bytes{{uploads={self.name}}}": self._budget.reserved,
+            f"telegram.uploads.waiting{{uploads={self.name}}}": self._budget.waiting,
+        }
+
+    @asynccontextmanager
+    async def spool(
+        self,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        size: Optional[int] = None
+    ) -> AsyncIterator[SpooledUpload]:
+        """
+        Spool the chunks of a file, the upload is held in the budget until the block exits
+        :param chunks: e.g. HttpResponse.aiter_bytes(StreamingUploads.CHUNK_SIZE)
+        :param filename:
+        :param size: content length when known, reserves less than `max_memory` for a small file
+        :return:
+        """
+        reserved = self.max_memory + self.CHUNK_SIZE if size is None else min(size, self.max_memory + self.CHUNK_SIZE)
+        async with self._budget.reserve(reserved):
+            upload = SpooledUpload(filename=filename, max_memory=self.max_memory)
+            try:
+                async for chunk in chunks:
+                    upload.write(chunk)
+                metrics.incr("telegram.uploads.spooled", uploads=self.name, storage="disk" if upload.on_disk else "memory")
+                metrics.observe("telegram.uploads.size", upload.size, uploads=self.name)
+                yield upload
+            finally:
+                upload.close()
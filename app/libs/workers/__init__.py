@@ -0,0 +1,12 @@
+"""
+Top-level package for workers.
+"""
+from .keyed_queue import KeyedWorkQueue
+from .outbox import StreamOutbox
+from .write_behind import WriteBehindBuffer
+
+__all__ = [
+    "KeyedWorkQueue",
+    "StreamOutbox",
+    "WriteBehindBuffer",
+]
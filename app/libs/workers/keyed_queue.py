@@ -0,0 +1,206 @@
+"""
+KeyedWorkQueue
+"""
+import asyncio
+import time
+import zlib
+from typing import Awaitable, Callable, Hashable, List, Optional, Tuple
+
+import sentry_sdk
+
+from app.libs.http_client import RetryPolicy
+from app.libs.logger import logger
+from app.libs.metrics import metrics
+
+Job = Callable[[], Awaitable[None]]
+DeadLetter = Callable[[Exception], Awaitable[None]]
+
+
+class KeyedWorkQueue:
+    """
+    Bounded background queue drained by `workers` workers.
+    Jobs with the same key always land on the same worker, so they run one at a time in submission order.
+    `maxsize` bounds the jobs waiting across all the workers, the jobs of a single key may use all of it.
+    A failing job is retried `max_retries` times with a jittered exponential backoff before it is dropped,
+    or handed to its dead letter.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        workers: int = 4,
+        maxsize: int = 1000,
+        max_retries: int = 3,
+        retry_interval: float = 1.0,
+        should_retry: Optional[Callable[[Exception], bool]] = None
+    ):
+        """
+        :param name:
+        :param workers:
+        :param maxsize:
+        :param max_retries:
+        :param retry_interval:
+        :param should_retry: False for the errors a retry won't fix, retries everything by default
+        """
+        self.name = name
+        self.workers = workers
+        self.maxsize = maxsize
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.retry_policy = RetryPolicy(base_delay=retry_interval, max_delay=retry_interval * 2 ** max_retries)
+        self.should_retry = should_retry or (lambda exc: True)
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._room: Optional[asyncio.Event] = None
+        metrics.register_collector(f"{name}.queue", self._collect)
+
+    def _collect(self) -> dict:
+        """
+        :return:
+        """
+        oldest = [queue._queue[0][0] for queue in self._queues if queue.qsize()]  # noqa
+        return {
+            f"{self.name}.queue.depth": self.depth,
+            f"{self.name}.queue.lag": time.monotonic() - min(oldest) if oldest else 0.0,
+        }
+
+    @property
+    def depth(self) -> int:
+        """jobs waiting"""
+        return sum(queue.qsize() for queue in self._queues)
+
+    def start(self) -> None:
+        """
+        Start the workers on the running event loop
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._tasks:
+            return
+        self._loop = loop
+        # the capacity is shared, submit checks the depth across the workers
+        self._queues = [asyncio.Queue() for _ in range(self.workers)]
+        self._room = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._work(queue), name=f"{self.name}-worker-{index}")
+            for index, queue in enumerate(self._queues)
+        ]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        Drain the queue for up to `timeout` seconds, then stop the workers
+        :param timeout:
+        :return:
+        """
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.name} queue stopped with {self.depth} jobs left")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
+        self._room = None
+        self._loop = None
+
+    def _get_queue(self, key: Hashable) -> asyncio.Queue:
+        """
+        :param key:
+        :return:
+        """
+        if self._loop is not asyncio.get_running_loop() or not self._tasks:
+            self.start()
+        return self._queues[zlib.crc32(str(key).encode()) % self.workers]
+
+    async def submit(self, key: Hashable, job: Job, dead_letter: Optional[DeadLetter] = None) -> None:
+        """
+        Queue a job, waits while the queue is full
+        :param key: jobs of the same key run in order
+        :param job: called again on retries, so it must create a new awaitable each time
+        :param dead_letter: called with the last error when the job fails for good
+        :return:
+        """
+        queue = self._get_queue(key)
+        while self.depth >= self.maxsize:
+            self._room.clear()
+            await self._room.wait()
+        metrics.incr(f"{self.name}.queue.jobs", result="submitted")
+        queue.put_nowait((time.monotonic(), key, job, dead_letter))
+
+    def submit_nowait(self, key: Hashable, job: Job, dead_letter: Optional[DeadLetter] = None) -> None:
+        """
+        Queue a job, raises asyncio.QueueFull instead of waiting when the queue is full
+        :param key: jobs of the same key run in order
+        :param job: called again on retries, so it must create a new awaitable each time
+        :param dead_letter: called with the last error when the job fails for good
+        :return:
+        """
+        queue = self._get_queue(key)
+        if self.depth >= self.maxsize:
+            metrics.incr(f"{self.name}.queue.jobs", result="rejected")
+            raise asyncio.QueueFull
+        queue.put_nowait((time.monotonic(), key, job, dead_letter))
+        metrics.incr(f"{self.name}.queue.jobs", result="submitted")
+
+    async def _work(self, queue: asyncio.Queue) -> None:
+        """
+        :param queue:
+        :return:
+        """
+        while True:
+            item: Tuple[float, Hashable, Job, Optional[DeadLetter]] = await queue.get()
+            self._room.set()
+            enqueued_at, key, job, dead_letter = item
+            started = time.monotonic()
+            metrics.observe(f"{self.name}.queue.wait", started - enqueued_at)
+            try:
+                await self._run(key, job, dead_letter)
+            finally:
+                metrics.observe(f"{self.name}.queue.duration", time.monotonic() - started)
+                queue.task_done()
+
+    async def _run(self, key: Hashable, job: Job, dead_letter: Optional[DeadLetter] = None) -> None:
+        """
+        :param key:
+        :param job:
+        :param dead_letter:
+        :return:
+        """
+        with sentry_sdk.start_transaction(op="queue.task", name=self.name):
+            delay = self.retry_interval
+            for attempt in range(self.max_retries + 1):
+                try:
+                    await job()
+                except Exception as exc:
+                    if attempt == self.max_retries or not self.should_retry(exc):
+                        logger.exception(exc)
+                        metrics.incr(f"{self.name}.queue.jobs", result="failed")
+                        if dead_letter is not None:
+                            await self._dead_letter(key, dead_letter, exc)
+                        return
+                    logger.warning(f"{self.name} job of {key} failed, retrying: {exc!r}")
+                    metrics.incr(f"{self.name}.queue.retries")
+                    delay = self.retry_policy.backoff(delay, base_delay=self.retry_interval)
+                    await asyncio.sleep(delay)
+                else:
+                    metrics.incr(f"{self.name}.queue.jobs", result="done")
+                    return
+
+    async def _dead_letter(self, key: Hashable, dead_letter: DeadLetter, exc: Exception) -> None:
+        """
+        :param key:
+        :param dead_letter:
+        :param exc:
+        :return:
+        """
+        try:
+            await dead_letter(exc)
+        except Exception as dead_letter_exc:
+            logger.error(f"{self.name} job of {key} lost, its dead letter failed: {dead_letter_exc!r}")
+            metrics.incr(f"{self.name}.queue.jobs", result="lost")
+        else:
+            metrics.incr(f"{self.name}.queue.jobs", result="dead_lettered")
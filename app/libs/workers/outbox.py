@@ -0,0 +1,362 @@
+"""
+StreamOutbox
+"""
+import asyncio
+import json
+import os
+import socket
+import time
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+from uuid import uuid4
+
+import sentry_sdk
+from redis.asyncio import Redis
+from redis.exceptions import RedisError, ResponseError
+
+from app.libs.http_client import RetryPolicy
+from app.libs.logger import logger
+from app.libs.metrics import metrics
+
+# action, payload, idempotency key
+Deliver = Callable[[str, dict, str], Awaitable[None]]
+Entry = Tuple[str, dict]
+
+
+def _stream_entries(response) -> List[Entry]:
+    """
+    The entries of a one-stream XREADGROUP reply, RESP2 and RESP3 replies are shaped differently
+    :param response:
+    :return:
+    """
+    if not response:
+        return []
+    streams = response.values() if isinstance(response, dict) else [entries for _, entries in response]
+    result = []
+    for entries in streams:
+        if entries and isinstance(entries[0], list):
+            entries = entries[0]
+        result.extend(entries)
+    return result
+
+
+class StreamOutbox:
+    """
+    Durable outbox on a Redis stream: `append` returns once Redis has the intent,
+    a consumer group delivers it with `workers` workers in the background.
+    - {stream}              the intents not delivered yet, an entry is deleted once delivered
+    - {stream}:dead_letter  the intents given up on, with their last error
+    A failing delivery is retried `max_retries` times with a jittered exponential backoff before it is dead-lettered.
+    A consumer claims the entries it is delivering again every `poll_interval` seconds, through its retries,
+    the entries of a consumer that died are claimed by another after `claim_idle` seconds:
+    an intent is delivered at least once and its idempotency key lets the upstream drop the duplicates.
+    An entry which can't be read is dead-lettered.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        stream: str,
+        deliver: Deliver,
+        workers: int = 4,
+        max_retries: int = 5,
+        retry_interval: float = 1.0,
+        claim_idle: float = 60.0,
+        poll_interval: float = 5.0,
+        dead_letter_size: int = 10000,
+        should_retry: Optional[Callable[[str, Exception], bool]] = None
+    ):
+        """
+        :param name:
+        :param stream: the Redis stream, the consumer group is named after `name`
+        :param deliver: sends an intent upstream
+        :param workers:
+        :param max_retries:
+        :param retry_interval:
+        :param claim_idle: seconds an entry stays with a silent consumer, above `poll_interval`
+        :param poll_interval: seconds between two claims of idle entries / lag measures
+        :param dead_letter_size: entries kept in the dead letter stream
+        :param should_retry: action, error -> False when a retry won't fix it or isn't safe, retries everything by default
+        """
+        if claim_idle <= poll_interval:
+            raise ValueError(f"outbox {name}: claim_idle must be above poll_interval")
+        self.name = name
+        self.stream = stream
+        self.dead_letter_stream = f"{stream}:dead_letter"
+        self.group = name
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self.deliver = deliver
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.retry_policy = RetryPolicy(base_delay=retry_interval, max_delay=retry_interval * 2 ** max_retries)
+        self.claim_idle = claim_idle
+        self.poll_interval = poll_interval
+        self.dead_letter_size = dead_letter_size
+        self.should_retry = should_retry or (lambda action, exc: True)
+        self.depth = 0
+        self.lag = 0.0
+        self._redis: Optional[Redis] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._in_progress: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+        self._group_ready = False
+        metrics.register_collector(f"outbox.{name}", self._collect)
+
+    def _collect(self) -> dict:
+        """
+        :return:
+        """
+        return {
+            f"outbox.depth{{outbox={self.name}}}": self.depth,
+            f"outbox.lag{{outbox={self.name}}}": self.lag,
+            f"outbox.in_progress{{outbox={self.name}}}": len(self._in_progress),
+        }
+
+    @staticmethod
+    def appended_at(entry_id: str) -> float:
+        """
+        :param entry_id: a stream entry id, {milliseconds}-{sequence}
+        :return: the time the entry was appended
+        """
+        return int(entry_id.split("-", 1)[0]) / 1000
+
+    async def append(self, redis: Redis, action: str, payload: dict, idempotency_key: Optional[str] = None) -> str:
+        """
+        Record an intent, it is delivered in the background
+        :param redis:
+        :param action:
+        :param payload: JSON serializable
+        :param idempotency_key: the same intent appended twice (a double tap) is applied once upstream
+        :return: the idempotency key
+        """
+        idempotency_key = idempotency_key or uuid4().hex
+        await redis.xadd(
+            self.stream,
+            {"action": action, "payload": json.dumps(payload), "idempotency_key": idempotency_key}
+        )
+        metrics.incr("outbox.entries", outbox=self.name, result="appended")
+        return idempotency_key
+
+    async def _ensure_group(self) -> None:
+        """
+        :return:
+        """
+        if self._group_ready:
+            return
+        try:
+            await self._redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as exc:
+            if "BUSYGROUP" not in str(exc):
+                raise
+        self._group_ready = True
+
+    def start(self, redis: Redis) -> None:
+        """
+        Start consuming on the running event loop
+        :param redis:
+        :return:
+        """
+        if self._tasks:
+            return
+        self._redis = redis
+        self._group_ready = False
+        self._queue = asyncio.Queue(maxsize=self.workers)
+        self._tasks = [
+            asyncio.create_task(self._read(), name=f"outbox-{self.name}-reader"),
+            asyncio.create_task(self._maintain(), name=f"outbox-{self.name}-maintenance"),
+        ] + [
+            asyncio.create_task(self._work(), name=f"outbox-{self.name}-worker-{index}")
+            for index in range(self.workers)
+        ]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        Stop reading, let the deliveries in progress finish for up to `timeout` seconds,
+        what is left stays in the stream for the next consumer
+        :param timeout:
+        :return:
+        """
+        if not self._tasks:
+            return
+        reader, maintenance, *workers = self._tasks
+        for task in (reader, maintenance):
+            task.cancel()
+        await asyncio.gather(reader, maintenance, return_exceptions=True)
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"outbox {self.name} stopped with {len(self._in_progress)} deliveries in progress")
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._tasks = []
+        self._in_progress.clear()
+
+    async def _read(self) -> None:
+        """
+        Hand the new entries to the workers, no more than they can take
+        :return:
+        """
+        while True:
+            try:
+                await self._ensure_group()
+                response = await self._redis.xreadgroup(
+                    self.group,
+                    self.consumer,
+                    {self.stream: ">"},
+                    count=self.workers,
+                    block=int(self.poll_interval * 1000)
+                )
+            except RedisError as exc:
+                logger.warning(f"outbox {self.name} unavailable: {exc}")
+                await asyncio.sleep(self.poll_interval)
+                continue
+            for entry in _stream_entries(response):
+                await self._submit(entry)
+
+    async def _maintain(self) -> None:
+        """
+        Keep the entries in progress, claim the entries of the silent consumers, measure the depth and lag of the stream
+        :return:
+        """
+        while True:
+            try:
+                await self._ensure_group()
+                await self._keep()
+                await self._claim()
+                await self._measure()
+            except RedisError as exc:
+                logger.warning(f"outbox {self.name} unavailable: {exc}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _keep(self) -> None:
+        """
+        Reset the idle time of the entries this consumer is delivering, another doesn't claim them while retrying
+        :return:
+        """
+        if not self._in_progress:
+            return
+        await self._redis.xclaim(
+            self.stream,
+            self.group,
+            self.consumer,
+            min_idle_time=0,
+            message_ids=list(self._in_progress),
+            justid=True
+        )
+
+    async def _claim(self) -> None:
+        """
+        :return:
+        """
+        start_id = "0-0"
+        while True:
+            response = await self._redis.xautoclaim(
+                self.stream,
+                self.group,
+                self.consumer,
+                min_idle_time=int(self.claim_idle * 1000),
+                start_id=start_id,
+                count=self.workers
+            )
+            start_id, entries = response[0], response[1]
+            for entry in entries:
+                if entry[0] is None or entry[0] in self._in_progress:
+                    continue
+                metrics.incr("outbox.entries", outbox=self.name, result="claimed")
+                await self._submit(entry)
+            if start_id in ("0-0", b"0-0"):
+                return
+
+    async def _measure(self) -> None:
+        """
+        :return:
+        """
+        self.depth = await self._redis.xlen(self.stream)
+        oldest = await self._redis.xrange(self.stream, count=1)
+        self.lag = time.time() - self.appended_at(oldest[0][0]) if oldest else 0.0
+
+    async def _submit(self, entry: Entry) -> None:
+        """
+        :param entry:
+        :return:
+        """
+        self._in_progress.add(entry[0])
+        await self._queue.put(entry)
+
+    async def _work(self) -> None:
+        """
+        :return:
+        """
+        while True:
+            entry_id, fields = await self._queue.get()
+            try:
+                await self._process(entry_id, fields)
+            except Exception as exc:
+                # the entry stays pending, it is claimed again after claim_idle
+                logger.exception(exc)
+            finally:
+                self._in_progress.discard(entry_id)
+                self._queue.task_done()
+
+    async def _process(self, entry_id: str, fields: dict) -> None:
+        """
+        :param entry_id:
+        :param fields:
+        :return:
+        """
+        try:
+            action, key = fields["action"], fields["idempotency_key"]
+            payload = json.loads(fields["payload"])
+        except (KeyError, TypeError, ValueError) as exc:
+            logger.error(f"outbox {self.name} can't read {entry_id}: {exc!r}")
+            await self._dead_letter(entry_id, fields or {}, exc)
+            return
+        with sentry_sdk.start_transaction(op="queue.task", name=f"outbox.{self.name}.{action}"):
+            delay = self.retry_interval
+            for attempt in range(self.max_retries + 1):
+                try:
+                    await self.deliver(action, payload, key)
+                except Exception as exc:
+                    if attempt == self.max_retries or not self.should_retry(action, exc):
+                        logger.error(f"outbox {self.name} gave up on {action} {key}: {exc!r}")
+                        await self._dead_letter(entry_id, fields, exc)
+                        return
+                    logger.warning(f"outbox {self.name} {action} {key} failed, retrying: {exc!r}")
+                    metrics.incr("outbox.entries", outbox=self.name, result="retried")
+                    delay = self.retry_policy.backoff(delay, base_delay=self.retry_interval)
+                    await asyncio.sleep(delay)
+                else:
+                    await self._done(entry_id)
+                    metrics.incr("outbox.entries", outbox=self.name, result="delivered")
+                    metrics.observe("outbox.delivery_latency", time.time() - self.appended_at(entry_id), outbox=self.name)
+                    return
+
+    async def _done(self, entry_id: str) -> None:
+        """
+        :param entry_id:
+        :return:
+        """
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.xack(self.stream, self.group, entry_id)
+            pipe.xdel(self.stream, entry_id)
+            await pipe.execute()
+
+    async def _dead_letter(self, entry_id: str, fields: dict, exc: Exception) -> None:
+        """
+        :param entry_id:
+        :param fields:
+        :param exc:
+        :return:
+        """
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.xadd(
+                self.dead_letter_stream,
+                {**fields, "entry_id": entry_id, "error": repr(exc), "failed_at": str(time.time())},
+                maxlen=self.dead_letter_size,
+                approximate=True
+            )
+            pipe.xack(self.stream, self.group, entry_id)
+            pipe.xdel(self.stream, entry_id)
+            await pipe.execute()
+        metrics.incr("outbox.entries", outbox=self.name, result="dead_lettered")
@@ -0,0 +1,128 @@
+"""
+WriteBehindBuffer
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from app.libs.http_client import RetryPolicy
+from app.libs.logger import logger
+from app.libs.metrics import metrics
+
+Batch = Dict[str, Dict[Hashable, Any]]
+
+
+class WriteBehindBuffer:
+    """
+    Collects writes for `window` seconds or until `max_items` are pending, then hands them to `flush` as one batch.
+    Writes are grouped by kind and de-duplicated by key, the last one wins.
+    Batches are flushed one at a time in order, a failing batch is retried `max_retries` times with a jittered
+    exponential backoff.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush: Callable[[Batch], Awaitable[None]],
+        window: float = 0.5,
+        max_items: int = 100,
+        max_retries: int = 3,
+        retry_interval: float = 1.0
+    ):
+        self.name = name
+        self._flush = flush
+        self.window = window
+        self.max_items = max_items
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.retry_policy = RetryPolicy(base_delay=retry_interval, max_delay=retry_interval * 2 ** max_retries)
+        self._pending: Batch = {}
+        self._pending_items = 0
+        self._future: Optional[asyncio.Future] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushing: List[asyncio.Task] = []
+        metrics.register_collector(f"{name}.write_behind", lambda: {f"{name}.write_behind.pending": self._pending_items})
+
+    def add(self, kind: str, key: Hashable, item: Any) -> asyncio.Future:
+        """
+        Buffer a write
+        :param kind:
+        :param key: a pending write of the same kind and key is replaced
+        :param item:
+        :return: resolved once the batch holding the write is flushed
+        """
+        loop = asyncio.get_running_loop()
+        if self._future is None or self._future.get_loop() is not loop:
+            if self._future is not None:
+                # left over by a closed event loop
+                self._timer, self._flushing = None, []
+            self._pending, self._pending_items = {}, 0
+            self._future = loop.create_future()
+        items = self._pending.setdefault(kind, {})
+        if key in items:
+            metrics.incr(f"{self.name}.write_behind.items", result="deduplicated")
+        else:
+            self._pending_items += 1
+            metrics.incr(f"{self.name}.write_behind.items", result="added")
+        items[key] = item
+        future = self._future
+
+        if self._pending_items >= self.max_items:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._schedule_flush)
+        return future
+
+    def _schedule_flush(self) -> None:
+        """
+        :return:
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending_items:
+            return
+        batch, future = self._pending, self._future
+        self._pending, self._pending_items, self._future = {}, 0, None
+        previous = self._flushing[-1] if self._flushing else None
+        task = asyncio.get_running_loop().create_task(self._run(batch, future, previous))
+        self._flushing.append(task)
+        task.add_done_callback(self._flushing.remove)
+
+    async def _run(self, batch: Batch, future: asyncio.Future, previous: Optional[asyncio.Task]) -> None:
+        """
+        :param batch:
+        :param future:
+        :param previous: the batch flushed before this one
+        :return:
+        """
+        if previous is not None:
+            await asyncio.wait([previous])
+        metrics.observe(f"{self.name}.write_behind.batch_size", sum(len(items) for items in batch.values()))
+        delay = self.retry_interval
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._flush(batch)
+            except Exception as exc:
+                if attempt == self.max_retries:
+                    logger.exception(exc)
+                    metrics.incr(f"{self.name}.write_behind.flushes", result="failed")
+                    future.set_exception(exc)
+                    # mark the exception retrieved when nobody waits for it
+                    future.exception()
+                    return
+                logger.warning(f"{self.name} flush failed, retrying: {exc!r}")
+                delay = self.retry_policy.backoff(delay, base_delay=self.retry_interval)
+                await asyncio.sleep(delay)
+            else:
+                metrics.incr(f"{self.name}.write_behind.flushes", result="done")
+                future.set_result(None)
+                return
+
+    async def aclose(self) -> None:
+        """
+        Flush what is pending and wait for the batches in flight
+        :return:
+        """
+        self._schedule_flush()
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
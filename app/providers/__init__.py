@@ -2,8 +2,16 @@
 Top level package for providers.
 """
 from .exchaige_assistant import ExchaigeAssistantProvider
+from .outbox import OUTBOX_ACTIONS, exchaige_assistant_outbox
+from .vendor_directory import VendorDirectory, vendor_directory
 
 __all__ = [
     # exchaige_assistant
     "ExchaigeAssistantProvider",
+    # outbox
+    "OUTBOX_ACTIONS",
+    "exchaige_assistant_outbox",
+    # vendor_directory
+    "VendorDirectory",
+    "vendor_directory",
 ]
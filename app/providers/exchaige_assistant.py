@@ -1,16 +1,121 @@
 """
 ExchaigeAssistantProvider
 """
-from typing import List
+import asyncio
+import time
+from typing import IO, AsyncContextManager, List, Optional
 from uuid import UUID
 
+from httpx import HTTPStatusError
+
 from app.clients.exchaige_assistant import ExchaigeAssistantClient
+from app.config import settings
+from app.libs.cache import DiskLRUCache, RefreshAheadCache
 from app.libs.consts.enums import PaymentAccountStatus
 from app.libs.decorators.sentry_tracer import distributed_trace
+from app.libs.http_client.http_client import HttpResponse
+from app.libs.logger import logger
+from app.libs.metrics import metrics
+from app.libs.workers import WriteBehindBuffer
 from app.schemas.telegram.account import TelegramAccount, TelegramChatGroup
 from app.schemas.currency import Currencies
 
 
+# shared by every provider instance, the container builds one per injection,
+# loaded with the client of the provider asking
+_currencies_cache: RefreshAheadCache[Currencies] = RefreshAheadCache(
+    name="currencies",
+    ttl=settings.CURRENCY_CACHE_TTL,
+    refresh_ahead=settings.CURRENCY_CACHE_REFRESH_AHEAD,
+    stale_if_error=settings.CURRENCY_CACHE_STALE_IF_ERROR
+)
+
+# the receipts downloaded by this process
+_receipt_files = DiskLRUCache(
+    name="receipt",
+    directory=settings.RECEIPT_CACHE_DIR,
+    max_bytes=settings.RECEIPT_CACHE_MAX_BYTES
+)
+
+
+class AccountWriter:
+    """
+    Sends the buffered account / group / membership writes, in bulk when the upstream supports it.
+    A 404 / 405 / 501 of the bulk endpoint switches to per-item writes for `recheck_interval` seconds,
+    then the bulk endpoint is probed again; any other failure is the batch's, retried by the buffer
+    """
+
+    def __init__(self, client: ExchaigeAssistantClient, recheck_interval: float):
+        self.client = client
+        self.recheck_interval = recheck_interval
+        self._bulk_unsupported_at: Optional[float] = None
+
+    @property
+    def bulk_supported(self) -> bool:
+        """bulk_supported"""
+        return (
+            self._bulk_unsupported_at is None
+            or time.monotonic() - self._bulk_unsupported_at >= self.recheck_interval
+        )
+
+    async def flush(self, batch: dict) -> None:
+        """
+        :param batch:
+        :return:
+        """
+        client = self.client.telegram_account
+        accounts = list(batch.get("accounts", {}).values())
+        groups = list(batch.get("groups", {}).values())
+        members = batch.get("chat_group_members", {}).values()
+        init_members = [data for action, data in members if action == "init"]
+        deleted_members = [data for action, data in members if action == "delete"]
+
+        if self.bulk_supported:
+            try:
+                await client.bulk_upsert(
+                    data={
+                        "accounts": accounts,
+                        "groups": groups,
+                        "chat_group_members": init_members,
+                        "deleted_chat_group_members": deleted_members
+                    }
+                )
+                self._bulk_unsupported_at = None
+                metrics.incr("account_writes.requests", mode="bulk")
+                return
+            except HTTPStatusError as exc:
+                if exc.response.status_code not in (404, 405, 501):
+                    raise exc
+                logger.warning("bulk upsert isn't supported by ExchaigeAssistant, falling back to per-item writes")
+                self._bulk_unsupported_at = time.monotonic()
+
+        # the members reference the accounts and the groups, write those first
+        await asyncio.gather(
+            *(client.set_account(data=data) for data in accounts),
+            *(client.set_group(data=data) for data in groups)
+        )
+        await asyncio.gather(
+            *(client.init_chat_group_member(data=data) for data in init_members),
+            *(client.delete_chat_group_member(data=data) for data in deleted_members)
+        )
+        metrics.incr("account_writes.requests", len(accounts) + len(groups) + len(members), mode="per_item")
+
+
+_account_writer = AccountWriter(
+    client=ExchaigeAssistantClient(),
+    recheck_interval=settings.ACCOUNT_BULK_UPSERT_RECHECK_INTERVAL
+)
+
+_account_writes = WriteBehindBuffer(
+    name="account_writes",
+    flush=_account_writer.flush,
+    window=settings.ACCOUNT_WRITE_BEHIND_WINDOW,
+    max_items=settings.ACCOUNT_WRITE_BEHIND_MAX_ITEMS,
+    max_retries=settings.BOOKKEEPING_MAX_RETRIES,
+    retry_interval=settings.BOOKKEEPING_RETRY_INTERVAL
+)
+
+
 class ExchaigeAssistantProvider:
     """ExchaigeAssistantProvider"""
 
@@ -58,6 +163,56 @@ class ExchaigeAssistantProvider:
         }
         await self.client.telegram_account.delete_chat_group_member(data=data)
 
+    @staticmethod
+    def queue_set_account(account: TelegramAccount) -> asyncio.Future:
+        """
+        set account on the next write-behind flush
+        :param account:
+        :return: resolved once written
+        """
+        return _account_writes.add(kind="accounts", key=account.id, item=account.model_dump(exclude_none=True))
+
+    @staticmethod
+    def queue_set_group(group: TelegramChatGroup) -> asyncio.Future:
+        """
+        set group on the next write-behind flush
+        :param group:
+        :return: resolved once written
+        """
+        return _account_writes.add(kind="groups", key=group.id, item=group.model_dump())
+
+    @staticmethod
+    def queue_init_chat_group_member(data: dict) -> asyncio.Future:
+        """
+        Initialize chat group member on the next write-behind flush
+        :param data:
+        :return: resolved once written
+        """
+        key = (data["chat_group_id"], data["account_id"])
+        return _account_writes.add(kind="chat_group_members", key=key, item=("init", data))
+
+    @staticmethod
+    def queue_delete_chat_group_member(account_id: int, group_id: int) -> asyncio.Future:
+        """
+        delete chat group member on the next write-behind flush, replaces a pending initialization
+        :param account_id:
+        :param group_id:
+        :return: resolved once written
+        """
+        data = {
+            "account_id": account_id,
+            "group_id": group_id
+        }
+        return _account_writes.add(kind="chat_group_members", key=(group_id, account_id), item=("delete", data))
+
+    @staticmethod
+    async def flush_account_writes() -> None:
+        """
+        flush the buffered writes, e.g. on shutdown
+        :return:
+        """
+        await _account_writes.aclose()
+
     @distributed_trace()
     async def get_vendors(self) -> List[TelegramChatGroup]:
         """
@@ -70,25 +225,46 @@ class ExchaigeAssistantProvider:
     @distributed_trace()
     async def get_currencies(self) -> Currencies:
         """
-        get currencies
+        get currencies, cached
+        :return:
+        """
+        return await _currencies_cache.get(loader=self._load_currencies)
+
+    async def _load_currencies(self) -> Currencies:
+        """
+        load currencies
         :return:
         """
         result = await self.client.currency.get_currencies()
         return Currencies(**result)
 
+    @staticmethod
+    def invalidate_currencies() -> None:
+        """
+        drop the cached currencies, the next get_currencies reloads them
+        :return:
+        """
+        _currencies_cache.invalidate()
+
     @distributed_trace()
-    async def update_exchange_rate(self, group_id: int, currency_rates: list):
+    async def update_exchange_rate(self, group_id: int, currency_rates: list, idempotency_key: Optional[str] = None):
         """
         get exchange rate
         :param group_id:
         :param currency_rates:
+        :param idempotency_key:
         :return:
         """
         data = {
             "group_id": group_id,
             "currency_rates": currency_rates
         }
-        await self.client.exchange_rate.update_exchange_rate(data=data)
+        await self.client.exchange_rate.update_exchange_rate(data=data, idempotency_key=idempotency_key)
+
+    @property
+    def files_cached(self) -> bool:
+        """the files are kept in the local disk cache, see open_file"""
+        return _receipt_files.enabled
 
     @distributed_trace()
     async def get_file(self, file_id: str, file_name: str) -> bytes:
@@ -98,20 +274,56 @@ class ExchaigeAssistantProvider:
         :param file_name:
         :return:
         """
-        return await self.client.files.get_file(file_id=file_id, file_name=file_name)
+        if not self.files_cached:
+            return await self.client.files.get_file(file_id=file_id, file_name=file_name)
+        async with self.open_file(file_id=file_id, file_name=file_name) as file:
+            return file.read()
+
+    def open_file(self, file_id: str, file_name: str) -> AsyncContextManager[IO[bytes]]:
+        """
+        open file from the local disk cache, concurrent misses share one download
+        :param file_id:
+        :param file_name:
+        :return: a read only memory map of the file
+        """
+        async def _download(target: IO[bytes]) -> None:
+            async with self.client.files.stream_file(file_id=file_id, file_name=file_name) as resp:
+                async for chunk in await resp.aiter_bytes(64 * 1024):
+                    target.write(chunk)
+
+        return _receipt_files.open(key=f"{file_id}/{file_name}", download=_download)
+
+    def stream_file(self, file_id: str, file_name: str) -> AsyncContextManager[HttpResponse]:
+        """
+        stream file
+        :param file_id:
+        :param file_name:
+        :return: the response, its body is read with aiter_bytes
+        """
+        return self.client.files.stream_file(file_id=file_id, file_name=file_name)
 
     @distributed_trace()
-    async def update_payment_account_status(self, group_id: int, status: PaymentAccountStatus) -> None:
+    async def update_payment_account_status(
+        self,
+        group_id: int,
+        status: PaymentAccountStatus,
+        idempotency_key: Optional[str] = None
+    ) -> None:
         """
         update payment account status
         :param group_id:
         :param status:
+        :param idempotency_key:
         :return:
         """
         data = {
-            "status": status.value
+            "status": PaymentAccountStatus(status).value
         }
-        await self.client.telegram_messages.update_payment_account_status(group_id=group_id, data=data)
+        await self.client.telegram_messages.update_payment_account_status(
+            group_id=group_id,
+            data=data,
+            idempotency_key=idempotency_key
+        )
 
     @distributed_trace()
     async def payment_account_out_of_stock(
@@ -119,7 +331,8 @@ class ExchaigeAssistantProvider:
         group_id: int,
         customer_id: int,
         order_id: UUID,
-        status: PaymentAccountStatus
+        status: PaymentAccountStatus,
+        idempotency_key: Optional[str] = None
     ) -> None:
         """
         payment account out of stock
@@ -127,14 +340,19 @@ class ExchaigeAssistantProvider:
         :param customer_id:
         :param order_id:
         :param status:
+        :param idempotency_key:
         :return:
         """
         data = {
             "customer_id": customer_id,
             "order_id": str(order_id),
-            "status": status.value
+            "status": PaymentAccountStatus(status).value
         }
-        await self.client.telegram_messages.payment_account_out_of_stock(group_id=group_id, data=data)
+        await self.client.telegram_messages.payment_account_out_of_stock(
+            group_id=group_id,
+            data=data,
+            idempotency_key=idempotency_key
+        )
 
     @distributed_trace()
     async def send_payment_account(
@@ -142,7 +360,8 @@ class ExchaigeAssistantProvider:
         message: str,
         message_id: int,
         customer_id: int,
-        order_id: UUID
+        order_id: UUID,
+        idempotency_key: Optional[str] = None
     ) -> None:
         """
         send the payment account
@@ -150,6 +369,7 @@ class ExchaigeAssistantProvider:
         :param message_id:
         :param customer_id:
         :param order_id:
+        :param idempotency_key:
         :return:
         """
         data = {
@@ -158,18 +378,19 @@ class ExchaigeAssistantProvider:
             "customer_id": customer_id,
             "order_id": str(order_id)
         }
-        await self.client.telegram_messages.send_payment_account(data=data)
+        await self.client.telegram_messages.send_payment_account(data=data, idempotency_key=idempotency_key)
 
     @distributed_trace()
-    async def confirm_pay(self, customer_id: int, order_id: UUID) -> None:
+    async def confirm_pay(self, customer_id: int, order_id: UUID, idempotency_key: Optional[str] = None) -> None:
         """
         confirm pay
         :param customer_id:
         :param order_id:
+        :param idempotency_key:
         :return:
         """
         data = {
             "customer_id": customer_id,
             "order_id": str(order_id),
         }
-        await self.client.telegram_messages.confirm_pay(data=data)
+        await self.client.telegram_messages.confirm_pay(data=data, idempotency_key=idempotency_key)
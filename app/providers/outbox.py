@@ -0,0 +1,80 @@
+"""
+ExchaigeAssistant outbox
+"""
+from httpx import ConnectError, ConnectTimeout, HTTPStatusError, PoolTimeout
+from starlette import status
+
+from app.config import settings
+from app.libs.http_client import CircuitOpenError
+from app.libs.workers import StreamOutbox
+from .exchaige_assistant import ExchaigeAssistantProvider
+
+# the state-changing calls the Telegram callbacks hand to the outbox, by ExchaigeAssistantProvider method
+OUTBOX_ACTIONS = frozenset(
+    {
+        "confirm_pay",
+        "payment_account_out_of_stock",
+        "send_payment_account",
+        "update_exchange_rate",
+        "update_payment_account_status",
+    }
+)
+# the POSTs the upstream applies again when repeated, it doesn't promise to drop a repeated Idempotency-Key
+NON_IDEMPOTENT_ACTIONS = frozenset({"confirm_pay", "send_payment_account"})
+
+
+async def _deliver(action: str, payload: dict, idempotency_key: str) -> None:
+    """
+    :param action:
+    :param payload:
+    :param idempotency_key:
+    :return:
+    """
+    if action not in OUTBOX_ACTIONS:
+        raise ValueError(f"unknown outbox action {action}")
+    method = getattr(ExchaigeAssistantProvider(), action)
+    await method(**payload, idempotency_key=idempotency_key)
+
+
+def _not_processed(exc: Exception) -> bool:
+    """
+    whether the upstream surely didn't apply the request: it wasn't sent, or was turned away before being handled
+    :param exc:
+    :return:
+    """
+    if isinstance(exc, HTTPStatusError):
+        code = exc.response.status_code
+        return code == status.HTTP_429_TOO_MANY_REQUESTS or (
+            code == status.HTTP_503_SERVICE_UNAVAILABLE and "Retry-After" in exc.response.headers
+        )
+    return isinstance(exc, (ConnectError, ConnectTimeout, PoolTimeout, CircuitOpenError))
+
+
+def _should_retry(action: str, exc: Exception) -> bool:
+    """
+    an intent the upstream rejects (4xx) won't be accepted on a retry either,
+    a non-idempotent one is only retried when it surely wasn't applied: a timeout may come after the upstream did
+    :param action:
+    :param exc:
+    :return:
+    """
+    if action in NON_IDEMPOTENT_ACTIONS:
+        return _not_processed(exc)
+    if isinstance(exc, HTTPStatusError):
+        code = exc.response.status_code
+        return code >= 500 or code in (status.HTTP_408_REQUEST_TIMEOUT, status.HTTP_429_TOO_MANY_REQUESTS)
+    return not isinstance(exc, (ValueError, TypeError))
+
+
+exchaige_assistant_outbox = StreamOutbox(
+    name="exchaige_assistant",
+    stream=f"{settings.APP_NAME}:outbox:exchaige_assistant",
+    deliver=_deliver,
+    workers=settings.OUTBOX_WORKERS,
+    max_retries=settings.OUTBOX_MAX_RETRIES,
+    retry_interval=settings.OUTBOX_RETRY_INTERVAL,
+    claim_idle=settings.OUTBOX_CLAIM_IDLE,
+    poll_interval=settings.OUTBOX_POLL_INTERVAL,
+    dead_letter_size=settings.OUTBOX_DEAD_LETTER_SIZE,
+    should_retry=_should_retry
+)
@@ -0,0 +1,162 @@
+"""
+VendorDirectory
+"""
+import asyncio
+from typing import Dict, List, Optional
+
+from app.config import settings
+from app.libs.consts.enums import PaymentAccountStatus
+from app.libs.logger import logger
+from app.libs.metrics import metrics
+from app.schemas.telegram.account import TelegramChatGroup
+from .exchaige_assistant import ExchaigeAssistantProvider
+
+
+class VendorDirectory:
+    """
+    In-process directory of the vendor groups indexed by id,
+    kept up to date by the membership handlers and reconciled with get_vendors() periodically
+    """
+
+    def __init__(self, exchaige_assistant_provider: ExchaigeAssistantProvider):
+        self._exchaige_assistant_provider = exchaige_assistant_provider
+        self._vendors: Dict[int, TelegramChatGroup] = {}
+        self._ready = False
+        self._reconcile_lock: Optional[asyncio.Lock] = None
+        self._reconcile_task: Optional[asyncio.Task] = None
+        # vendor id -> the group, None once removed: the local changes made while reconcile() fetches
+        self._changes: Optional[Dict[int, Optional[TelegramChatGroup]]] = None
+        metrics.register_collector("vendor_directory", lambda: {"vendor_directory.size": len(self._vendors)})
+
+    @property
+    def ready(self) -> bool:
+        """ready"""
+        return self._ready
+
+    def get(self, vendor_id: int) -> Optional[TelegramChatGroup]:
+        """
+        get a vendor
+        :param vendor_id:
+        :return:
+        """
+        return self._vendors.get(vendor_id)
+
+    async def get_vendors(self) -> List[TelegramChatGroup]:
+        """
+        get vendors, loaded from upstream on the first call only
+        :return:
+        """
+        if not self._ready:
+            await self.reconcile()
+        return list(self._vendors.values())
+
+    def upsert(self, group: TelegramChatGroup) -> None:
+        """
+        Add or update a vendor group, one which isn't a vendor (anymore) is removed
+        :param group:
+        :return:
+        """
+        if not group.in_group or group.bot_type != settings.TELEGRAM_BOT_TYPE:
+            self.remove(group.id)
+            return
+        existing = self._vendors.get(group.id)
+        if existing and group.payment_account_status is None:
+            group = group.model_copy(update={"payment_account_status": existing.payment_account_status})
+        self._set(group.id, group)
+
+    def remove(self, vendor_id: int) -> None:
+        """
+        remove a vendor group
+        :param vendor_id:
+        :return:
+        """
+        self._set(vendor_id, None)
+
+    def _set(self, vendor_id: int, group: Optional[TelegramChatGroup]) -> None:
+        """
+        :param vendor_id:
+        :param group: None to remove the vendor
+        :return:
+        """
+        if group is None:
+            self._vendors.pop(vendor_id, None)
+        else:
+            self._vendors[vendor_id] = group
+        if self._changes is not None:
+            self._changes[vendor_id] = group
+
+    def update_payment_account_status(self, vendor_id: int, status: PaymentAccountStatus) -> None:
+        """
+        update the payment account status of a vendor
+        :param vendor_id:
+        :param status:
+        :return:
+        """
+        vendor = self._vendors.get(vendor_id)
+        if vendor:
+            self._set(vendor_id, vendor.model_copy(update={"payment_account_status": status}))
+
+    async def reconcile(self) -> None:
+        """
+        Replace the directory with the upstream vendor list, covers missed membership events.
+        The changes made while the list is fetched are newer, they are kept over it
+        :return:
+        """
+        if self._reconcile_lock is None:
+            self._reconcile_lock = asyncio.Lock()
+        async with self._reconcile_lock:
+            self._changes = {}
+            try:
+                vendors = await self._exchaige_assistant_provider.get_vendors()
+            finally:
+                changes, self._changes = self._changes, None
+            upstream = {vendor.id: vendor for vendor in vendors}
+            for vendor_id, group in changes.items():
+                if group is None:
+                    upstream.pop(vendor_id, None)
+                else:
+                    upstream[vendor_id] = group
+            drift = len(upstream.keys() ^ self._vendors.keys())
+            if self._ready and drift:
+                logger.info(f"vendor directory reconciled, {drift} vendors drifted")
+                metrics.incr("vendor_directory.drift", drift)
+            self._vendors = upstream
+            self._ready = True
+            metrics.incr("vendor_directory.reconciles")
+
+    async def _reconcile_periodically(self, interval: float) -> None:
+        """
+        :param interval:
+        :return:
+        """
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as exc:
+                logger.exception(exc)
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float = settings.VENDOR_DIRECTORY_RECONCILE_INTERVAL) -> None:
+        """
+        Warm the directory and keep reconciling it in the background
+        :param interval:
+        :return:
+        """
+        if self._reconcile_task is None or self._reconcile_task.done():
+            self._reconcile_task = asyncio.create_task(self._reconcile_periodically(interval))
+
+    async def stop(self) -> None:
+        """
+        :return:
+        """
+        if self._reconcile_task is None:
+            return
+        self._reconcile_task.cancel()
+        try:
+            await self._reconcile_task
+        except asyncio.CancelledError:
+            pass
+        self._reconcile_task = None
+
+
+vendor_directory = VendorDirectory(exchaige_assistant_provider=ExchaigeAssistantProvider())
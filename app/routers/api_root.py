@@ -2,6 +2,8 @@
 Root router.
 """
 from fastapi import APIRouter
+
+from app.libs.metrics import metrics
 from .apis.v1 import router as api_v1_router
 
 router = APIRouter()
@@ -19,3 +21,14 @@ async def healthcheck():
     return {
         "message": "ok"
     }
+
+
+@router.get(
+    path="/metrics"
+)
+async def get_metrics():
+    """
+    Metrics endpoint
+    :return:
+    """
+    return metrics.snapshot()
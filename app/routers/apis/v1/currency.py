@@ -0,0 +1,28 @@
+"""
+Currency Router
+"""
+from dependency_injector.wiring import inject, Provide
+from fastapi import APIRouter, Depends
+from starlette import status
+
+from app.containers import Container
+from app.providers import ExchaigeAssistantProvider
+
+router = APIRouter()
+
+
+@router.post(
+    path="/invalidate",
+    status_code=status.HTTP_200_OK
+)
+@inject
+async def invalidate_currencies(
+    exchaige_assistant_provider: ExchaigeAssistantProvider = Depends(Provide[Container.exchaige_assistant_provider])
+):
+    """
+    Drop the cached currencies after they changed upstream
+    :param exchaige_assistant_provider:
+    :return:
+    """
+    exchaige_assistant_provider.invalidate_currencies()
+    return {"message": "success"}
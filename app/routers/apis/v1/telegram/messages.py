@@ -1,13 +1,23 @@
 """
 Telegram Router
 """
+from typing import Optional
+
 from dependency_injector.wiring import inject, Provide
-from fastapi import APIRouter, Depends, BackgroundTasks
+from fastapi import APIRouter, Depends, Header
 from starlette import status
 
 from app.containers import Container
 from app.handlers.telegram import TelegramMessagesHandler
-from app.serializers.v1.telegram import PaymentAccount, CheckReceipt, ConfirmPayment, TelegramBroadcast
+from app.schemas.telegram.broadcast import BroadcastJob, BulkBroadcastResult
+from app.serializers.v1.telegram import (
+    PaymentAccount,
+    CheckReceipt,
+    ConfirmPayment,
+    TelegramBroadcast,
+    TelegramBroadcastJob,
+    TelegramBulkBroadcast,
+)
 
 router = APIRouter()
 
@@ -43,8 +53,82 @@ async def exchange_rate_msg(
     :param telegram_messages_handler:
     :return:
     """
-    await telegram_messages_handler.exchange_rate_msg()
-    return {"message": "success"}
+    results = await telegram_messages_handler.exchange_rate_msg()
+    return {"message": "success", "results": results}
+
+
+@router.post(
+    path="/broadcast/bulk",
+    status_code=status.HTTP_200_OK,
+    response_model=BulkBroadcastResult,
+    response_model_exclude_none=True
+)
+@inject
+async def broadcast_bulk(
+    model: TelegramBulkBroadcast,
+    telegram_messages_handler: TelegramMessagesHandler = Depends(Provide[Container.telegram_messages_handler])
+):
+    """
+
+    :param model:
+    :param telegram_messages_handler:
+    :return:
+    """
+    return await telegram_messages_handler.broadcast_messages(model=model)
+
+
+@router.post(
+    path="/broadcast/jobs",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=BroadcastJob
+)
+@inject
+async def broadcast_job(
+    model: TelegramBroadcastJob,
+    telegram_messages_handler: TelegramMessagesHandler = Depends(Provide[Container.telegram_messages_handler])
+):
+    """
+
+    :param model:
+    :param telegram_messages_handler:
+    :return:
+    """
+    return await telegram_messages_handler.broadcast_message_job(model=model)
+
+
+@router.post(
+    path="/exchange_rate_msg/jobs",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=BroadcastJob
+)
+@inject
+async def exchange_rate_msg_job(
+    telegram_messages_handler: TelegramMessagesHandler = Depends(Provide[Container.telegram_messages_handler])
+):
+    """
+
+    :param telegram_messages_handler:
+    :return:
+    """
+    return await telegram_messages_handler.exchange_rate_msg_job()
+
+
+@router.get(
+    path="/broadcast/jobs/{job_id}",
+    response_model=BroadcastJob
+)
+@inject
+async def get_broadcast_job(
+    job_id: str,
+    telegram_messages_handler: TelegramMessagesHandler = Depends(Provide[Container.telegram_messages_handler])
+):
+    """
+
+    :param job_id:
+    :param telegram_messages_handler:
+    :return:
+    """
+    return await telegram_messages_handler.get_broadcast_job(job_id=job_id)
 
 
 @router.post(
@@ -53,15 +137,17 @@ async def exchange_rate_msg(
 @inject
 async def payment_account(
     model: PaymentAccount,
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
     telegram_messages_handler: TelegramMessagesHandler = Depends(Provide[Container.telegram_messages_handler])
 ):
     """
 
     :param model:
+    :param idempotency_key: a retry with the same key gets the first response, defaults to the order
     :param telegram_messages_handler:
     :return:
     """
-    return await telegram_messages_handler.payment_account(model)
+    return await telegram_messages_handler.payment_account(model, idempotency_key=idempotency_key)
 
 
 @router.post(
@@ -70,15 +156,17 @@ async def payment_account(
 @inject
 async def hurry_payment_account(
     model: PaymentAccount,
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
     telegram_messages_handler: TelegramMessagesHandler = Depends(Provide[Container.telegram_messages_handler])
 ):
     """
 
     :param model:
+    :param idempotency_key: a retry with the same key gets the first response, each request without one is sent
     :param telegram_messages_handler:
     :return:
     """
-    return await telegram_messages_handler.hurry_payment_account(model)
+    return await telegram_messages_handler.hurry_payment_account(model, idempotency_key=idempotency_key)
 
 
 @router.post(
@@ -87,17 +175,15 @@ async def hurry_payment_account(
 @inject
 async def check_receipt(
     model: CheckReceipt,
-    background_tasks: BackgroundTasks,
     telegram_messages_handler: TelegramMessagesHandler = Depends(Provide[Container.telegram_messages_handler])
 ):
     """
 
     :param model:
-    :param background_tasks:
     :param telegram_messages_handler:
     :return:
     """
-    background_tasks.add_task(telegram_messages_handler.check_receipt, model)
+    telegram_messages_handler.queue_check_receipt(model)
 
 
 @router.post(
@@ -106,12 +192,14 @@ async def check_receipt(
 @inject
 async def confirm_payment(
     model: ConfirmPayment,
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
     telegram_messages_handler: TelegramMessagesHandler = Depends(Provide[Container.telegram_messages_handler])
 ):
     """
 
     :param model:
+    :param idempotency_key: a retry with the same key gets the first response, defaults to the order
     :param telegram_messages_handler:
     :return:
     """
-    return await telegram_messages_handler.confirm_payment(model)
+    return await telegram_messages_handler.confirm_payment(model, idempotency_key=idempotency_key)
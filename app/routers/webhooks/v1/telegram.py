@@ -2,9 +2,12 @@
 Telegram Router
 """
 from fastapi import APIRouter, Request, Response
-from telegram import Update
+from starlette import status
 
-from app.bot import application
+from app.bot import application, telegram_updates
+from app.config import settings
+from app.libs.metrics import metrics
+from app.libs.telegram import RawUpdate, secret_token_matches
 
 router = APIRouter()
 
@@ -14,10 +17,27 @@ router = APIRouter()
 )
 async def telegram(request: Request) -> Response:
     """
-    Handle incoming Telegram updates by putting them into the `update_queue`
+    Handle incoming Telegram updates by putting them into the `update_queue`, a redelivered update is dropped.
+    An update is remembered once queued, a shed one is answered 503 and Telegram delivers it again later.
+    Only the id and type of the update are read here, the Update is built when the application processes it,
+    after Redis confirmed no instance received it before
     :param request:
     :return:
     """
-    update = Update.de_json(data=await request.json(), bot=application.bot)
-    await application.update_queue.put(update)
+    if not secret_token_matches(
+        expected=settings.TELEGRAM_WEBHOOK_SECRET_TOKEN,
+        received=request.headers.get("X-Telegram-Bot-Api-Secret-Token")
+    ):
+        metrics.incr("telegram.updates", bot=telegram_updates.name, result="forbidden")
+        return Response(status_code=status.HTTP_403_FORBIDDEN)
+    try:
+        update = RawUpdate.parse(await request.body())
+    except ValueError:
+        metrics.incr("telegram.updates", bot=telegram_updates.name, result="malformed")
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+    if telegram_updates.seen(update.update_id):
+        return Response()
+    if not await application.update_queue.put(update):
+        return Response(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    telegram_updates.mark(update.update_id)
     return Response()
@@ -1,7 +1,8 @@
 """
 Serializers for currency API
 """
-from typing import Optional, List
+from functools import cached_property
+from typing import Optional, List, Dict
 from uuid import UUID
 
 from pydantic import field_validator, Field, BaseModel
@@ -33,3 +34,11 @@ class Currencies(BaseModel):
     Currencies
     """
     currencies: List[CurrencyInfo]
+
+    @cached_property
+    def symbol_mapping(self) -> Dict[str, UUID]:
+        """
+        symbol -> currency id
+        :return:
+        """
+        return {currency.symbol: currency.id for currency in self.currencies}
@@ -0,0 +1,40 @@
+"""
+Schemas for the broadcast jobs
+"""
+import time
+from typing import List, Optional
+
+from pydantic import BaseModel, Field, computed_field
+
+from app.libs.consts.enums import BroadcastJobStatus
+from app.libs.telegram import DeliveryResult
+
+
+class BroadcastJob(BaseModel):
+    """BroadcastJob"""
+    job_id: str
+    status: BroadcastJobStatus
+    total: int
+    sent: int = 0
+    failed: int = 0
+    created_at: float = Field(description="Unix timestamp")
+    started_at: Optional[float] = Field(default=None, description="Unix timestamp")
+    finished_at: Optional[float] = Field(default=None, description="Unix timestamp")
+    failures: List[DeliveryResult] = Field(default_factory=list, description="Failed deliveries")
+
+    @computed_field
+    @property
+    def throughput(self) -> Optional[float]:
+        """messages per second since the job started"""
+        if self.started_at is None:
+            return None
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return (self.sent + self.failed) / elapsed if elapsed > 0 else None
+
+
+class BulkBroadcastResult(BaseModel):
+    """BulkBroadcastResult"""
+    total: int
+    sent: int
+    failed: int
+    results: List[DeliveryResult]
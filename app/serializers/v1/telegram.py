@@ -1,9 +1,12 @@
 """
 Serializers for Telegram API
 """
+from typing import List, Optional
 from uuid import UUID
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
+
+from app.libs.consts.enums import PaymentAccountStatus
 
 
 class TelegramBroadcast(BaseModel):
@@ -14,6 +17,38 @@ class TelegramBroadcast(BaseModel):
     message: str
 
 
+class VendorFilter(BaseModel):
+    """
+    Vendor Filter, the vendors matching every given field
+    """
+    payment_account_status: Optional[PaymentAccountStatus] = Field(default=None, description="Payment Account Status")
+
+
+class TelegramBulkBroadcast(BaseModel):
+    """
+    Telegram Bulk Broadcast, to the given chats or the vendors matching the filter
+    """
+    message: str
+    chat_ids: Optional[List[int]] = Field(default=None, description="Chat IDs")
+    vendor_filter: Optional[VendorFilter] = Field(default=None, description="Vendor Filter")
+
+    @model_validator(mode="after")
+    def check_recipients(self) -> "TelegramBulkBroadcast":
+        """
+        either chat_ids or vendor_filter
+        :return:
+        """
+        if (self.chat_ids is None) == (self.vendor_filter is None):
+            raise ValueError("Either chat_ids or vendor_filter is required")
+        return self
+
+
+class TelegramBroadcastJob(TelegramBulkBroadcast):
+    """
+    Telegram Broadcast Job
+    """
+
+
 class PaymentAccount(BaseModel):
     """
     Telegram Flow Chat
@@ -0,0 +1,3 @@
+"""
+Benchmarks, run them with `python -m benchmarks.<name>` from the project root.
+"""
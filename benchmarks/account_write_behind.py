@@ -0,0 +1,87 @@
+"""
+Benchmark: upstream requests for the account / group / membership writes of a busy period,
+one request per write (before) vs the write-behind buffer (after)
+
+    python -m benchmarks.account_write_behind --events 1000 --rate 500
+    python -m benchmarks.account_write_behind --no-bulk  # the upstream lacks the bulk endpoint
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from app.config import settings
+from app.libs.consts.enums import BotType
+from app.libs.http_client import http_client
+from app.providers import ExchaigeAssistantProvider
+from app.schemas.telegram.account import TelegramAccount, TelegramChatGroup
+from .utils import StandInServer
+
+
+def make_event(groups: int, users: int):
+    """
+    a message of a random user in a random group
+    :param groups:
+    :param users:
+    :return:
+    """
+    group_id = -random.randrange(groups) - 1
+    account = TelegramAccount(id=random.randrange(users) + 1, first_name="vendor")
+    group = TelegramChatGroup(id=group_id, title=f"group {group_id}", type="group", in_group=True, bot_type=BotType.VENDORS)
+    data = {"account_id": account.id, "chat_group_id": group.id, "is_customer_service": False}
+    return account, group, data
+
+
+async def per_item(provider: ExchaigeAssistantProvider, account, group, data) -> None:
+    """
+    :return:
+    """
+    await asyncio.gather(provider.set_account(account=account), provider.set_group(group=group))
+    await provider.init_chat_group_member(data=data)
+
+
+async def write_behind(provider: ExchaigeAssistantProvider, account, group, data) -> None:
+    """
+    :return:
+    """
+    await provider.queue_set_account(account=account)
+    await provider.queue_set_group(group=group)
+    await provider.queue_init_chat_group_member(data=data)
+
+
+async def main(events: int, rate: float, groups: int, users: int, bulk: bool) -> None:
+    """
+    main
+    :return:
+    """
+    not_found = () if bulk else ("/api/v1/telegram/account/raw/bulk",)
+    async with StandInServer(not_found=not_found) as server:
+        settings.JCN_EXCHAIGE_ASSISTANT_URL = server.url
+        provider = ExchaigeAssistantProvider()
+        random.seed(0)
+        workload = [make_event(groups, users) for _ in range(events)]
+
+        for name, func in (("one request per write", per_item), ("write-behind", write_behind)):
+            requests = server.requests
+            started = time.perf_counter()
+            tasks = []
+            for account, group, data in workload:
+                tasks.append(asyncio.create_task(func(provider, account, group, data)))
+                await asyncio.sleep(1 / rate)
+            await asyncio.gather(*tasks)
+            await provider.flush_account_writes()
+            elapsed = time.perf_counter() - started
+            sent = server.requests - requests
+            print(f"{name:<24} events {events}  upstream requests {sent}  ({sent / elapsed * 60:.0f}/min over {elapsed:.1f}s)")
+        await http_client.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=500, help="events per second")
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--no-bulk", dest="bulk", action="store_false")
+    args = parser.parse_args()
+    asyncio.run(main(events=args.events, rate=args.rate, groups=args.groups, users=args.users, bulk=args.bulk))
@@ -0,0 +1,67 @@
+"""
+Load test: HTTP/1.1 pool vs HTTP/2 multiplexing for a burst of concurrent calls
+
+    python -m benchmarks.http_client_http2 --total 2000 --concurrency 50 --delay 0.02
+
+The stand-in servers answer after `--delay` seconds, like a busy upstream, so the HTTP/1.1
+pool has to open one connection per call in flight while HTTP/2 multiplexes them.
+The last scenario points an HTTP/2 (prior knowledge) pool at an HTTP/1.1-only server
+to exercise the fallback.
+"""
+import argparse
+import asyncio
+
+from app.libs.http_client import HttpClient, HttpDefaults, HttpHostOptions
+from .utils import StandInServer, H2StandInServer, run_load
+
+
+async def _burst(name: str, server: StandInServer, options: HttpHostOptions, total: int, concurrency: int):
+    """
+    Fire the burst through a fresh HttpClient
+    :param name:
+    :param server:
+    :param options:
+    :param total:
+    :param concurrency:
+    :return:
+    """
+    client = HttpClient(defaults=HttpDefaults(base_url=server.url, verbose=False))
+    client.configure_host(server.url, options)
+
+    async def _call():
+        resp = await client.create("/api/v1/currency/all").aget()
+        resp.raise_for_status()
+
+    connections = server.connections
+    result = await run_load(name, _call, total=total, concurrency=concurrency)
+    print(f"{result.report()}  connections {server.connections - connections}")
+    await client.aclose()
+
+
+async def main(total: int, concurrency: int, delay: float) -> None:
+    """
+    main
+    :param total:
+    :param concurrency:
+    :param delay:
+    :return:
+    """
+    async with StandInServer(delay=delay) as http1_server, H2StandInServer(delay=delay) as http2_server:
+        await _burst("HTTP/1.1", http1_server, HttpHostOptions(http2=False), total, concurrency)
+        await _burst("HTTP/2", http2_server, HttpHostOptions(http2=True, http2_prior_knowledge=True), total, concurrency)
+        await _burst(
+            "HTTP/2 -> HTTP/1.1 fallback",
+            http1_server,
+            HttpHostOptions(http2=True, http2_prior_knowledge=True),
+            total,
+            concurrency
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--total", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.02)
+    args = parser.parse_args()
+    asyncio.run(main(total=args.total, concurrency=args.concurrency, delay=args.delay))
@@ -0,0 +1,49 @@
+"""
+Benchmark: one httpx.AsyncClient per HttpSession (before) vs the pooled HttpClient (after)
+
+    python -m benchmarks.http_client_pool --total 2000 --concurrency 4 --tls
+
+The stand-in server shares the event loop with the client, keep the concurrency low on small machines.
+"""
+import argparse
+import asyncio
+
+from app.libs.http_client import HttpClient, HttpDefaults
+from .utils import StandInServer, run_load, self_signed_context
+
+
+async def main(total: int, concurrency: int, tls: bool) -> None:
+    """
+    main
+    :param total:
+    :param concurrency:
+    :param tls:
+    :return:
+    """
+    ssl_context = self_signed_context() if tls else None
+    async with StandInServer(ssl_context=ssl_context) as server:
+        client = HttpClient(defaults=HttpDefaults(base_url=server.url, verbose=False))
+        url = "/api/v1/telegram/account/vendors"
+
+        async def per_session():
+            resp = await client.create(url).pooled(False).verify(False).aget()
+            resp.raise_for_status()
+
+        async def pooled():
+            resp = await client.create(url).verify(False).aget()
+            resp.raise_for_status()
+
+        for name, func in (("per-session client", per_session), ("pooled client", pooled)):
+            connections = server.connections
+            result = await run_load(name, func, total=total, concurrency=concurrency)
+            print(f"{result.report()}  connections {server.connections - connections}")
+        await client.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--total", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--tls", action="store_true", help="serve over TLS to include the handshake cost")
+    args = parser.parse_args()
+    asyncio.run(main(total=args.total, concurrency=args.concurrency, tls=args.tls))
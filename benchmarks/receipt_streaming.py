@@ -0,0 +1,155 @@
+"""
+Benchmark: peak memory of relaying receipts from ExchaigeAssistant to Telegram,
+the receipt loaded in memory then uploaded (before) vs spooled and streamed under the in-flight cap (after),
+and read from the local disk cache through a memory map
+
+    python -m benchmarks.receipt_streaming --receipts 100 --size 5
+
+The stand-in servers run in a child process, tracemalloc only sees the relaying side.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import multiprocessing
+import re
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Tuple
+from uuid import uuid4
+
+from telegram.ext import ExtBot
+
+from app.config import settings
+from app.handlers.telegram import TelegramMessagesHandler
+from app.handlers.telegram.messages import receipt_uploads
+from app.libs.database import RedisPool
+from app.libs.http_client import http_client
+from app.libs.telegram import TelegramRequest
+from app.providers import ExchaigeAssistantProvider
+from app.providers.exchaige_assistant import _receipt_files
+from app.serializers.v1.telegram import CheckReceipt
+from .utils import FakeBotApiServer, StandInServer
+
+TOKEN = "123456:benchmark"
+
+
+class PhotoBotApiServer(FakeBotApiServer):
+    """Fake Bot API reading the chat id of a multipart sendPhoto"""
+
+    def respond(self, path: str, payload: bytes) -> Tuple[bytes, bytes]:
+        match = re.search(rb'name="chat_id"\r\n\r\n(-?\d+)', payload)
+        self.messages += 1
+        result = {
+            "message_id": self.messages,
+            "date": int(time.time()),
+            "chat": {"id": int(match.group(1)) if match else 0, "type": "private"},
+            "photo": [{"file_id": f"photo-{self.messages}", "file_unique_id": "u", "width": 1, "height": 1}],
+        }
+        return b"200 OK", json.dumps({"ok": True, "result": result}).encode()
+
+
+class ReceiptServer(StandInServer):
+    """ExchaigeAssistant serving `size` bytes receipts"""
+
+    def __init__(self, size: int):
+        super().__init__()
+        self._receipt = bytes(size)
+
+    def respond(self, path: str, payload: bytes) -> Tuple[bytes, bytes]:
+        return b"200 OK", self._receipt
+
+
+def serve(size: int, ports: multiprocessing.Queue) -> None:
+    """
+    run the stand-in servers until killed
+    :param size:
+    :param ports:
+    :return:
+    """
+    async def _serve():
+        async with ReceiptServer(size=size) as files, PhotoBotApiServer() as bot_api:
+            ports.put((files.url, bot_api.url))
+            await asyncio.Event().wait()
+
+    asyncio.run(_serve())
+
+
+async def main(receipts: int, size: int) -> None:
+    """
+    main
+    :return:
+    """
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(size, ports), daemon=True)
+    process.start()
+    files_url, bot_api_url = ports.get(timeout=30)
+    settings.JCN_EXCHAIGE_ASSISTANT_URL = files_url
+
+    bot = ExtBot(
+        token=TOKEN,
+        base_url=f"{bot_api_url}/bot",
+        request=TelegramRequest(name="bench", connection_pool_size=receipts, write_timeout=60, read_timeout=60)
+    )
+    provider = ExchaigeAssistantProvider()
+    handler = TelegramMessagesHandler(
+        bot=bot,
+        exchaige_assistant_provider=provider,
+        vendor_directory=None,
+        broadcast_jobs=None,
+        redis=RedisPool()
+    )
+
+    def make_receipt(index: int) -> CheckReceipt:
+        return CheckReceipt(
+            order_id=uuid4(), customer_id=1, vendor_id=index + 1, file_id=uuid4().hex, file_name="receipt.jpg"
+        )
+
+    async def buffered(model: CheckReceipt):
+        content = await provider.get_file(file_id=model.file_id, file_name=model.file_name)
+        await bot.send_photo(chat_id=model.vendor_id, photo=content)
+
+    async def streamed(model: CheckReceipt):
+        await handler._upload_receipt(model, buttons=None)  # noqa  # pylint: disable=protected-access
+
+    cache_dir = tempfile.TemporaryDirectory()
+    _receipt_files.directory = Path(cache_dir.name)
+    cache_max_bytes = _receipt_files.max_bytes
+
+    tracemalloc.start()
+    cached = [make_receipt(index) for index in range(receipts)]
+    for name, func, max_bytes, models in (
+        ("loaded in memory", buffered, 0, None),
+        ("spooled and streamed", streamed, 0, None),
+        ("disk cache, cold", streamed, max(cache_max_bytes, receipts * size), cached),
+        ("disk cache, warm", streamed, max(cache_max_bytes, receipts * size), cached),
+    ):
+        _receipt_files.max_bytes = max_bytes
+        gc.collect()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        await asyncio.gather(*(func(model) for model in models or map(make_receipt, range(receipts))))
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        print(f"{name:<22} receipts {receipts} x {size / 2 ** 20:.0f}MB  {elapsed:6.2f}s  peak memory {peak / 2 ** 20:8.1f}MB")
+    tracemalloc.stop()
+    print(
+        f"in-flight cap {receipt_uploads._budget.limit / 2 ** 20:.0f}MB, "  # noqa  # pylint: disable=protected-access
+        f"{receipt_uploads.max_memory / 2 ** 20:.0f}MB in memory per receipt"
+    )
+
+    cache_dir.cleanup()
+    await bot.shutdown()
+    await http_client.aclose()
+    process.kill()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--receipts", type=int, default=100, help="concurrent receipts")
+    parser.add_argument("--size", type=float, default=5, help="MB per receipt")
+    args = parser.parse_args()
+    asyncio.run(main(receipts=args.receipts, size=int(args.size * 2 ** 20)))
@@ -0,0 +1,75 @@
+"""
+Benchmark: Redis round trips of a request, a new RedisPool per request like reset_singletons() after each
+request did (before) vs the pool opened once by the container (after).
+A request checks and remembers the account info fingerprints, as a message update does.
+
+    python -m benchmarks.redis_pool_lifetime --requests 500 --concurrency 20 --rtt 0.001
+"""
+import argparse
+import asyncio
+import itertools
+
+from app.config import settings
+from app.libs.cache import FingerprintCache
+from app.libs.database import RedisPool
+from .utils import FakeRedisServer, run_load
+
+_request_ids = itertools.count(1)
+
+
+async def handle_request(redis_pool: RedisPool, cache: FingerprintCache) -> None:
+    """
+    the Redis work of one update
+    :param redis_pool:
+    :param cache:
+    :return:
+    """
+    redis = redis_pool.create()
+    request_id = next(_request_ids)
+    fingerprints = {
+        f"account:{request_id}": FingerprintCache.fingerprint(request_id),
+        f"group:{request_id}": FingerprintCache.fingerprint(-request_id),
+    }
+    changed = await cache.changed(redis=redis, fingerprints=fingerprints)
+    await cache.remember(redis=redis, fingerprints={key: fingerprints[key] for key in changed})
+
+
+async def main(requests: int, concurrency: int, rtt: float) -> None:
+    """
+    main
+    :return:
+    """
+    async with FakeRedisServer(rtt=rtt) as server:
+        settings.REDIS_URL = server.url
+        cache = FingerprintCache(name="bench", ttl=60)
+
+        # before: the pool was dropped after each request, its connections with it
+        pools = []
+
+        async def _per_request():
+            redis_pool = RedisPool()
+            pools.append(redis_pool)
+            await handle_request(redis_pool, cache)
+
+        # after: one pool for the lifetime of the application
+        async with RedisPool() as shared_pool:
+            runs = (("pool per request", _per_request), ("pool per process", lambda: handle_request(shared_pool, cache)))
+            for name, func in runs:
+                connections, commands = server.connections, sum(server.commands.values())
+                result = await run_load(name, func, total=requests, concurrency=concurrency)
+                print(
+                    f"{result.report()}  "
+                    f"connections {server.connections - connections}  "
+                    f"redis commands/request {(sum(server.commands.values()) - commands) / requests:.1f}"
+                )
+        for redis_pool in pools:
+            await redis_pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--rtt", type=float, default=0.001, help="seconds, network round trip to Redis")
+    args = parser.parse_args()
+    asyncio.run(main(requests=args.requests, concurrency=args.concurrency, rtt=args.rtt))
@@ -0,0 +1,76 @@
+"""
+Benchmark: exchange rate message to the vendors through a fake Bot API,
+one vendor after another (before) vs the rate-limited fan-out (after)
+
+    python -m benchmarks.telegram_fan_out --vendors 1000 --rtt 0.05
+
+1% of the vendors get a flood control error (retry after 1s) on their first message.
+"""
+import argparse
+import asyncio
+import time
+
+from telegram import Bot
+from telegram.error import TelegramError
+from telegram.ext import ExtBot
+from telegram.request import HTTPXRequest
+
+from app.libs.telegram import TelegramRateLimiter, fan_out
+from .utils import FakeBotApiServer
+
+TOKEN = "123456:benchmark"
+
+
+async def main(vendors: int, rtt: float, global_rate: float, concurrency: int) -> None:
+    """
+    main
+    :param vendors:
+    :param rtt:
+    :param global_rate:
+    :param concurrency:
+    :return:
+    """
+    chat_ids = [-1000000000000 - index for index in range(vendors)]
+    flooded = chat_ids[::100]
+
+    async with FakeBotApiServer(delay=rtt, flooded=flooded) as server:
+        base_url = f"{server.url}/bot"
+
+        bot = Bot(token=TOKEN, base_url=base_url)
+        started, failed = time.perf_counter(), 0
+        for chat_id in chat_ids:
+            try:
+                await bot.send_message(chat_id=chat_id, text="exchange rate")
+            except TelegramError:
+                failed += 1
+        elapsed = time.perf_counter() - started
+        print(f"{'sequential':<10} vendors {vendors}  {elapsed:6.1f}s  {vendors / elapsed:5.1f} msg/s  failed {failed}")
+        await bot.shutdown()
+
+        server._flooded = set(flooded)  # noqa
+        bot = ExtBot(
+            token=TOKEN,
+            base_url=base_url,
+            request=HTTPXRequest(connection_pool_size=concurrency),
+            rate_limiter=TelegramRateLimiter(global_rate=global_rate)
+        )
+        started = time.perf_counter()
+        results = await fan_out(
+            chat_ids=chat_ids,
+            send=lambda chat_id: bot.send_message(chat_id=chat_id, text="exchange rate"),
+            concurrency=concurrency
+        )
+        elapsed = time.perf_counter() - started
+        failed = sum(1 for result in results if not result.ok)
+        print(f"{'fan-out':<10} vendors {vendors}  {elapsed:6.1f}s  {vendors / elapsed:5.1f} msg/s  failed {failed}")
+        await bot.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vendors", type=int, default=1000)
+    parser.add_argument("--rtt", type=float, default=0.05, help="seconds the fake Bot API takes to answer")
+    parser.add_argument("--global-rate", type=float, default=30, help="messages per second of the bot")
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+    asyncio.run(main(vendors=args.vendors, rtt=args.rtt, global_rate=args.global_rate, concurrency=args.concurrency))
@@ -0,0 +1,379 @@
+"""
+Shared helpers for the benchmarks
+"""
+import asyncio
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+
+@dataclass
+class BenchResult:
+    """BenchResult"""
+    name: str
+    latencies: List[float] = field(default_factory=list)
+    elapsed: float = 0.0
+    errors: int = 0
+
+    @property
+    def rps(self) -> float:
+        """requests per second"""
+        return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, value: float) -> float:
+        """percentile in milliseconds"""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(value / 100 * (len(ordered) - 1))))
+        return ordered[index] * 1000
+
+    def report(self) -> str:
+        """one line summary"""
+        return (
+            f"{self.name:<28} {self.rps:>9.1f} req/s  "
+            f"p50 {self.percentile(50):>7.2f}ms  p99 {self.percentile(99):>7.2f}ms  "
+            f"mean {statistics.fmean(self.latencies) * 1000 if self.latencies else 0:>7.2f}ms  "
+            f"errors {self.errors}"
+        )
+
+
+async def run_load(
+    name: str,
+    func: Callable[[], Awaitable],
+    total: int,
+    concurrency: int
+) -> BenchResult:
+    """
+    Call `func` `total` times with at most `concurrency` calls in flight
+    :param name:
+    :param func:
+    :param total:
+    :param concurrency:
+    :return:
+    """
+    result = BenchResult(name=name)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _one():
+        async with semaphore:
+            st = time.perf_counter()
+            try:
+                await func()
+            except Exception:  # noqa
+                result.errors += 1
+                return
+            result.latencies.append(time.perf_counter() - st)
+
+    st = time.perf_counter()
+    await asyncio.gather(*[_one() for _ in range(total)])
+    result.elapsed = time.perf_counter() - st
+    return result
+
+
+def self_signed_context() -> ssl.SSLContext:
+    """
+    Server side TLS context with a throwaway self-signed certificate
+    :return:
+    """
+    directory = tempfile.mkdtemp(prefix="bench-tls-")
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=localhost", "-keyout", key, "-out", cert
+        ],
+        check=True,
+        capture_output=True
+    )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+class StandInServer:
+    """
+    Minimal HTTP/1.1 keep-alive server that answers every request with a JSON body,
+    it stands in for the ExchaigeAssistant API
+    """
+
+    def __init__(
+        self,
+        body: Optional[dict] = None,
+        delay: float = 0.0,
+        ssl_context: Optional[ssl.SSLContext] = None,
+        not_found: Iterable[str] = ()
+    ):
+        """
+        :param body: answer of every request
+        :param delay: seconds before answering
+        :param ssl_context:
+        :param not_found: paths answered with 404, e.g. an endpoint the upstream doesn't implement
+        """
+        self._body = json.dumps(body or {"vendors": []}).encode()
+        self._delay = delay
+        self._ssl_context = ssl_context
+        self._not_found = frozenset(not_found)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.connections = 0
+        self.requests = 0
+        self.paths: Counter = Counter()
+        self.port: Optional[int] = None
+        self._writers = set()
+
+    @property
+    def url(self) -> str:
+        """base url"""
+        scheme = "https" if self._ssl_context else "http"
+        return f"{scheme}://127.0.0.1:{self.port}"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                if head.startswith(b"PRI * HTTP/2.0"):
+                    # HTTP/2 prior knowledge preface, reject it like an HTTP/1.1-only server does
+                    writer.write(b"HTTP/1.1 400 Bad Request\r\nconnection: close\r\ncontent-length: 0\r\n\r\n")
+                    break
+                length = 0
+                keep_alive = True
+                for line in head.split(b"\r\n")[1:]:
+                    name, _, value = line.partition(b":")
+                    if name.lower() == b"content-length":
+                        length = int(value.strip())
+                    elif name.lower() == b"connection" and value.strip().lower() == b"close":
+                        keep_alive = False
+                payload = await reader.readexactly(length) if length else b""
+                self.requests += 1
+                path = head.split(b" ", 2)[1].decode()
+                self.paths[path] += 1
+                if self._delay:
+                    await asyncio.sleep(self._delay)
+                status, body = self.respond(path, payload)
+                writer.write(
+                    b"HTTP/1.1 " + status + b"\r\ncontent-type: application/json\r\n"
+                    b"content-length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def respond(self, path: str, payload: bytes) -> Tuple[bytes, bytes]:
+        """
+        Status line and body of the answer, override it to stand in for another API
+        :param path:
+        :param payload: request body
+        :return:
+        """
+        if path in self._not_found:
+            return b"404 Not Found", self._body
+        return b"200 OK", self._body
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0, ssl=self._ssl_context)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._server.close()
+        # the clients' idle keep-alive connections
+        for writer in list(self._writers):
+            writer.close()
+        await asyncio.sleep(0)
+
+
+class FakeBotApiServer(StandInServer):
+    """
+    Stands in for the Telegram Bot API, every method succeeds,
+    the first message to a chat of `flooded` gets a flood control error asking to retry after `retry_after` seconds
+    """
+
+    def __init__(self, delay: float = 0.0, flooded: Iterable[int] = (), retry_after: int = 1):
+        super().__init__(delay=delay)
+        self._flooded = set(flooded)
+        self._retry_after = retry_after
+        self.messages = 0
+
+    def respond(self, path: str, payload: bytes) -> Tuple[bytes, bytes]:
+        params = {key: values[0] for key, values in parse_qs(payload.decode()).items()}
+        chat_id = int(params.get("chat_id", 0))
+        if chat_id in self._flooded:
+            self._flooded.discard(chat_id)
+            body = {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self._retry_after}",
+                "parameters": {"retry_after": self._retry_after},
+            }
+            return b"429 Too Many Requests", json.dumps(body).encode()
+        self.messages += 1
+        result = {"message_id": self.messages, "date": int(time.time()), "chat": {"id": chat_id, "type": "group"}}
+        return b"200 OK", json.dumps({"ok": True, "result": result}).encode()
+
+
+class H2StandInServer(StandInServer):
+    """
+    Cleartext HTTP/2 (prior knowledge) variant of the stand-in server, needs the h2 package
+    """
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # pylint: disable=import-outside-toplevel
+        from h2.config import H2Configuration
+        from h2.connection import H2Connection
+        from h2.events import DataReceived, StreamEnded
+
+        self.connections += 1
+        connection = H2Connection(config=H2Configuration(client_side=False))
+        connection.initiate_connection()
+        writer.write(connection.data_to_send())
+
+        async def _respond(stream_id: int):
+            if self._delay:
+                await asyncio.sleep(self._delay)
+            connection.send_headers(
+                stream_id,
+                [(":status", "200"), ("content-type", "application/json"), ("content-length", str(len(self._body)))]
+            )
+            connection.send_data(stream_id, self._body, end_stream=True)
+            writer.write(connection.data_to_send())
+
+        tasks = set()
+        try:
+            while data := await reader.read(65536):
+                for event in connection.receive_data(data):
+                    if isinstance(event, DataReceived):
+                        connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    elif isinstance(event, StreamEnded):
+                        self.requests += 1
+                        task = asyncio.create_task(_respond(event.stream_id))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                writer.write(connection.data_to_send())
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+class FakeRedisServer:
+    """
+    Stands in for Redis (RESP3), every key is missing and every write succeeds,
+    the answers of the commands received together are sent `rtt` seconds later, once, like a remote server
+    """
+
+    def __init__(self, rtt: float = 0.0):
+        """
+        :param rtt: seconds between receiving commands and answering them
+        """
+        self._rtt = rtt
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers = set()
+        self.connections = 0
+        self.commands: Counter = Counter()
+        self.port: Optional[int] = None
+
+    @property
+    def url(self) -> str:
+        """redis url"""
+        return f"redis://127.0.0.1:{self.port}"
+
+    @staticmethod
+    def _parse(buffer: bytearray) -> Optional[List[bytes]]:
+        """
+        Pop one command off the buffer, None while it is incomplete
+        :param buffer:
+        :return:
+        """
+        end = buffer.find(b"\r\n")
+        if end < 0:
+            return None
+        count, position, command = int(buffer[1:end]), end + 2, []
+        for _ in range(count):
+            end = buffer.find(b"\r\n", position)
+            if end < 0:
+                return None
+            length = int(buffer[position + 1:end])
+            if len(buffer) < end + 2 + length + 2:
+                return None
+            command.append(bytes(buffer[end + 2:end + 2 + length]))
+            position = end + 2 + length + 2
+        del buffer[:position]
+        return command
+
+    @staticmethod
+    def _reply(name: str) -> bytes:
+        """
+        :param name:
+        :return:
+        """
+        if name == "GET":
+            return b"_\r\n"
+        if name == "PTTL":
+            return b":-2\r\n"
+        if name == "PING":
+            return b"+PONG\r\n"
+        if name == "HELLO":
+            return b"%2\r\n$6\r\nserver\r\n$5\r\nredis\r\n$5\r\nproto\r\n:3\r\n"
+        if name in ("SET", "SELECT", "CLIENT", "AUTH", "MULTI"):
+            return b"+OK\r\n"
+        return b":1\r\n"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self._writers.add(writer)
+        buffer = bytearray()
+        queued: Optional[List[bytes]] = None
+        try:
+            while data := await reader.read(65536):
+                received_at = time.monotonic()
+                buffer += data
+                replies = []
+                while (command := self._parse(buffer)) is not None:
+                    name = command[0].decode().upper()
+                    self.commands[name] += 1
+                    if name == "EXEC":
+                        replies.append(b"*%d\r\n" % len(queued or []) + b"".join(queued or []))
+                        queued = None
+                    elif queued is not None:
+                        queued.append(self._reply(name))
+                        replies.append(b"+QUEUED\r\n")
+                    else:
+                        replies.append(self._reply(name))
+                        if name == "MULTI":
+                            queued = []
+                if self._rtt:
+                    await asyncio.sleep(max(0.0, received_at + self._rtt - time.monotonic()))
+                writer.write(b"".join(replies))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await asyncio.sleep(0)
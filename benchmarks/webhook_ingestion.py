@@ -0,0 +1,156 @@
+"""
+Benchmark: webhook ingestion throughput in updates/sec,
+request.json() + Update.de_json before enqueueing (before) vs reading the update id and type only,
+the Update being built by the consumer (after)
+
+    python -m benchmarks.webhook_ingestion --updates 20000
+
+The parse-only rows time the ingestion work in a loop, the webhook rows call the ASGI application
+directly (no HTTP client in the measure), from the request to the update in the queue.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from typing import Callable, List
+
+from fastapi import FastAPI, Request, Response
+from telegram import Update
+
+from app.app import TELEGRAM_WEBHOOK_PATH, get_application
+from app.bot import application
+from app.libs.telegram import RawUpdate
+from app.libs.telegram import ingest
+from .utils import run_load
+
+_update_ids = itertools.count(1)
+
+
+def make_update() -> bytes:
+    """
+    a group message or a button tap, as Telegram posts them
+    :return:
+    """
+    update_id = next(_update_ids)
+    chat = {"id": -1001, "type": "supergroup", "title": "vendors"}
+    user = {"id": 42, "is_bot": False, "first_name": "vendor", "username": "vendor", "language_code": "en"}
+    message = {"message_id": update_id, "date": 1700000000, "chat": chat, "from": user, "text": "USD:56.7|57.1"}
+    if update_id % 2:
+        return json.dumps({"update_id": update_id, "message": message}).encode()
+    callback_query = {
+        "id": str(update_id),
+        "from": user,
+        "chat_instance": "1",
+        "data": "CONFIRM_PAY 1 5d3c0a8e-6f0e-4c1e-9f4e-2f8f3e7a9b10",
+        "message": {**message, "from": {"id": 1, "is_bot": True, "first_name": "bot"}},
+    }
+    return json.dumps({"update_id": update_id, "callback_query": callback_query}).encode()
+
+
+def parse_rate(name: str, parse: Callable[[bytes], object], bodies: List[bytes]) -> None:
+    """
+    :param name:
+    :param parse:
+    :param bodies:
+    :return:
+    """
+    started = time.perf_counter()
+    for body in bodies:
+        parse(body)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<34} {len(bodies) / elapsed:>10,.0f} updates/s  {elapsed / len(bodies) * 1e6:7.1f}us per update")
+
+
+def before_application() -> FastAPI:
+    """
+    The former webhook, the Update is built inside the request
+    :return:
+    """
+    web_application = FastAPI()
+
+    @web_application.post(TELEGRAM_WEBHOOK_PATH)
+    async def telegram(request: Request) -> Response:
+        update = Update.de_json(data=await request.json(), bot=application.bot)
+        await application.update_queue.put(update)
+        return Response()
+
+    return web_application
+
+
+async def post(web_application: FastAPI, body: bytes) -> int:
+    """
+    One webhook request straight through the ASGI application
+    :param web_application:
+    :param body:
+    :return: the response status
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": TELEGRAM_WEBHOOK_PATH,
+        "raw_path": TELEGRAM_WEBHOOK_PATH.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 1024),
+        "server": ("bench", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    statuses = []
+
+    async def receive():
+        return messages.pop() if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    await web_application(scope, receive, send)
+    return statuses[0]
+
+
+async def drain_update_queue() -> None:
+    """
+    nothing processes the updates here, keep the queue from growing
+    :return:
+    """
+    while True:
+        await application.update_queue.get()
+
+
+async def main(updates: int, requests: int, concurrency: int) -> None:
+    """
+    main
+    :return:
+    """
+    bodies = [make_update() for _ in range(updates)]
+    parse_rate("Update.de_json(json.loads)", lambda body: Update.de_json(json.loads(body), application.bot), bodies)
+    parse_rate("RawUpdate.parse, orjson", RawUpdate.parse, bodies)
+    loads, ingest._loads = ingest._loads, json.loads  # noqa  # pylint: disable=protected-access
+    parse_rate("RawUpdate.parse, json", RawUpdate.parse, bodies)
+    ingest._loads = loads  # noqa  # pylint: disable=protected-access
+
+    drain = asyncio.create_task(drain_update_queue())
+    for name, web_application in (("webhook, de_json in request", before_application()),
+                                  ("webhook, fast path", get_application())):
+
+        async def _post(_web_application=web_application):
+            status = await post(_web_application, make_update())
+            if status != 200:
+                raise RuntimeError(f"webhook answered {status}")
+
+        result = await run_load(name, _post, total=requests, concurrency=concurrency)
+        print(f"{result.report()}  ({requests / result.elapsed:,.0f} updates/s)")
+    drain.cancel()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=20000, help="updates parsed in the parse-only rows")
+    parser.add_argument("--requests", type=int, default=5000, help="updates posted to the webhook")
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(updates=args.updates, requests=args.requests, concurrency=args.concurrency))
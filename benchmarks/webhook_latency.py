@@ -0,0 +1,90 @@
+"""
+Benchmark: latency of the Telegram webhook, with the fixed 1.5s post-response sleep the http middleware
+used to do (before) vs answering at once, outbound sends being paced by the bot's rate limiter (after)
+
+    python -m benchmarks.webhook_latency --requests 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import itertools
+
+import httpx
+from fastapi import FastAPI
+from starlette.requests import Request
+
+from app.app import TELEGRAM_WEBHOOK_PATH, get_application
+from app.bot import application
+from .utils import run_load
+
+_update_ids = itertools.count(1)
+
+
+def make_update() -> dict:
+    """
+    a text message in a group
+    :return:
+    """
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 1700000000,
+            "chat": {"id": -1001, "type": "supergroup", "title": "vendors"},
+            "from": {"id": 42, "is_bot": False, "first_name": "vendor"},
+            "text": "hello",
+        },
+    }
+
+
+def setup_sleeping_middleware(webapi_app: FastAPI) -> None:
+    """
+    The former middleware, sleeping 1.5s after each response
+    :param webapi_app:
+    :return:
+    """
+
+    @webapi_app.middleware("http")
+    async def sleeping_middleware_handler(request: Request, callback):
+        response = await callback(request)
+        await asyncio.sleep(1.5)
+        return response
+
+
+async def drain_update_queue() -> None:
+    """
+    nothing processes the updates here, keep the queue from growing
+    :return:
+    """
+    while True:
+        await application.update_queue.get()
+
+
+async def main(requests: int, concurrency: int) -> None:
+    """
+    main
+    :return:
+    """
+    drain = asyncio.create_task(drain_update_queue())
+    for name, sleeping in (("sleep 1.5s after response", True), ("rate shaped sends", False)):
+        web_application = get_application()
+        if sleeping:
+            setup_sleeping_middleware(web_application)
+        transport = httpx.ASGITransport(app=web_application)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+            async def _post():
+                response = await client.post(TELEGRAM_WEBHOOK_PATH, json=make_update())
+                response.raise_for_status()
+
+            result = await run_load(name, _post, total=requests, concurrency=concurrency)
+        print(result.report())
+    drain.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(requests=args.requests, concurrency=args.concurrency))
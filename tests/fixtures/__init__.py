@@ -3,3 +3,4 @@ Top-level package for tests.fixtures.
 """
 from .handlers import *
 from .providers import *
+from .redis import *
@@ -1,6 +1,9 @@
 """
 Fixtures for Exchange Assistant
 """
+import asyncio
+import json
+
 import pytest
 
 from app.providers import ExchaigeAssistantProvider
@@ -14,3 +17,54 @@ def exchaige_assistant_provider() -> ExchaigeAssistantProvider:
     :return:
     """
     return Container.exchaige_assistant_provider()
+
+
+class FakeExchaigeAssistantServer:
+    """
+    ExchaigeAssistant on a local port, records the requests and applies a request once per Idempotency-Key
+    """
+
+    def __init__(self, statuses: dict = None):
+        """
+        :param statuses: path -> status code, 200 for the others
+        """
+        self.statuses = statuses or {}
+        self.requests = []
+        self.applied = []
+        self._keys = set()
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        """base url"""
+        return f"http://127.0.0.1:{self._server.sockets[0].getsockname()[1]}"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = (await reader.readuntil(b"\r\n\r\n")).decode()
+                method, path, _ = head.split("\r\n", 1)[0].split(" ", 2)
+                headers = {
+                    name.strip().lower(): value.strip()
+                    for name, _, value in (line.partition(":") for line in head.split("\r\n")[1:] if line)
+                }
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                request = (method, path, headers.get("idempotency-key"), json.loads(body) if body else None)
+                self.requests.append(request)
+                status = self.statuses.get(path, 200)
+                if status == 200 and request[2] not in self._keys:
+                    self._keys.add(request[2])
+                    self.applied.append(request)
+                writer.write(f"HTTP/1.1 {status} X\r\ncontent-type: application/json\r\ncontent-length: 2\r\n\r\n{{}}".encode())
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def __aenter__(self) -> "FakeExchaigeAssistantServer":
+        self._server = await asyncio.start_server(self._handle, host="127.0.0.1", port=0)
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        self._server.close()
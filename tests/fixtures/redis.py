@@ -0,0 +1,276 @@
+"""
+In-memory stand-in of redis.asyncio.Redis (decode_responses=True), for the commands the app uses
+"""
+import asyncio
+import time
+
+import pytest
+from redis.exceptions import ResponseError
+
+
+class FakePipeline:
+    """Queues the commands, runs them on execute()"""
+
+    def __init__(self, redis: "FakeRedis"):
+        self._redis = redis
+        self._commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return None
+
+    def __getattr__(self, name):
+        def _queue(*args, **kwargs):
+            self._commands.append((getattr(self._redis, name), args, kwargs))
+            return self
+        return _queue
+
+    async def execute(self):
+        commands, self._commands = self._commands, []
+        return [await command(*args, **kwargs) for command, args, kwargs in commands]
+
+
+def _stream_id(entry_id):
+    if entry_id in ("-", "0"):
+        return 0, 0
+    if entry_id == "+":
+        return float("inf"), 0
+    ms, _, seq = entry_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+class FakeStream:
+    """A stream, its entries and consumer groups"""
+
+    def __init__(self):
+        self.entries = {}
+        self.last_id = (0, 0)
+        # group -> {"last": id, "pending": {entry id: [consumer, delivered at]}}
+        self.groups = {}
+
+
+class FakeRedis:
+    """FakeRedis"""
+
+    def __init__(self):
+        self.data = {}
+        self._expire_at = {}
+
+    def _get(self, name, default=None):
+        expire_at = self._expire_at.get(name)
+        if expire_at is not None and expire_at <= time.monotonic():
+            self.data.pop(name, None)
+            self._expire_at.pop(name, None)
+        return self.data.get(name, default)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    # [keys]
+    async def delete(self, *names):
+        return sum(1 for name in names if self.data.pop(name, None) is not None)
+
+    async def expire(self, name, time_):
+        if self._get(name) is None:
+            return False
+        self._expire_at[name] = time.monotonic() + time_
+        return True
+
+    async def pexpire(self, name, time_):
+        return await self.expire(name, time_ / 1000)
+
+    async def pttl(self, name):
+        if self._get(name) is None:
+            return -2
+        expire_at = self._expire_at.get(name)
+        return -1 if expire_at is None else int((expire_at - time.monotonic()) * 1000)
+
+    # [strings]
+    async def get(self, name):
+        return self._get(name)
+
+    async def set(self, name, value, ex=None, px=None, nx=False):
+        if nx and self._get(name) is not None:
+            return None
+        self.data[name] = str(value)
+        self._expire_at.pop(name, None)
+        if ex is not None:
+            self._expire_at[name] = time.monotonic() + ex
+        if px is not None:
+            self._expire_at[name] = time.monotonic() + px / 1000
+        return True
+
+    # [hashes]
+    async def hset(self, name, key=None, value=None, mapping=None):
+        data = self.data.setdefault(name, {})
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        added = sum(1 for field in items if str(field) not in data)
+        data.update({str(field): str(value) for field, value in items.items()})
+        return added
+
+    async def hget(self, name, key):
+        return self._get(name, {}).get(str(key))
+
+    async def hgetall(self, name):
+        return dict(self._get(name, {}))
+
+    async def hkeys(self, name):
+        return list(self._get(name, {}))
+
+    async def hvals(self, name):
+        return list(self._get(name, {}).values())
+
+    async def hincrby(self, name, key, amount=1):
+        data = self.data.setdefault(name, {})
+        data[str(key)] = str(int(data.get(str(key), 0)) + amount)
+        return int(data[str(key)])
+
+    # [sets]
+    async def sadd(self, name, *values):
+        data = self.data.setdefault(name, set())
+        added = len({str(value) for value in values} - data)
+        data.update(str(value) for value in values)
+        return added
+
+    async def srem(self, name, *values):
+        data = self._get(name, set())
+        removed = len(data & {str(value) for value in values})
+        data.difference_update(str(value) for value in values)
+        return removed
+
+    async def smembers(self, name):
+        return set(self._get(name, set()))
+
+    async def sismember(self, name, value):
+        return str(value) in self._get(name, set())
+
+
+    # [lists]
+    async def lpush(self, name, *values):
+        data = self.data.setdefault(name, [])
+        for value in values:
+            data.insert(0, str(value))
+        return len(data)
+
+    async def ltrim(self, name, start, end):
+        data = self._get(name, [])
+        data[:] = data[start:None if end == -1 else end + 1]
+        return True
+
+    async def lrange(self, name, start, end):
+        return list(self._get(name, [])[start:None if end == -1 else end + 1])
+
+
+    # [streams]
+    def _stream(self, name, create=False):
+        stream = self.data.get(name)
+        if stream is None and create:
+            stream = self.data[name] = FakeStream()
+        return stream
+
+    async def xadd(self, name, fields, id="*", maxlen=None, approximate=True):
+        stream = self._stream(name, create=True)
+        ms = int(time.time() * 1000)
+        last_ms, last_seq = stream.last_id
+        stream.last_id = (ms, 0) if ms > last_ms else (last_ms, last_seq + 1)
+        entry_id = f"{stream.last_id[0]}-{stream.last_id[1]}"
+        stream.entries[entry_id] = {str(key): str(value) for key, value in fields.items()}
+        while maxlen is not None and len(stream.entries) > maxlen:
+            stream.entries.pop(next(iter(stream.entries)))
+        return entry_id
+
+    async def xgroup_create(self, name, groupname, id="$", mkstream=False):
+        stream = self._stream(name, create=mkstream)
+        if stream is None:
+            raise ResponseError("ERR The XGROUP subcommand requires the key to exist")
+        if groupname in stream.groups:
+            raise ResponseError("BUSYGROUP Consumer Group name already exists")
+        last = f"{stream.last_id[0]}-{stream.last_id[1]}" if id == "$" else id
+        stream.groups[groupname] = {"last": last, "pending": {}}
+        return True
+
+    async def xreadgroup(self, groupname, consumername, streams, count=None, block=None, noack=False):
+        deadline = time.monotonic() + (block or 0) / 1000
+        while True:
+            result = []
+            for name in streams:
+                stream = self._stream(name)
+                group = stream.groups[groupname]
+                entries = [
+                    (entry_id, fields) for entry_id, fields in stream.entries.items()
+                    if _stream_id(entry_id) > _stream_id(group["last"])
+                ][:count]
+                for entry_id, _ in entries:
+                    group["pending"][entry_id] = [consumername, time.monotonic()]
+                    group["last"] = entry_id
+                if entries:
+                    result.append([name, entries])
+            if result or block is None or time.monotonic() >= deadline:
+                return result
+            await asyncio.sleep(0.005)
+
+    async def xack(self, name, groupname, *ids):
+        pending = self._stream(name).groups[groupname]["pending"]
+        return sum(1 for entry_id in ids if pending.pop(entry_id, None) is not None)
+
+    async def xdel(self, name, *ids):
+        stream = self._stream(name)
+        return sum(1 for entry_id in ids if stream.entries.pop(entry_id, None) is not None)
+
+    async def xautoclaim(self, name, groupname, consumername, min_idle_time, start_id="0-0", count=None, justid=False):
+        stream = self._stream(name)
+        pending = stream.groups[groupname]["pending"]
+        claimed = []
+        for entry_id in sorted(pending, key=_stream_id):
+            consumer, delivered_at = pending[entry_id]
+            if _stream_id(entry_id) < _stream_id(start_id) or (time.monotonic() - delivered_at) * 1000 < min_idle_time:
+                continue
+            pending[entry_id] = [consumername, time.monotonic()]
+            claimed.append((entry_id, stream.entries.get(entry_id)))
+        return ["0-0", claimed, []]
+
+    async def xclaim(self, name, groupname, consumername, min_idle_time, message_ids, justid=False):
+        stream = self._stream(name)
+        pending = stream.groups[groupname]["pending"]
+        claimed = []
+        for entry_id in message_ids:
+            if entry_id not in pending or (time.monotonic() - pending[entry_id][1]) * 1000 < min_idle_time:
+                continue
+            pending[entry_id] = [consumername, time.monotonic()]
+            claimed.append(entry_id if justid else (entry_id, stream.entries.get(entry_id)))
+        return claimed
+
+    async def xlen(self, name):
+        stream = self._stream(name)
+        return len(stream.entries) if stream else 0
+
+    async def xrange(self, name, min="-", max="+", count=None):
+        stream = self._stream(name)
+        entries = [
+            (entry_id, fields) for entry_id, fields in (stream.entries.items() if stream else ())
+            if _stream_id(min) <= _stream_id(entry_id) <= _stream_id(max)
+        ]
+        return entries[:count]
+
+
+class FakeRedisPool:
+    """RedisPool handing out a FakeRedis"""
+
+    def __init__(self, redis: FakeRedis = None):
+        self.redis = redis or FakeRedis()
+
+    def create(self, db: int = 0) -> FakeRedis:
+        return self.redis
+
+
+@pytest.fixture
+def fake_redis_pool() -> FakeRedisPool:
+    """
+    fake redis pool
+    :return:
+    """
+    return FakeRedisPool()
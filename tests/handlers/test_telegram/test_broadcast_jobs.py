@@ -0,0 +1,150 @@
+"""
+Test broadcast jobs
+"""
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from pydantic import ValidationError
+from telegram.error import BadRequest
+
+from app.config import settings
+from app.handlers.telegram import BroadcastJobs, TelegramMessagesHandler
+from app.handlers.telegram.broadcast_jobs import _running
+from app.libs.consts.enums import BotType, BroadcastJobStatus, PaymentAccountStatus
+from app.providers import VendorDirectory
+from app.schemas.telegram.account import TelegramChatGroup
+from app.serializers.v1.telegram import TelegramBulkBroadcast
+
+
+class FakeBot:
+    """Bot recording the messages"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None):
+        await asyncio.sleep(0)
+        if chat_id == -404:
+            raise BadRequest("Chat not found")
+        self.sent.append(chat_id)
+        return SimpleNamespace(message_id=len(self.sent))
+
+
+async def wait_for_jobs():
+    """
+    :return:
+    """
+    await asyncio.gather(*list(_running.values()))
+
+
+@pytest.mark.asyncio
+async def test_broadcast_job(fake_redis_pool):
+    """
+    submitted at once, sent in the background, progress and failures kept in Redis
+    """
+    bot = FakeBot()
+    jobs = BroadcastJobs(bot=bot, redis=fake_redis_pool)
+
+    job = await jobs.submit(chat_ids=[-1, -2, -404, -3], text="hello")
+    assert job.status == BroadcastJobStatus.PENDING
+    await wait_for_jobs()
+
+    job = await jobs.get(job.job_id)
+    assert job.status == BroadcastJobStatus.DONE
+    assert (job.total, job.sent, job.failed) == (4, 3, 1)
+    assert [failure.chat_id for failure in job.failures] == [-404]
+    assert job.throughput > 0
+    assert sorted(bot.sent) == [-3, -2, -1]
+    assert await fake_redis_pool.redis.smembers(jobs.redis_name("broadcast_jobs:active")) == set()
+    assert await jobs.get("missing") is None
+
+
+@pytest.mark.asyncio
+async def test_broadcast_job_resume(fake_redis_pool):
+    """
+    a job interrupted by a restart goes on with the chats without a result
+    """
+    redis = fake_redis_pool.redis
+    jobs = BroadcastJobs(bot=FakeBot(), redis=fake_redis_pool)
+    name = jobs.redis_name("broadcast_job:interrupted")
+    await redis.hset(name, mapping={
+        "status": "running", "total": 3, "sent": 1, "failed": 0, "created_at": 1.0, "started_at": 2.0,
+        "chat_ids": json.dumps([-1, -2, -3]),
+        "message": json.dumps({"text": "hello", "parse_mode": None, "reply_markup": None}),
+    })
+    await redis.hset(f"{name}:results", "-1", json.dumps({"chat_id": -1, "ok": True, "message_id": 1}))
+    await redis.sadd(jobs.redis_name("broadcast_jobs:active"), "interrupted")
+
+    bot = FakeBot()
+    assert await BroadcastJobs(bot=bot, redis=fake_redis_pool).resume() == 1
+    await wait_for_jobs()
+
+    assert sorted(bot.sent) == [-3, -2]
+    job = await jobs.get("interrupted")
+    assert (job.status, job.sent, job.started_at) == (BroadcastJobStatus.DONE, 3, 2.0)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_job_runs_in_one_process(fake_redis_pool, monkeypatch):
+    """
+    a job whose lease another process holds isn't resumed until the lease is released
+    """
+    monkeypatch.setattr(settings, "BROADCAST_JOB_LEASE_TTL", 0.03)
+    redis = fake_redis_pool.redis
+    jobs = BroadcastJobs(bot=FakeBot(), redis=fake_redis_pool)
+    name = jobs.redis_name("broadcast_job:leased")
+    await redis.hset(name, mapping={
+        "status": "running", "total": 2, "sent": 0, "failed": 0, "created_at": 1.0,
+        "chat_ids": json.dumps([-1, -2]),
+        "message": json.dumps({"text": "hello", "parse_mode": None, "reply_markup": None}),
+    })
+    await redis.sadd(jobs.redis_name("broadcast_jobs:active"), "leased")
+    await redis.set(f"{name}:lease", "other-process")
+
+    bot = FakeBot()
+    assert await BroadcastJobs(bot=bot, redis=fake_redis_pool).resume() == 1
+    await asyncio.sleep(0.05)
+    assert bot.sent == []
+
+    await redis.delete(f"{name}:lease")
+    await asyncio.wait_for(wait_for_jobs(), timeout=1)
+    assert sorted(bot.sent) == [-2, -1]
+    assert await redis.get(f"{name}:lease") is None
+
+
+class FakeVendorProvider:
+    """Upstream vendor list"""
+
+    async def get_vendors(self):
+        return [
+            TelegramChatGroup(id=chat_id, title="vendor", type="group", in_group=True, bot_type=BotType.VENDORS, payment_account_status=status)
+            for chat_id, status in ((-1, PaymentAccountStatus.PREPARING), (-2, PaymentAccountStatus.OUT_OF_STOCK), (-404, PaymentAccountStatus.PREPARING))
+        ]
+
+
+@pytest.mark.asyncio
+async def test_bulk_broadcast(fake_redis_pool):
+    """
+    to a chat list or the vendors matching a filter, with a result per chat
+    """
+    bot = FakeBot()
+    handler = TelegramMessagesHandler(
+        bot=bot,
+        exchaige_assistant_provider=None,
+        vendor_directory=VendorDirectory(exchaige_assistant_provider=FakeVendorProvider()),
+        broadcast_jobs=BroadcastJobs(bot=bot, redis=fake_redis_pool),
+        redis=fake_redis_pool
+    )
+
+    result = await handler.broadcast_messages(TelegramBulkBroadcast(message="hi", chat_ids=[-5, -6, -5]))
+    assert (result.total, result.sent, result.failed) == (2, 2, 0)
+
+    model = TelegramBulkBroadcast(message="hi", vendor_filter={"payment_account_status": "preparing"})
+    result = await handler.broadcast_messages(model)
+    assert [(item.chat_id, item.ok) for item in result.results] == [(-1, True), (-404, False)]
+    assert result.failed == 1
+
+    with pytest.raises(ValidationError):
+        TelegramBulkBroadcast(message="hi")
@@ -1,7 +1,9 @@
 """
 Test Telegram messages handler
 """
+import asyncio
 import uuid
+from types import SimpleNamespace
 
 import pytest
 
@@ -30,3 +32,55 @@ async def test_payment_account(telegram_messages_handler: TelegramMessagesHandle
         exchange_currency="GCASH",
     )
     await telegram_messages_handler.payment_account(model=model)
+
+
+class FakeMessageBot:
+    """Bot recording the messages"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None):
+        await asyncio.sleep(0.01)
+        self.sent.append(chat_id)
+        return SimpleNamespace(to_dict=lambda: {"message_id": len(self.sent), "chat": {"id": chat_id}})
+
+
+@pytest.mark.asyncio
+async def test_payment_account_is_sent_once(fake_redis_pool):
+    """
+    a retried or duplicated payment_account gets the first response instead of a second message
+    """
+    bot = FakeMessageBot()
+    handler = TelegramMessagesHandler(
+        bot=bot,
+        exchaige_assistant_provider=None,
+        vendor_directory=None,
+        broadcast_jobs=None,
+        redis=fake_redis_pool
+    )
+    model = PaymentAccount(
+        order_id=uuid.uuid4(),
+        customer_id=1,
+        vendor_id=10,
+        total_amount=20 * 56.7,
+        payment_currency="PHP",
+        exchange_currency="GCASH",
+    )
+    responses = await asyncio.gather(
+        handler.payment_account(model=model),
+        handler.payment_account(model=model),
+    )
+    assert await handler.payment_account(model=model) == responses[0] == responses[1]
+    assert bot.sent == [10]
+
+    # another endpoint, or another key, is another message
+    await handler.hurry_payment_account(model=model)
+    await handler.payment_account(model=model, idempotency_key="retry-2")
+    assert bot.sent == [10, 10, 10]
+
+    # an order may be hurried again, only a retry with the same key is deduplicated
+    await handler.hurry_payment_account(model=model)
+    await handler.hurry_payment_account(model=model, idempotency_key="hurry-1")
+    await handler.hurry_payment_account(model=model, idempotency_key="hurry-1")
+    assert bot.sent == [10] * 5
@@ -0,0 +1,214 @@
+"""
+Test the receipts sent to the vendors
+"""
+import asyncio
+import io
+import json
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from uuid import uuid4
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from telegram import InputFile
+from telegram.error import BadRequest
+
+from app.handlers.telegram import TelegramMessagesHandler
+from app.handlers.telegram.messages import receipt_checks, receipt_file_ids, receipt_uploads
+from app.libs.metrics import metrics
+from app.serializers.v1.telegram import CheckReceipt
+
+
+class FakeFileResponse:
+    """streamed HttpResponse"""
+
+    def __init__(self, content: bytes):
+        self.headers = {"content-length": str(len(content))}
+        self._content = content
+        self.closed = False
+
+    async def aiter_bytes(self, chunk_size=None):
+        async def _chunks():
+            for index in range(0, len(self._content), chunk_size):
+                yield self._content[index:index + chunk_size]
+        return _chunks()
+
+    async def aclose(self):
+        self.closed = True
+
+
+class FakeFilesProvider:
+    """ExchaigeAssistantProvider serving the receipt files"""
+
+    def __init__(self, content: bytes = b"receipt image", files_cached: bool = True):
+        self.content = content
+        self.files_cached = files_cached
+        self.downloads = 0
+
+    @asynccontextmanager
+    async def open_file(self, file_id: str, file_name: str):
+        self.downloads += 1
+        yield io.BytesIO(self.content)
+
+    @asynccontextmanager
+    async def stream_file(self, file_id: str, file_name: str):
+        self.downloads += 1
+        yield FakeFileResponse(self.content)
+
+
+class FakePhotoBot:
+    """Bot recording the photos, a file_id it didn't hand out is rejected"""
+
+    def __init__(self):
+        self.photos = []
+        self.uploads = 0
+
+    async def send_photo(self, chat_id, photo, reply_markup=None):
+        if isinstance(photo, str) and not photo.startswith("uploaded-"):
+            raise BadRequest("Wrong file identifier/http url specified")
+        if isinstance(photo, InputFile):
+            self.uploads += 1
+            photo = photo.input_file_content.read()
+        self.photos.append((chat_id, photo))
+        file_id = photo if isinstance(photo, str) else f"uploaded-{self.uploads}"
+        return SimpleNamespace(photo=[SimpleNamespace(file_id="thumbnail"), SimpleNamespace(file_id=file_id)])
+
+
+@pytest.mark.asyncio
+async def test_check_receipt_reuses_file_id(fake_redis_pool):
+    """
+    the receipt is uploaded once, the next sends reference its file_id, a rejected file_id is uploaded again
+    """
+    bot, provider = FakePhotoBot(), FakeFilesProvider()
+    handler = TelegramMessagesHandler(
+        bot=bot,
+        exchaige_assistant_provider=provider,
+        vendor_directory=None,
+        broadcast_jobs=None,
+        redis=fake_redis_pool
+    )
+    metrics.reset()
+    receipt = dict(order_id=uuid4(), customer_id=1, file_id="f1", file_name="receipt.png")
+
+    await handler.check_receipt(CheckReceipt(vendor_id=10, **receipt))
+    await handler.check_receipt(CheckReceipt(vendor_id=11, **receipt))
+    assert bot.photos == [(10, b"receipt image"), (11, "uploaded-1")]
+    assert provider.downloads == 1
+    assert metrics.snapshot()["gauges"]["telegram_file_cache.hit_rate{cache=receipt}"] == 0.5
+
+    await receipt_file_ids.set(fake_redis_pool.redis, key="f1:receipt.png", file_id="expired")
+    await handler.check_receipt(CheckReceipt(vendor_id=12, **receipt))
+    assert bot.photos[-1] == (12, b"receipt image")
+    assert provider.downloads == 2
+    assert await receipt_file_ids.get(fake_redis_pool.redis, key="f1:receipt.png") == "uploaded-2"
+
+
+@pytest.mark.asyncio
+async def test_check_receipt_spools_large_receipts(fake_redis_pool, monkeypatch):
+    """
+    without the disk cache, a receipt bigger than the memory share of a transfer is spooled to disk and streamed to Telegram
+    """
+    monkeypatch.setattr(receipt_uploads, "max_memory", 1024)
+    content = bytes(range(256)) * 1024
+    bot = FakePhotoBot()
+    handler = TelegramMessagesHandler(
+        bot=bot,
+        exchaige_assistant_provider=FakeFilesProvider(content=content, files_cached=False),
+        vendor_directory=None,
+        broadcast_jobs=None,
+        redis=fake_redis_pool
+    )
+    metrics.reset()
+
+    await handler.check_receipt(
+        CheckReceipt(order_id=uuid4(), customer_id=1, vendor_id=10, file_id="big", file_name="receipt.jpg")
+    )
+    assert bot.photos == [(10, content)]
+    assert metrics.get_counter("telegram.uploads.spooled", uploads="receipt", storage="disk") == 1
+    assert metrics.snapshot()["gauges"]["telegram.uploads.in_flight_bytes{uploads=receipt}"] == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_check_receipt(fake_redis_pool, monkeypatch):
+    """
+    receipts are checked by the workers, 429 when the queue is full, a rejected receipt is dead-lettered
+    """
+    monkeypatch.setattr(receipt_checks, "retry_interval", 0)
+    bot = FakePhotoBot()
+    handler = TelegramMessagesHandler(
+        bot=bot,
+        exchaige_assistant_provider=FakeFilesProvider(),
+        vendor_directory=None,
+        broadcast_jobs=None,
+        redis=fake_redis_pool
+    )
+    receipt = CheckReceipt(order_id=uuid4(), customer_id=1, vendor_id=10, file_id="f1", file_name="receipt.png")
+    handler.queue_check_receipt(receipt)
+    await receipt_checks.stop()
+    assert bot.photos == [(10, b"receipt image")]
+
+    async def rejected(chat_id, photo, reply_markup=None):
+        raise BadRequest("Chat not found")
+
+    monkeypatch.setattr(bot, "send_photo", rejected)
+    handler.queue_check_receipt(receipt.model_copy(update={"file_id": "f2"}))
+    await receipt_checks.stop()
+    [entry] = await fake_redis_pool.redis.lrange(handler.dead_letter_name(), 0, -1)
+    assert json.loads(entry)["receipt"]["file_id"] == "f2"
+    assert "Chat not found" in json.loads(entry)["error"]
+
+    monkeypatch.setattr(receipt_checks, "maxsize", 1)
+    monkeypatch.setattr(receipt_checks, "workers", 1)
+    release = asyncio.Event()
+
+    async def blocked(chat_id, photo, reply_markup=None):
+        await release.wait()
+
+    monkeypatch.setattr(bot, "send_photo", blocked)
+    handler.queue_check_receipt(receipt)
+    await asyncio.sleep(0)
+    handler.queue_check_receipt(receipt)
+    with pytest.raises(HTTPException) as exc_info:
+        handler.queue_check_receipt(receipt)
+    assert exc_info.value.status_code == 429
+    assert exc_info.value.headers == {"Retry-After": "1"}
+    release.set()
+    await receipt_checks.stop()
+
+
+@pytest.mark.asyncio
+async def test_check_receipt_upstream_rejection_is_not_retried(fake_redis_pool, monkeypatch):
+    """
+    a receipt the upstream answers with a 4xx goes straight to the dead letter, a 5xx is retried
+    """
+    monkeypatch.setattr(receipt_checks, "retry_interval", 0)
+    provider = FakeFilesProvider(files_cached=False)
+    codes = [404]
+
+    @asynccontextmanager
+    async def stream_file(file_id, file_name):
+        provider.downloads += 1
+        request = httpx.Request("GET", "http://upstream/files")
+        response = httpx.Response(codes[0], request=request)
+        raise httpx.HTTPStatusError("upstream error", request=request, response=response)
+        yield  # pylint: disable=unreachable
+
+    monkeypatch.setattr(provider, "stream_file", stream_file)
+    handler = TelegramMessagesHandler(
+        bot=FakePhotoBot(),
+        exchaige_assistant_provider=provider,
+        vendor_directory=None,
+        broadcast_jobs=None,
+        redis=fake_redis_pool
+    )
+    receipt = CheckReceipt(order_id=uuid4(), customer_id=1, vendor_id=10, file_id="missing", file_name="receipt.png")
+    handler.queue_check_receipt(receipt)
+    await receipt_checks.stop()
+    assert provider.downloads == 1
+
+    codes[0] = 502
+    handler.queue_check_receipt(receipt)
+    await receipt_checks.stop()
+    assert provider.downloads == 2 + receipt_checks.max_retries
+    assert len(await fake_redis_pool.redis.lrange(handler.dead_letter_name(), 0, -1)) == 2
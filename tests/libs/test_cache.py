@@ -0,0 +1,206 @@
+"""
+Test caches
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.libs.cache import DiskLRUCache, FingerprintCache, IdempotencyStore, RefreshAheadCache
+from tests.fixtures.redis import FakeRedis
+
+
+class Loader:
+    """Counting loader"""
+
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(0)
+        if self.fail:
+            raise ConnectionError("upstream down")
+        return self.calls
+
+
+@pytest.mark.asyncio
+async def test_refresh_ahead_cache(monkeypatch):
+    """
+    fresh hits, refresh-ahead in the background, stale value while the upstream fails, invalidation
+    """
+    now = [0.0]
+    monkeypatch.setattr("app.libs.cache.refresh_ahead.time", SimpleNamespace(monotonic=lambda: now[0]))
+    loader = Loader()
+    cache = RefreshAheadCache(name="test", loader=loader, ttl=10, refresh_ahead=2, stale_if_error=5)
+
+    assert await asyncio.gather(cache.get(), cache.get()) == [1, 1]
+    assert loader.calls == 1
+
+    now[0] = 9
+    assert await cache.get() == 1
+    await asyncio.sleep(0.01)
+    assert loader.calls == 2
+
+    loader.fail = True
+    now[0] = 9 + 12
+    assert await cache.get() == 2
+    now[0] = 9 + 16
+    with pytest.raises(ConnectionError):
+        await cache.get()
+
+    loader.fail = False
+    cache.invalidate()
+    assert await cache.get() == loader.calls
+
+
+@pytest.mark.asyncio
+async def test_refresh_ahead_cache_invalidated_during_load():
+    """
+    a load which started before the invalidation doesn't overwrite the cache with what it fetched
+    """
+    release = asyncio.Event()
+    values = iter(["stale", "fresh"])
+
+    async def loader():
+        value = next(values)
+        if value == "stale":
+            await release.wait()
+        return value
+
+    cache = RefreshAheadCache(name="test", ttl=10)
+    stale = asyncio.create_task(cache.get(loader=loader))
+    await asyncio.sleep(0)
+    cache.invalidate()
+    assert await cache.get(loader=loader) == "fresh"
+    release.set()
+    assert await stale == "stale"
+    assert await cache.get(loader=loader) == "fresh"
+
+
+@pytest.mark.asyncio
+async def test_fingerprint_cache(fake_redis_pool, monkeypatch):
+    """
+    unchanged payloads are skipped until the ttl, from the local LRU or from Redis
+    """
+    now = [0.0]
+    monkeypatch.setattr("app.libs.cache.fingerprint.time", SimpleNamespace(monotonic=lambda: now[0]))
+    redis = fake_redis_pool.redis
+    cache = FingerprintCache(name="test", ttl=60, maxsize=1)
+    first, second = cache.fingerprint({"id": 1}), cache.fingerprint({"id": 2})
+    assert cache.fingerprint({"id": 1}) == first
+
+    assert await cache.changed(redis, {"a": first, "b": first}) == {"a", "b"}
+    await cache.remember(redis, {"a": first, "b": first})
+    assert await cache.changed(redis, {"a": first, "b": first}) == set()
+    assert await cache.changed(redis, {"a": second}) == {"a"}
+
+    # another worker, only Redis knows the fingerprint
+    other = FingerprintCache(name="test", ttl=60)
+    assert await other.changed(redis, {"b": first}) == set()
+
+    now[0] = 61
+    assert await cache.changed(FakeRedis(), {"b": first}) == {"b"}
+
+
+@pytest.mark.asyncio
+async def test_disk_lru_cache(tmp_path):
+    """
+    files are downloaded once, evicted least recently used first, a failed write leaves no partial file
+    """
+    (tmp_path / ".tmp-interrupted").write_bytes(b"partial")
+    cache = DiskLRUCache(name="test", directory=tmp_path, max_bytes=10)
+    downloads = []
+
+    def download(content: bytes):
+        async def _write(file):
+            downloads.append(content)
+            await asyncio.sleep(0)
+            file.write(content)
+        return _write
+
+    async def read(key: str, content: bytes) -> bytes:
+        async with cache.open(key, download(content)) as file:
+            return file[:]
+
+    # concurrent misses share one download
+    assert await asyncio.gather(read("a", b"aaaa"), read("a", b"aaaa")) == [b"aaaa", b"aaaa"]
+    assert downloads == [b"aaaa"]
+    assert not (tmp_path / ".tmp-interrupted").exists()
+
+    assert await read("b", b"bbbb") == b"bbbb"
+    assert await read("a", b"aaaa") == b"aaaa"
+    assert await read("c", b"cccc") == b"cccc"
+    # b was the least recently used
+    assert downloads == [b"aaaa", b"bbbb", b"cccc"]
+    assert cache.size == 8 and set(cache.index) == {cache.digest("a"), cache.digest("c")}
+
+    async def fail(file):
+        file.write(b"xx")
+        raise ConnectionError
+
+    with pytest.raises(ConnectionError):
+        async with cache.open("d", fail):
+            pass
+    assert [path.name for path in tmp_path.iterdir() if path.name.startswith(".tmp-")] == []
+
+    # another process finds the files on disk
+    restarted = DiskLRUCache(name="test", directory=tmp_path, max_bytes=10)
+    assert set(restarted.index) == set(cache.index) and restarted.size == 8
+
+
+@pytest.mark.asyncio
+async def test_idempotency_store(fake_redis_pool):
+    """
+    a request runs once per key, duplicates wait for it and get its response, a failure releases the key
+    """
+    redis = fake_redis_pool.redis
+    store = IdempotencyStore(name="test", ttl=60, lock_ttl=5, poll_interval=0.001)
+    other_process = IdempotencyStore(name="test", ttl=60, lock_ttl=5, poll_interval=0.001)
+    calls = []
+
+    async def send():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"message_id": len(calls)}
+
+    responses = await asyncio.gather(
+        store.run(redis, "order-1", send),
+        store.run(redis, "order-1", send),
+        other_process.run(redis, "order-1", send),
+    )
+    assert responses == [{"message_id": 1}] * 3
+    assert await store.run(redis, "order-1", send) == {"message_id": 1}
+    assert len(calls) == 1
+
+    async def fail():
+        raise ConnectionError("telegram down")
+
+    with pytest.raises(ConnectionError):
+        await store.run(redis, "order-2", fail)
+    assert await store.run(redis, "order-2", send) == {"message_id": 2}
+
+
+@pytest.mark.asyncio
+async def test_idempotency_store_renews_its_claim(fake_redis_pool):
+    """
+    a request running longer than lock_ttl keeps its key, a duplicate waits for it instead of running again
+    """
+    redis = fake_redis_pool.redis
+    store = IdempotencyStore(name="test_renew", ttl=60, lock_ttl=0.03, poll_interval=0.001)
+    other_process = IdempotencyStore(name="test_renew", ttl=60, lock_ttl=0.03, poll_interval=0.001)
+    calls = []
+
+    async def send():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return {"message_id": len(calls)}
+
+    async def duplicate():
+        await asyncio.sleep(0.06)
+        return await other_process.run(redis, "order-1", send)
+
+    responses = await asyncio.gather(store.run(redis, "order-1", send), duplicate())
+    assert responses == [{"message_id": 1}] * 2
+    assert len(calls) == 1
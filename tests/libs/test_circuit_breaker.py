@@ -0,0 +1,109 @@
+"""
+Test circuit breaker
+"""
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from app.libs.http_client import HttpClient, HttpDefaults, CircuitBreaker, CircuitOpenError, CircuitState
+from app.libs.metrics import metrics
+
+
+def test_circuit_breaker_transitions(monkeypatch):
+    """
+    closed -> open after the threshold, half-open after the timeout, closed after a successful probe
+    """
+    now = [1000.0]
+    monkeypatch.setattr("app.libs.http_client.circuit_breaker.time", SimpleNamespace(monotonic=lambda: now[0]))
+    breaker = CircuitBreaker(host="https://example.com:443", failure_threshold=2, reset_timeout=10)
+
+    breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    now[0] += 10
+    assert breaker.state == CircuitState.HALF_OPEN
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        # only one probe at a time
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+
+    now[0] += 10
+    breaker.before_call()
+    breaker.record_response(httpx.Response(404))
+    assert breaker.state == CircuitState.CLOSED
+    assert metrics.snapshot()["gauges"]["http_client.circuit_breaker.state{host=https://example.com:443}"] == 0
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_fails_fast():
+    """
+    Once the host failed enough, calls are rejected without reaching it
+    """
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(503)
+
+    client = HttpClient(defaults=HttpDefaults(verbose=False, circuit_failure_threshold=3))
+    transport = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    for _ in range(3):
+        session = client.create("https://down.example.com/api/v1/currency/all")
+        session._client = transport
+        assert (await session.aget()).status_code == 503
+
+    session = client.create("https://down.example.com/api/v1/currency/all")
+    session._client = transport
+    with pytest.raises(CircuitOpenError):
+        await session.aget()
+    assert len(calls) == 3
+    assert client.get_circuit_breaker("https://down.example.com/").state == CircuitState.OPEN
+    await transport.aclose()
+
+
+@pytest.mark.asyncio
+async def test_half_open_probe_slot_is_given_back():
+    """
+    A probe which raises outside the retried errors, or is cancelled, doesn't hold the half-open slot
+    """
+    url = "https://flaky.example.com/api/v1/telegram/messages/confirm_pay"
+    answers = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        answer = answers.pop(0)
+        if answer == "hang":
+            await asyncio.sleep(10)
+        if isinstance(answer, Exception):
+            raise answer
+        return httpx.Response(answer)
+
+    client = HttpClient(defaults=HttpDefaults(verbose=False, circuit_failure_threshold=1, circuit_reset_timeout=0))
+    transport = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    async def _post():
+        session = client.create(url).retry(0, 0.01)
+        session._client = transport
+        return await session.add_json({"order_id": "1"}).apost()
+
+    answers.extend([503, httpx.PoolTimeout("pool"), "hang", 200])
+    assert (await _post()).status_code == 503
+    breaker = client.get_circuit_breaker(url)
+    assert breaker.state == CircuitState.HALF_OPEN
+    with pytest.raises(httpx.PoolTimeout):
+        await _post()
+    probe = asyncio.create_task(_post())
+    await asyncio.sleep(0.01)
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+    assert (await _post()).status_code == 200
+    assert breaker.state == CircuitState.CLOSED
+    await transport.aclose()
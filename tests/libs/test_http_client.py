@@ -0,0 +1,170 @@
+"""
+Test http client
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from app.libs.http_client import HttpClient, HttpDefaults, HttpHostOptions
+from app.libs.metrics import metrics
+
+
+@pytest.mark.asyncio
+async def test_sessions_borrow_pool_per_origin():
+    """
+    Sessions of the same origin share one connection pool, the pool outlives the sessions
+    """
+    client = HttpClient(defaults=HttpDefaults(verbose=False))
+    first = client.create("https://example.com/api/v1/currency/all")
+    second = client.create("https://example.com/api/v1/telegram/account/vendors")
+    other = client.create("https://example.org/api/v1/currency/all")
+    async with first, second, other:
+        pass
+
+    assert first._client is second._client
+    assert first._client is not other._client
+    assert not first._client.is_closed
+    assert len(client.pools) == 2
+
+    await client.aclose()
+    assert first._client.is_closed
+    assert not client.pools
+
+
+@pytest.mark.asyncio
+async def test_unpooled_session_owns_client():
+    """
+    Opting out of the pool builds a private client which the session closes itself
+    """
+    client = HttpClient(defaults=HttpDefaults(verbose=False))
+    session = client.create("https://example.com/api/v1/currency/all").pooled(False)
+    async with session:
+        pass
+    assert session._client.is_closed
+    assert not client.pools
+
+
+@pytest.mark.asyncio
+async def test_http2_host_falls_back_to_http1():
+    """
+    An HTTP/2 host which fails before any HTTP/2 response is downgraded, other hosts keep their settings
+    """
+    pytest.importorskip("h2")
+    client = HttpClient(defaults=HttpDefaults(verbose=False))
+    client.configure_host("https://example.com", HttpHostOptions(http2=True, max_connections=4))
+
+    pool = client.get_pool("https://example.com/api/v1/currency/all")
+    assert pool in client._http2_pools.values()
+    assert pool._transport._pool._max_connections == 4
+    assert client.get_pool("https://example.org/") not in client._http2_pools.values()
+
+    assert client.downgrade_http2("https://example.com/api/v1/files", pool) is True
+    http1_pool = client.get_pool("https://example.com/api/v1/currency/all")
+    assert http1_pool is not pool
+    assert http1_pool not in client._http2_pools.values()
+    await client.aclose()
+    assert pool.is_closed
+
+
+@pytest.mark.asyncio
+async def test_confirmed_http2_host_is_not_downgraded():
+    """
+    Once a pool got an HTTP/2 response its failures are regular transport errors
+    """
+    pytest.importorskip("h2")
+    client = HttpClient(defaults=HttpDefaults(verbose=False, http2=True))
+    pool = client.get_pool("https://example.com/")
+    client.confirm_http2(pool)
+    assert client.downgrade_http2("https://example.com/", pool) is False
+    assert client.get_pool("https://example.com/") is pool
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_http2_downgrade_never_replays_a_post():
+    """
+    A read error keeps HTTP/2, a protocol error downgrades the host for a cooldown without resending the POST
+    """
+    pytest.importorskip("h2")
+    url = "https://example.com/api/v1/telegram/messages/confirm_pay"
+    errors = [httpx.ReadError("reset"), httpx.RemoteProtocolError("bad frame")]
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        raise errors.pop(0)
+
+    client = HttpClient(defaults=HttpDefaults(verbose=False, http2=True, http2_downgrade_cooldown=0.05))
+    pool = client.get_pool(url)
+    pool._transport = httpx.MockTransport(handler)
+    with pytest.raises(httpx.ReadError):
+        await client.create(url).retry(0, 0.01).add_json({"order_id": "1"}).apost()
+    assert client.get_pool(url) is pool
+
+    with pytest.raises(httpx.RemoteProtocolError):
+        await client.create(url).retry(0, 0.01).add_json({"order_id": "1"}).apost()
+    assert len(calls) == 2
+    http1_pool = client.get_pool(url)
+    assert http1_pool is not pool and http1_pool not in client._http2_pools.values()
+
+    await asyncio.sleep(0.06)
+    assert client.get_pool(url) in client._http2_pools.values()
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_identical_gets_are_coalesced():
+    """
+    Concurrent identical GETs share one upstream request and one parsed response
+    """
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"currencies": []})
+
+    client = HttpClient(defaults=HttpDefaults(verbose=False))
+    transport = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    def session(url: str, api_key: str = "key"):
+        _session = client.create(url).add_header("X-API-KEY", api_key)
+        _session._client = transport
+        return _session
+
+    url = "https://example.com/api/v1/currency/all"
+    responses = await asyncio.gather(
+        *[session(url).aget() for _ in range(5)],
+        session(url, api_key="other").aget(),
+        session(url).coalesce(False).aget(),
+    )
+    assert len(calls) == 3
+    assert responses[0] is responses[4]
+    assert responses[0].json() is responses[1].json()
+    assert responses[5] is not responses[0]
+    assert metrics.get_counter("http_client.single_flight.calls", result="shared") >= 4
+    await transport.aclose()
+
+
+@pytest.mark.asyncio
+async def test_streamed_response_is_read_in_chunks():
+    """
+    A streamed response hands out its body chunk by chunk
+    """
+    body = bytes(range(256)) * 64
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=body, headers={"content-length": str(len(body))})
+
+    client = HttpClient(defaults=HttpDefaults(verbose=False))
+    transport = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    session = client.create("https://example.com/api/v1/files/1/receipt.jpg")
+    session._client = transport
+
+    async with session.astream() as resp:
+        assert resp.status_code == 200
+        chunks = [chunk async for chunk in await resp.aiter_bytes(chunk_size=1024)]
+    assert len(chunks) == 16
+    assert b"".join(chunks) == body
+    await transport.aclose()
@@ -0,0 +1,133 @@
+"""
+Test retry policy
+"""
+import httpx
+import pytest
+
+from app.libs.http_client import HttpClient, HttpDefaults, RetryPolicy
+
+URL = httpx.URL("https://example.com/api/v1/telegram/messages/confirm_pay")
+
+
+def test_idempotency_classification():
+    """
+    Methods and endpoints are classified, POSTs are unsafe unless marked
+    """
+    policy = RetryPolicy(idempotent_endpoints=["POST */currency_rate"])
+    assert policy.is_idempotent("GET", URL)
+    assert policy.is_idempotent("PUT", URL)
+    assert not policy.is_idempotent("POST", URL)
+    # the upstream never promised to dedupe on the header
+    assert not policy.is_idempotent("POST", URL, headers={"Idempotency-Key": "order-1"})
+    assert policy.start("POST", URL, idempotent=True).idempotent
+    assert policy.is_idempotent("POST", httpx.URL("https://example.com/api/v1/exchange_rate/currency_rate"))
+
+
+def test_non_idempotent_only_retried_when_not_sent():
+    """
+    A POST is resent only when the request never reached the server
+    """
+    policy = RetryPolicy()
+    state = policy.start("POST", URL)
+    assert state.next_delay(response=httpx.Response(500)) is None
+    assert state.next_delay(exception=httpx.ReadTimeout("timeout")) is None
+    assert state.next_delay(exception=httpx.ConnectError("refused")) is not None
+    assert state.next_delay(response=httpx.Response(503, headers={"Retry-After": "1"})) >= 1
+
+
+def test_decorrelated_jitter_and_retry_after():
+    """
+    Backoff stays within [base, cap], Retry-After wins and a too long one isn't waited for
+    """
+    policy = RetryPolicy(base_delay=0.1, max_delay=1.0, budget_capacity=100)
+    state = policy.start("GET", URL)
+    delays = [state.next_delay(response=httpx.Response(502)) for _ in range(20)]
+    assert all(0.1 <= delay <= 1.0 for delay in delays)
+    assert 2 <= state.next_delay(response=httpx.Response(429, headers={"Retry-After": "2"})) <= 2.1
+    assert state.next_delay(response=httpx.Response(429, headers={"Retry-After": "3600"})) is None
+
+
+def test_backoff_is_jittered():
+    """
+    the workers' backoff grows from the base delay up to the cap, two callers don't wait the same
+    """
+    policy = RetryPolicy(base_delay=1.0, max_delay=8.0)
+    delays = [policy.backoff(1.0) for _ in range(50)]
+    assert all(1.0 <= delay <= 3.0 for delay in delays) and len(set(delays)) > 1
+    assert all(1.0 <= policy.backoff(100.0) <= 8.0 for _ in range(10))
+    assert 0.5 <= policy.backoff(0.5, base_delay=0.5) <= 1.5
+
+
+def test_retry_budget_per_host():
+    """
+    Retries of a host stop once its budget is spent, other hosts are unaffected
+    """
+    policy = RetryPolicy(budget_ratio=0.5, budget_capacity=2)
+    state = policy.start("GET", URL)
+    assert state.next_delay(exception=httpx.ConnectError("refused")) is not None
+    assert state.next_delay(exception=httpx.ConnectError("refused")) is not None
+    assert state.next_delay(exception=httpx.ConnectError("refused")) is None
+    # two more requests earn one retry back
+    policy.start("GET", URL)
+    assert policy.start("GET", URL).next_delay(exception=httpx.ConnectError("refused")) is not None
+    other = policy.start("GET", httpx.URL("https://example.org/"))
+    assert other.next_delay(exception=httpx.ConnectError("refused")) is not None
+
+
+@pytest.mark.asyncio
+async def test_arequest_honors_retry_after():
+    """
+    arequest retries a 503 + Retry-After and returns the next answer
+    """
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        if len(calls) == 1:
+            return httpx.Response(503, headers={"Retry-After": "0"})
+        return httpx.Response(200, json={"ok": True})
+
+    client = HttpClient(defaults=HttpDefaults(verbose=False, retry_policy=RetryPolicy(base_delay=0.01)))
+    session = client.create("https://example.com/api/v1/telegram/messages/confirm_pay").retry(2, 0.01)
+    session._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    resp = await session.add_json({"order_id": "1"}).apost()
+    assert resp.status_code == 200
+    assert len(calls) == 2
+
+
+def test_sync_request_retries(monkeypatch):
+    """
+    request retries like arequest, a retryable answer it can't wait for is returned as the last attempt's
+    """
+    answers = [httpx.Response(503, headers={"Retry-After": "0"}), httpx.Response(200, json={"ok": True})]
+    calls = []
+
+    def _request(method, url, **kwargs):
+        calls.append((method, url))
+        return answers.pop(0)
+
+    monkeypatch.setattr(httpx, "request", _request)
+    client = HttpClient(defaults=HttpDefaults(verbose=False, retry_policy=RetryPolicy(base_delay=0.01)))
+    resp = client.create(str(URL)).retry(2, 0.01).add_json({"order_id": "1"}).post()
+    assert resp.status_code == 200
+    assert len(calls) == 2
+
+    monkeypatch.setattr(httpx, "request", lambda method, url, **kwargs: httpx.Response(502))
+    assert client.create(str(URL)).retry(2, 0.01).get().status_code == 502
+
+
+@pytest.mark.asyncio
+async def test_sync_request_in_event_loop_returns_last_answer(monkeypatch):
+    """
+    inside an event loop the sync retries are skipped: the answer is returned, the error raised
+    """
+    monkeypatch.setattr(httpx, "request", lambda method, url, **kwargs: httpx.Response(502))
+    client = HttpClient(defaults=HttpDefaults(verbose=False, retry_policy=RetryPolicy(base_delay=0.01)))
+    assert client.create(str(URL)).retry(2, 0.01).get().status_code == 502
+
+    def _refused(method, url, **kwargs):
+        raise httpx.ConnectError("refused")
+
+    monkeypatch.setattr(httpx, "request", _refused)
+    with pytest.raises(httpx.ConnectError):
+        client.create(str(URL)).retry(2, 0.01).get()
@@ -0,0 +1,351 @@
+"""
+Test telegram rate limiting, fan-out, the bot's connection pool metrics and the webhook ingestion
+"""
+import asyncio
+import time
+from functools import partial
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from telegram import Update
+from telegram.error import BadRequest, RetryAfter, TimedOut
+from telegram.ext import ApplicationBuilder, TypeHandler
+from telegram.request import HTTPXRequest
+
+from app.bot import update_priority
+from app.config import settings
+from app.libs.metrics import metrics
+from app.libs.telegram import (
+    LazyUpdateApplication,
+    PriorityUpdateQueue,
+    RawUpdate,
+    TelegramRateLimiter,
+    TelegramRequest,
+    TokenBucket,
+    UpdateDeduplicator,
+    UpdateIdWindow,
+    UpdatePriority,
+    fan_out,
+    secret_token_matches,
+)
+from app.routers.webhooks.v1 import telegram as telegram_webhook
+
+
+@pytest.mark.asyncio
+async def test_token_bucket():
+    """
+    the burst is free, then tokens come at the rate
+    """
+    bucket = TokenBucket(rate=100, capacity=2)
+    started = time.monotonic()
+    for _ in range(4):
+        await bucket.acquire()
+    assert 0.015 <= time.monotonic() - started < 0.2
+
+
+@pytest.mark.asyncio
+async def test_retry_after_pauses_the_lane_only():
+    """
+    a flood controlled chat is paused and retried, the other chats keep going
+    """
+    limiter = TelegramRateLimiter(global_rate=1000, group_rate=1000, group_burst=1000, max_retries=1)
+    sent = []
+    flooded = {-1}
+
+    async def send(chat_id):
+        if chat_id in flooded:
+            flooded.discard(chat_id)
+            raise RetryAfter(retry_after=0)
+        sent.append((chat_id, time.monotonic()))
+        return True
+
+    limiter.get_lane(-1).pause(0.2)
+    started = time.monotonic()
+    await asyncio.gather(*(
+        limiter.process_request(send, (chat_id,), {}, "sendMessage", {"chat_id": chat_id}, None)
+        for chat_id in (-1, -2, -3)
+    ))
+    times = {chat_id: at - started for chat_id, at in sent}
+    assert times[-2] < 0.1 and times[-3] < 0.1
+    assert times[-1] >= 0.2
+
+    with pytest.raises(RetryAfter):
+        async def always_flooded():
+            raise RetryAfter(retry_after=0)
+        await limiter.process_request(always_flooded, (), {}, "sendMessage", {"chat_id": -4}, 0)
+
+
+@pytest.mark.asyncio
+async def test_fan_out():
+    """
+    every chat gets a result, in order
+    """
+    async def send(chat_id):
+        if chat_id == 2:
+            raise BadRequest("Chat not found")
+        await asyncio.sleep(0.001 * (5 - chat_id))
+        return SimpleNamespace(message_id=chat_id * 10)
+
+    results = await fan_out(chat_ids=[1, 2, 3], send=send, concurrency=2)
+    assert [(result.chat_id, result.ok, result.message_id) for result in results] == [
+        (1, True, 10), (2, False, None), (3, True, 30)
+    ]
+    assert results[1].error == "Chat not found"
+    assert await fan_out(chat_ids=[], send=send) == []
+
+
+@pytest.mark.asyncio
+async def test_fan_out_stops_every_sender_on_error():
+    """
+    when recording a result fails, the other senders are stopped before fan_out raises
+    """
+    sending = []
+
+    async def send(chat_id):
+        sending.append(chat_id)
+        await asyncio.sleep(0 if chat_id == 1 else 0.05)
+        return SimpleNamespace(message_id=chat_id)
+
+    async def on_result(result):
+        if result.chat_id == 1:
+            raise ConnectionError("redis down")
+
+    with pytest.raises(ConnectionError):
+        await fan_out(chat_ids=range(1, 10), send=send, concurrency=3, on_result=on_result)
+    await asyncio.sleep(0.1)
+    assert sorted(sending) == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_request_pool_saturation(monkeypatch):
+    """
+    the requests beyond the pool size are counted as queued, a pool timeout as a metric
+    """
+    release = asyncio.Event()
+
+    async def do_request(self, url, method, **kwargs):
+        if url.endswith("timeout"):
+            raise TimedOut(message="Pool timeout: All connections in the connection pool are occupied.")
+        await release.wait()
+        return 200, b"{}"
+
+    monkeypatch.setattr(HTTPXRequest, "do_request", do_request)
+    metrics.reset()
+    request = TelegramRequest(name="test", connection_pool_size=2)
+
+    tasks = [asyncio.create_task(request.do_request(url=f"https://bot/{index}", method="POST")) for index in range(3)]
+    await asyncio.sleep(0)
+    gauges = metrics.snapshot()["gauges"]
+    assert gauges["telegram.http.in_flight{request=test}"] == 3
+    assert gauges["telegram.http.pool_size{request=test}"] == 2
+    assert metrics.get_counter("telegram.http.queued", request="test") == 1
+
+    with pytest.raises(TimedOut):
+        await request.do_request(url="https://bot/timeout", method="POST")
+    assert metrics.get_counter("telegram.http.pool_timeouts", request="test") == 1
+
+    release.set()
+    assert await asyncio.gather(*tasks) == [(200, b"{}")] * 3
+    gauges = metrics.snapshot()["gauges"]
+    assert gauges["telegram.http.in_flight{request=test}"] == 0
+    assert gauges["telegram.http.peak_in_flight{request=test}"] == 4
+
+
+def test_request_http2_falls_back_without_h2(monkeypatch):
+    """
+    HTTP/2 is used when asked for and h2 is installed, HTTP/1.1 otherwise instead of failing at import
+    """
+    assert TelegramRequest(name="test_http2", http2=True).http_version == "2"
+    monkeypatch.setattr("app.libs.telegram.request.HTTP2_AVAILABLE", False)
+    assert TelegramRequest(name="test_http2", http2=True).http_version == "1.1"
+
+
+def test_update_id_window():
+    """
+    the ring remembers the last `size` ids in constant memory, older ids are left to Redis
+    """
+    window = UpdateIdWindow(size=64)
+    assert [window.add(update_id) for update_id in (100, 101, 100, 99)] == [True, True, False, True]
+    assert window.add(170) is True
+    # slid past 100 and 101
+    assert window.add(101) is None
+    assert window.add(120) is True and window.add(120) is False
+    assert 120 in window and 121 not in window and 101 not in window
+    window.add(10_000)
+    assert window.add(9_999) is True and window.add(170) is None
+    assert len(window._bits) == 8  # noqa  # pylint: disable=protected-access
+
+
+@pytest.mark.asyncio
+async def test_update_claim(fake_redis_pool):
+    """
+    the application processes an update once across the instances, through the Redis claim
+    """
+    redis = fake_redis_pool.redis
+    metrics.reset()
+    processed = []
+
+    async def _handle(update, context):
+        processed.append(update.update_id)
+
+    applications = []
+    for _ in range(2):
+        application = ApplicationBuilder().token("123:abc").application_class(LazyUpdateApplication).build()
+        application.add_handler(TypeHandler(Update, _handle))
+        application.set_update_claim(partial(UpdateDeduplicator(name="test", window=64, ttl=60).claim, redis))
+        application._initialized = True  # noqa  # initialize() would call getMe
+        applications.append(application)
+    for application, update_id in zip(applications * 2, (1, 1, 2, 2)):
+        await application.process_update(RawUpdate.parse(
+            b'{"update_id": %d, "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}}}'
+            % update_id
+        ))
+    assert processed == [1, 2]
+    assert metrics.get_counter("telegram.updates", bot="test", result="duplicate", source="redis") == 2
+
+
+@pytest.mark.asyncio
+async def test_webhook_marks_an_update_once_queued(monkeypatch):
+    """
+    the webhook drops a redelivered update once it was queued, a shed or failed one is answered
+    with an error and accepted when Telegram delivers it again
+    """
+    queue = PriorityUpdateQueue(name="test_webhook", capacity=1, priority=update_priority)
+    telegram_updates = UpdateDeduplicator(name="test_webhook", window=64, ttl=60)
+    monkeypatch.setattr(telegram_webhook, "application", SimpleNamespace(update_queue=queue))
+    monkeypatch.setattr(telegram_webhook, "telegram_updates", telegram_updates)
+    monkeypatch.setattr(settings, "TELEGRAM_WEBHOOK_SECRET_TOKEN", None)
+    web_application = FastAPI()
+    web_application.include_router(telegram_webhook.router)
+    chat = b'"chat": {"id": -1, "type": "group"}, "date": 0'
+
+    def chatter(update_id):
+        return b'{"update_id": %d, "message": {"message_id": 1, %s, "text": "hi"}}' % (update_id, chat)
+
+    transport = httpx.ASGITransport(app=web_application, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        assert (await client.post("/telegram", content=chatter(1))).status_code == 200
+        assert (await client.post("/telegram", content=chatter(1))).status_code == 200
+        assert queue.qsize() == 1
+        # the queue is full, the chatter is shed
+        assert (await client.post("/telegram", content=chatter(2))).status_code == 503
+        assert not telegram_updates.seen(2)
+        queue.get_nowait()
+        assert (await client.post("/telegram", content=chatter(2))).status_code == 200
+        queue.get_nowait()
+
+        async def broken_put(update):
+            raise RuntimeError("queue broken")
+
+        monkeypatch.setattr(queue, "put", broken_put)
+        assert (await client.post("/telegram", content=chatter(3))).status_code == 500
+        assert not telegram_updates.seen(3)
+    assert telegram_updates.seen(1) and telegram_updates.seen(2)
+
+
+def test_raw_update():
+    """
+    only the id and type of the update are read, anything else is rejected
+    """
+    update = RawUpdate.parse(b'{"update_id": 7, "callback_query": {"id": "1", "data": "CONFIRM_PAY 1 x"}}')
+    assert (update.update_id, update.type) == (7, "callback_query")
+    for body in (b"", b"[]", b'{"message": {}}', b'{"update_id": "7"}'):
+        with pytest.raises(ValueError):
+            RawUpdate.parse(body)
+    assert secret_token_matches(expected=None, received=None) is True
+    assert secret_token_matches(expected="secret", received="secret") is True
+    assert secret_token_matches(expected="secret", received="guess") is False
+    assert secret_token_matches(expected="secret", received=None) is False
+
+
+@pytest.mark.asyncio
+async def test_lazy_update_application():
+    """
+    the Update is built when processed, once the claim accepted the raw update
+    """
+    application = ApplicationBuilder().token("123:abc").application_class(LazyUpdateApplication).build()
+    processed = []
+
+    async def _handle(update, context):
+        processed.append(update)
+
+    async def _claim(update_id):
+        return update_id != 2
+
+    application.add_handler(TypeHandler(Update, _handle))
+    application.set_update_claim(_claim)
+    application._initialized = True  # noqa  # initialize() would call getMe
+    for update_id in (1, 2):
+        await application.process_update(RawUpdate.parse(
+            b'{"update_id": %d, "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}}}'
+            % update_id
+        ))
+    assert [update.update_id for update in processed] == [1]
+    assert isinstance(processed[0], Update) and processed[0].message.chat_id == 1
+
+
+@pytest.mark.asyncio
+async def test_priority_update_queue():
+    """
+    the payment updates are served first, the low ones are shed when the queue is full,
+    the stop signal comes out last and the updates put after it are shed
+    """
+    stop_signal = object()
+    queue = PriorityUpdateQueue(
+        name="test",
+        capacity=3,
+        priority=lambda item: None if item is stop_signal else UpdatePriority[item.split(":")[0]]
+    )
+    metrics.reset()
+    assert [await queue.put(item) for item in ("LOW:1", "FLOW:1", "LOW:2", "LOW:3", "PAYMENT:1")] == [
+        True, True, True, False, True
+    ]
+    # LOW:3 was shed on arrival, PAYMENT:1 took the room of LOW:1
+    assert [queue.get_nowait() for _ in range(3)] == ["PAYMENT:1", "FLOW:1", "LOW:2"]
+    assert metrics.get_counter("telegram.update_queue.updates", queue="test", tier="low", result="shed") == 2
+
+    for item in ("FLOW:2", "FLOW:3", "FLOW:4"):
+        queue.put_nowait(item)
+    put = asyncio.create_task(queue.put("PAYMENT:2"))
+    await asyncio.sleep(0.01)
+    assert not put.done()
+    assert queue.get_nowait() == "FLOW:2"
+    await asyncio.wait_for(put, timeout=1)
+
+    await queue.put(stop_signal)
+    assert await queue.put("PAYMENT:3") is False
+    assert [queue.get_nowait() for _ in range(4)] == ["PAYMENT:2", "FLOW:3", "FLOW:4", stop_signal]
+    assert queue.empty()
+    for _ in range(8):
+        queue.task_done()
+    await asyncio.wait_for(queue.join(), timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_membership_update_survives_chatter():
+    """
+    the membership updates rank above the group chatter, a flood of chatter doesn't shed them
+    """
+    queue = PriorityUpdateQueue(name="test_membership", capacity=3, priority=update_priority)
+    chat = b'"chat": {"id": -1, "type": "group"}, "date": 0'
+
+    def chatter(update_id):
+        return RawUpdate.parse(b'{"update_id": %d, "message": {"message_id": 1, %s, "text": "hi"}}' % (update_id, chat))
+
+    joined = RawUpdate.parse(
+        b'{"update_id": 100, "message": {"message_id": 1, %s, "new_chat_members": [{"id": 7, "is_bot": false, '
+        b'"first_name": "v"}]}}' % chat
+    )
+    added = RawUpdate.parse(b'{"update_id": 101, "my_chat_member": {%s}}' % chat)
+    assert update_priority(chatter(1)) is UpdatePriority.LOW
+    assert update_priority(joined) is update_priority(added) is UpdatePriority.MEMBERSHIP
+
+    for update_id in range(1, 4):
+        await queue.put(chatter(update_id))
+    assert await queue.put(joined) is True
+    assert await queue.put(added) is True
+    for update_id in range(4, 50):
+        await queue.put(chatter(update_id))
+    assert [queue.get_nowait().update_id for _ in range(queue.qsize())] == [100, 101, 3]
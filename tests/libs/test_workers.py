@@ -0,0 +1,256 @@
+"""
+Test workers
+"""
+import asyncio
+
+import pytest
+
+from app.libs.metrics import metrics
+from app.libs.workers import KeyedWorkQueue, StreamOutbox, WriteBehindBuffer
+from tests.fixtures.redis import FakeRedis
+
+
+@pytest.mark.asyncio
+async def test_keyed_work_queue():
+    """
+    jobs of a key run in order, failures are retried, stop drains the queue
+    """
+    queue = KeyedWorkQueue(name="test_workers", workers=2, maxsize=100, max_retries=1, retry_interval=0)
+    done = []
+    attempts = {"flaky": 0}
+
+    def job(key, index):
+        async def run():
+            await asyncio.sleep(0.001 * (5 - index))
+            done.append((key, index))
+        return run
+
+    async def flaky():
+        attempts["flaky"] += 1
+        if attempts["flaky"] == 1:
+            raise ConnectionError("upstream down")
+        done.append(("flaky", 0))
+
+    async def broken():
+        raise ConnectionError("upstream down")
+
+    for index in range(5):
+        for key in ("a", "b", "c"):
+            await queue.submit(key=key, job=job(key, index))
+    await queue.submit(key="a", job=flaky)
+    await queue.submit(key="a", job=broken)
+    assert metrics.snapshot()["gauges"]["test_workers.queue.depth"] > 0
+    await queue.stop()
+
+    for key in ("a", "b", "c"):
+        assert [index for name, index in done if name == key] == list(range(5))
+    assert ("flaky", 0) in done
+    assert attempts["flaky"] == 2
+    assert metrics.get_counter("test_workers.queue.jobs", result="failed") == 1
+    assert metrics.snapshot()["gauges"]["test_workers.queue.depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_write_behind_buffer():
+    """
+    writes are batched by size and window, de-duplicated by key, flushed in order and retried
+    """
+    batches = []
+    failures = [1]
+
+    async def flush(batch):
+        if failures[0]:
+            failures[0] -= 1
+            raise ConnectionError("upstream down")
+        batches.append(batch)
+
+    buffer = WriteBehindBuffer(name="test_write_behind", flush=flush, window=0.01, max_items=3, retry_interval=0)
+    first = buffer.add("accounts", 1, {"name": "a"})
+    buffer.add("accounts", 1, {"name": "b"})
+    buffer.add("groups", 1, {"title": "g"})
+    full = buffer.add("accounts", 2, {"name": "c"})
+    assert full is first
+    late = buffer.add("accounts", 3, {"name": "d"})
+    await asyncio.gather(first, late)
+
+    assert batches == [
+        {"accounts": {1: {"name": "b"}, 2: {"name": "c"}}, "groups": {1: {"title": "g"}}},
+        {"accounts": {3: {"name": "d"}}},
+    ]
+    assert metrics.get_counter("test_write_behind.write_behind.items", result="deduplicated") == 1
+
+    buffer.add("accounts", 4, {})
+    await buffer.aclose()
+    assert batches[-1] == {"accounts": {4: {}}}
+
+
+@pytest.mark.asyncio
+async def test_keyed_work_queue_backpressure():
+    """
+    a full queue rejects instead of waiting, a job failing for good goes to its dead letter
+    """
+    queue = KeyedWorkQueue(
+        name="test_backpressure",
+        workers=1,
+        maxsize=1,
+        max_retries=2,
+        retry_interval=0,
+        should_retry=lambda exc: not isinstance(exc, ValueError)
+    )
+    release = asyncio.Event()
+    dead = []
+    attempts = []
+
+    async def blocked():
+        await release.wait()
+
+    def failing(exc):
+        async def run():
+            attempts.append(exc)
+            raise exc
+        return run
+
+    async def dead_letter(exc):
+        dead.append(exc)
+
+    queue.submit_nowait(key="a", job=blocked)
+    await asyncio.sleep(0)
+    queue.submit_nowait(key="a", job=failing(ConnectionError()), dead_letter=dead_letter)
+    with pytest.raises(asyncio.QueueFull):
+        queue.submit_nowait(key="a", job=blocked)
+    assert metrics.get_counter("test_backpressure.queue.jobs", result="rejected") == 1
+
+    release.set()
+    await queue.submit(key="a", job=failing(ValueError()), dead_letter=dead_letter)
+    await queue.stop()
+    # retried until max_retries, a ValueError isn't retried
+    assert [type(exc) for exc in attempts] == [ConnectionError] * 3 + [ValueError]
+    assert [type(exc) for exc in dead] == [ConnectionError, ValueError]
+    assert metrics.get_counter("test_backpressure.queue.jobs", result="dead_lettered") == 2
+
+
+@pytest.mark.asyncio
+async def test_keyed_work_queue_shares_its_capacity():
+    """
+    the jobs of a single key may use the capacity of all the workers, submit waits for room
+    """
+    queue = KeyedWorkQueue(name="test_shared_capacity", workers=4, maxsize=4)
+    release = asyncio.Event()
+    done = []
+
+    def job(index):
+        async def run():
+            await release.wait()
+            done.append(index)
+        return run
+
+    queue.submit_nowait(key="hot", job=job(0))
+    await asyncio.sleep(0)
+    for index in range(1, 5):
+        queue.submit_nowait(key="hot", job=job(index))
+    with pytest.raises(asyncio.QueueFull):
+        queue.submit_nowait(key="cold", job=job(5))
+
+    waiting = asyncio.create_task(queue.submit(key="hot", job=job(5)))
+    await asyncio.sleep(0)
+    assert not waiting.done()
+    release.set()
+    await waiting
+    await queue.stop()
+    assert done == list(range(6))
+
+
+@pytest.mark.asyncio
+async def test_stream_outbox():
+    """
+    intents are delivered with their idempotency key, retried, dead-lettered, and claimed from a dead consumer
+    """
+    redis = FakeRedis()
+    delivered = []
+    failures = {"flaky": 1}
+
+    async def deliver(action, payload, key):
+        if action == "broken":
+            raise ValueError("rejected")
+        if failures.get(action):
+            failures[action] -= 1
+            raise ConnectionError("upstream down")
+        delivered.append((action, payload, key))
+
+    outbox = StreamOutbox(
+        name="test_outbox",
+        stream="test:outbox",
+        deliver=deliver,
+        workers=2,
+        retry_interval=0,
+        claim_idle=0.05,
+        poll_interval=0.01,
+        should_retry=lambda action, exc: not isinstance(exc, ValueError)
+    )
+    # an entry read by a consumer which died before delivering it
+    await redis.xgroup_create(outbox.stream, outbox.group, id="0", mkstream=True)
+    await outbox.append(redis, action="orphan", payload={}, idempotency_key="orphan-1")
+    await redis.xreadgroup(outbox.group, "dead-consumer", {outbox.stream: ">"})
+
+    assert await outbox.append(redis, action="flaky", payload={"order_id": "1"}, idempotency_key="k1") == "k1"
+    await outbox.append(redis, action="broken", payload={})
+    # an entry missing its fields
+    await redis.xadd(outbox.stream, {"action": "unreadable"})
+    outbox.start(redis)
+    for _ in range(100):
+        if len(delivered) == 2 and not await redis.xlen(outbox.stream) and outbox.depth == 0:
+            break
+        await asyncio.sleep(0.01)
+    await outbox.stop()
+
+    assert sorted(delivered) == [("flaky", {"order_id": "1"}, "k1"), ("orphan", {}, "orphan-1")]
+    dead = {fields["action"]: fields for _, fields in await redis.xrange(outbox.dead_letter_stream)}
+    assert set(dead) == {"broken", "unreadable"} and "rejected" in dead["broken"]["error"]
+    assert "KeyError" in dead["unreadable"]["error"]
+    assert metrics.get_counter("outbox.entries", outbox="test_outbox", result="retried") == 1
+    assert metrics.get_counter("outbox.entries", outbox="test_outbox", result="claimed") == 1
+    assert metrics.get_counter("outbox.entries", outbox="test_outbox", result="dead_lettered") == 2
+    assert metrics.snapshot()["gauges"]["outbox.depth{outbox=test_outbox}"] == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_outbox_keeps_the_entries_it_retries():
+    """
+    a delivery retried for longer than claim_idle isn't claimed and delivered again by another consumer
+    """
+    redis = FakeRedis()
+    delivered = []
+    attempts = []
+
+    async def deliver(action, payload, key):
+        attempts.append(key)
+        if len(attempts) < 4:
+            raise ConnectionError("upstream down")
+        delivered.append(key)
+
+    def outbox(consumer):
+        instance = StreamOutbox(
+            name="test_outbox_keep",
+            stream="test:outbox_keep",
+            deliver=deliver,
+            workers=1,
+            retry_interval=0.02,
+            claim_idle=0.05,
+            poll_interval=0.01
+        )
+        instance.consumer = consumer
+        return instance
+
+    first, second = outbox("first"), outbox("second")
+    await first.append(redis, action="confirm_pay", payload={}, idempotency_key="k1")
+    first.start(redis)
+    await asyncio.sleep(0.02)
+    second.start(redis)
+    for _ in range(100):
+        if delivered and not await redis.xlen(first.stream):
+            break
+        await asyncio.sleep(0.01)
+    await asyncio.gather(first.stop(), second.stop())
+    assert delivered == ["k1"] and attempts == ["k1"] * 4
+    with pytest.raises(ValueError):
+        StreamOutbox(name="test_outbox_keep", stream="test:outbox_keep", deliver=deliver, claim_idle=5, poll_interval=5)
@@ -1,9 +1,14 @@
 """
 Test Exchange Assistant provider
 """
+import asyncio
+from types import SimpleNamespace
+
+import httpx
 import pytest
 
 from app.providers import ExchaigeAssistantProvider
+from app.providers.exchaige_assistant import AccountWriter
 
 
 @pytest.mark.asyncio
@@ -14,3 +19,43 @@ async def test_get_vendors(exchaige_assistant_provider: ExchaigeAssistantProvide
     """
     result = await exchaige_assistant_provider.get_vendors()
     assert result is not None
+
+
+@pytest.mark.asyncio
+async def test_account_writer_falls_back_to_per_item_writes():
+    """
+    only a definitive answer of the bulk endpoint switches to per-item writes, and for a while
+    """
+    calls = []
+
+    class FakeTelegramAccount:
+        """the account endpoints, the bulk one answering `bulk_status`"""
+        bulk_status = 500
+
+        async def bulk_upsert(self, data):
+            calls.append("bulk")
+            request = httpx.Request("POST", "https://example.com/api/v1/telegram_account/bulk")
+            response = httpx.Response(self.bulk_status, request=request)
+            response.raise_for_status()
+
+        async def set_account(self, data):
+            calls.append("account")
+
+    client = SimpleNamespace(telegram_account=FakeTelegramAccount())
+    writer = AccountWriter(client=client, recheck_interval=0.05)
+    batch = {"accounts": {1: {"id": 1}}}
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await writer.flush(batch)
+    assert writer.bulk_supported
+
+    client.telegram_account.bulk_status = 404
+    await writer.flush(batch)
+    await writer.flush(batch)
+    assert calls == ["bulk", "bulk", "account", "account"]
+    assert not writer.bulk_supported
+
+    await asyncio.sleep(0.06)
+    client.telegram_account.bulk_status = 200
+    await writer.flush(batch)
+    assert calls[-1] == "bulk" and writer.bulk_supported
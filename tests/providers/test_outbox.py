@@ -0,0 +1,97 @@
+"""
+Test the ExchaigeAssistant outbox
+"""
+import asyncio
+from uuid import uuid4
+
+import httpx
+import pytest
+
+from app.config import settings
+from app.handlers import TelegramBotMessagesHandler
+from app.libs.consts.enums import PaymentAccountStatus
+from app.libs.http_client import http_client
+from app.providers import exchaige_assistant_outbox
+from tests.fixtures.providers import FakeExchaigeAssistantServer
+
+
+@pytest.mark.asyncio
+async def test_outbox_delivers_intents(fake_redis_pool, monkeypatch):
+    """
+    the callbacks' intents reach ExchaigeAssistant once per idempotency key, a rejected one is dead-lettered
+    """
+    monkeypatch.setattr(exchaige_assistant_outbox, "retry_interval", 0)
+    monkeypatch.setattr(exchaige_assistant_outbox, "poll_interval", 0.01)
+    handler = TelegramBotMessagesHandler(
+        redis=fake_redis_pool,
+        exchaige_assistant_provider=None,
+        vendor_directory=None
+    )
+    order_id = str(uuid4())
+    redis = fake_redis_pool.redis
+
+    async with FakeExchaigeAssistantServer(
+        statuses={"/api/v1/telegram/messages/order_payment_account_status/-100": 422}
+    ) as server:
+        monkeypatch.setattr(settings, "JCN_EXCHAIGE_ASSISTANT_URL", server.url)
+        # the vendor taps the button twice
+        for _ in range(2):
+            await handler.append_intent(
+                action="confirm_pay",
+                idempotency_key=f"confirm_pay:{order_id}",
+                customer_id=1,
+                order_id=order_id
+            )
+        await handler.append_intent(
+            action="payment_account_out_of_stock",
+            idempotency_key=f"payment_account_out_of_stock:{order_id}",
+            group_id=-100,
+            customer_id=1,
+            order_id=order_id,
+            status=PaymentAccountStatus.OUT_OF_STOCK.value
+        )
+        exchaige_assistant_outbox.start(redis)
+        try:
+            for _ in range(200):
+                if len(server.requests) == 3 and not await redis.xlen(exchaige_assistant_outbox.stream):
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await exchaige_assistant_outbox.stop()
+            await http_client.aclose()
+
+    assert server.applied == [
+        (
+            "POST",
+            "/api/v1/telegram/messages/confirm_pay",
+            f"confirm_pay:{order_id}",
+            {"customer_id": 1, "order_id": order_id}
+        )
+    ]
+    # a 422 isn't retried
+    assert len(server.requests) == 3
+    [(_, dead)] = await redis.xrange(exchaige_assistant_outbox.dead_letter_stream)
+    assert dead["action"] == "payment_account_out_of_stock" and "422" in dead["error"]
+
+
+def test_outbox_retries_a_non_idempotent_intent_only_when_not_applied():
+    """
+    confirm_pay and send_payment_account aren't retried after an error the upstream may have applied them before
+    """
+    request = httpx.Request("POST", "http://upstream")
+
+    def status_error(code, headers=None):
+        response = httpx.Response(code, headers=headers, request=request)
+        return httpx.HTTPStatusError("error", request=request, response=response)
+
+    should_retry = exchaige_assistant_outbox.should_retry
+    for action in ("confirm_pay", "send_payment_account"):
+        assert should_retry(action, httpx.ConnectError("refused", request=request))
+        assert should_retry(action, status_error(429))
+        assert should_retry(action, status_error(503, {"Retry-After": "1"}))
+        assert not should_retry(action, httpx.ReadTimeout("timeout", request=request))
+        assert not should_retry(action, status_error(503))
+        assert not should_retry(action, status_error(502))
+    assert should_retry("update_payment_account_status", httpx.ReadTimeout("timeout", request=request))
+    assert should_retry("update_payment_account_status", status_error(502))
+    assert not should_retry("update_payment_account_status", status_error(422))
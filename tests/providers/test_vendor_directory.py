@@ -0,0 +1,88 @@
+"""
+Test VendorDirectory
+"""
+import asyncio
+
+import pytest
+
+from app.libs.consts.enums import BotType, PaymentAccountStatus
+from app.providers import VendorDirectory
+from app.schemas.telegram.account import TelegramChatGroup
+
+
+def vendor(vendor_id: int, **kwargs) -> TelegramChatGroup:
+    """
+    :param vendor_id:
+    :param kwargs:
+    :return:
+    """
+    data = {"id": vendor_id, "title": f"vendor {vendor_id}", "type": "group", "in_group": True, "bot_type": BotType.VENDORS}
+    return TelegramChatGroup(**{**data, **kwargs})
+
+
+class FakeProvider:
+    """Upstream returning a fixed vendor list"""
+
+    def __init__(self, vendors):
+        self.vendors = vendors
+        self.calls = 0
+
+    async def get_vendors(self):
+        self.calls += 1
+        return list(self.vendors)
+
+
+@pytest.mark.asyncio
+async def test_vendor_directory():
+    """
+    loaded once, updated incrementally, reconciled with upstream
+    """
+    provider = FakeProvider([vendor(1, payment_account_status=PaymentAccountStatus.PREPARING)])
+    directory = VendorDirectory(exchaige_assistant_provider=provider)
+
+    assert [v.id for v in await directory.get_vendors()] == [1]
+    assert [v.id for v in await directory.get_vendors()] == [1]
+    assert provider.calls == 1
+
+    directory.upsert(group=vendor(2))
+    directory.upsert(group=vendor(1, title="renamed"))
+    assert directory.get(1).title == "renamed"
+    # a membership update without the status keeps the known one
+    assert directory.get(1).payment_account_status == PaymentAccountStatus.PREPARING
+    directory.update_payment_account_status(vendor_id=1, status=PaymentAccountStatus.OUT_OF_STOCK)
+    assert directory.get(1).payment_account_status == PaymentAccountStatus.OUT_OF_STOCK
+
+    directory.upsert(group=vendor(2, in_group=False))
+    assert directory.get(2) is None
+
+    provider.vendors = [vendor(3)]
+    await directory.reconcile()
+    assert [v.id for v in await directory.get_vendors()] == [3]
+    assert provider.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_vendor_directory_keeps_changes_made_during_reconcile():
+    """
+    the membership updates received while the upstream list is fetched aren't wiped out by it
+    """
+    provider = FakeProvider([vendor(1), vendor(2)])
+    directory = VendorDirectory(exchaige_assistant_provider=provider)
+    await directory.reconcile()
+
+    fetched = asyncio.Event()
+    get_vendors = provider.get_vendors
+
+    async def slow_get_vendors():
+        vendors = await get_vendors()
+        await fetched.wait()
+        return vendors
+
+    provider.get_vendors = slow_get_vendors
+    reconcile = asyncio.create_task(directory.reconcile())
+    await asyncio.sleep(0)
+    directory.upsert(group=vendor(3))
+    directory.remove(2)
+    fetched.set()
+    await reconcile
+    assert [v.id for v in await directory.get_vendors()] == [1, 3]